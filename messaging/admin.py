@@ -1,7 +1,8 @@
 from django.contrib import admin, messages
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from .models import Subscriber, Message
-from .tasks import queue_message_sending # Importaremos la tarea de Celery
+from .models import Delivery, Subscriber, SubscriberImport, Message
+from .tasks import import_subscribers, queue_message_sending # Importaremos la tarea de Celery
 
 @admin.register(Subscriber)
 class SubscriberAdmin(admin.ModelAdmin):
@@ -22,13 +23,13 @@ class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'subject_display', 'status', 'created_at', 'scheduled_at')
     list_filter = ('status', 'created_at', 'scheduled_at')
     search_fields = ('subject', 'body_text', 'body_html')
-    readonly_fields = ('created_at', 'updated_at', 'status', 'sent_to_report')
+    readonly_fields = ('created_at', 'updated_at', 'status', 'sent_to_report', 'delivery_report_display')
     fieldsets = (
         (None, {
             'fields': ('subject', 'body_html', 'body_text')
         }),
         (_('Scheduling and Status'), {
-            'fields': ('scheduled_at', 'status', 'sent_to_report'),
+            'fields': ('scheduled_at', 'status', 'sent_to_report', 'delivery_report_display'),
         }),
     )
     actions = ['send_selected_messages']
@@ -37,15 +38,31 @@ class MessageAdmin(admin.ModelAdmin):
          return obj.subject or _("Message {id} (No Subject)").format(id=obj.pk)
     subject_display.short_description = _('Subject / ID')
 
+    def delivery_report_display(self, obj):
+        # Una línea por canal: "email: sent=120, failed=3"
+        report = obj.delivery_report()
+        return "\n".join(
+            f"{channel}: " + ", ".join(f"{status}={count}" for status, count in sorted(counts.items()))
+            for channel, counts in sorted(report.items())
+        ) or "-"
+    delivery_report_display.short_description = _('Delivery Report')
+
 
     @admin.action(description=_('Queue selected messages for sending'))
     def send_selected_messages(self, request, queryset):
         """Admin action to queue messages for sending via Celery."""
         queued_count = 0
+        scheduled_count = 0
         already_processed_count = 0
 
         for message in queryset:
             if message.status in ['draft', 'failed']: # Solo enviar borradores o fallidos
+                if message.scheduled_at and message.scheduled_at > timezone.now():
+                    # Programado: lo encolará dispatch_scheduled_messages a su hora
+                    message.status = 'scheduled'
+                    message.save(update_fields=['status', 'updated_at'])
+                    scheduled_count += 1
+                    continue
                 # Marcar como encolado y guardar inmediatamente
                 message.status = 'queued'
                 message.save(update_fields=['status', 'updated_at'])
@@ -57,5 +74,29 @@ class MessageAdmin(admin.ModelAdmin):
 
         if queued_count:
             self.message_user(request, _('%(count)d message(s) have been queued for sending.') % {'count': queued_count}, messages.SUCCESS)
+        if scheduled_count:
+            self.message_user(request, _('%(count)d message(s) have been scheduled and will be sent at their scheduled time.') % {'count': scheduled_count}, messages.SUCCESS)
         if already_processed_count:
-             self.message_user(request, _('%(count)d message(s) were already queued, sending, or sent and were skipped.') % {'count': already_processed_count}, messages.WARNING)
\ No newline at end of file
+             self.message_user(request, _('%(count)d message(s) were already scheduled, queued, sending, or sent and were skipped.') % {'count': already_processed_count}, messages.WARNING)
+
+
+@admin.register(Delivery)
+class DeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'message', 'subscriber', 'channel', 'status', 'attempts', 'error_code', 'updated_at')
+    list_filter = ('channel', 'status')
+    search_fields = ('provider_id', 'error_code')
+    raw_id_fields = ('message', 'subscriber') # Evitar cargar selects con millones de filas
+    list_select_related = ('message', 'subscriber')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(SubscriberImport)
+class SubscriberImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'format', 'status', 'processed_rows', 'imported_rows', 'duplicate_rows', 'failed_rows', 'created_at', 'finished_at')
+    list_filter = ('status', 'format')
+    readonly_fields = ('status', 'processed_rows', 'imported_rows', 'duplicate_rows', 'failed_rows', 'error_file', 'error', 'created_at', 'updated_at', 'finished_at')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change: # Fichero recién subido: procesarlo en segundo plano
+            import_subscribers.delay(obj.id)
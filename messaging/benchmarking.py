@@ -0,0 +1,214 @@
+"""Utilidades para los benchmarks de envío (comandos `bench_*`): proveedores falsos locales y medición de tareas."""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import httplib2
+from celery.signals import task_postrun, task_prerun
+from googleapiclient.errors import HttpError
+
+from . import services
+
+
+class _FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, como la API real
+    wbufsize = 64 * 1024 # Cabeceras y cuerpo en un solo write (evita esperas de Nagle/ACK retardado)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            server.request_count += 1
+        if server.error_rate and random.random() < server.error_rate:
+            status, payload = 429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429}
+        else:
+            status, payload = 201, {'sid': f"SM{uuid.uuid4().hex}", 'status': 'queued'}
+
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Sin ruido en la salida del benchmark
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # Aceptar cientos de conexiones simultáneas
+
+
+class FakeTwilioServer:
+    """
+    Servidor HTTP local que imita `POST /2010-04-01/Accounts/{sid}/Messages.json`
+    con latencia y tasa de error configurables. Uso:
+
+        with FakeTwilioServer(latency=0.05) as server:
+            with override_settings(TWILIO_API_BASE_URL=server.base_url): ...
+    """
+
+    def __init__(self, latency=0.05, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        return self._httpd.request_count
+
+    def __enter__(self):
+        self._httpd = _FakeHTTPServer(('127.0.0.1', 0), _FakeTwilioHandler)
+        self._httpd.latency = self.latency
+        self._httpd.error_rate = self.error_rate
+        self._httpd.request_count = 0
+        self._httpd.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+
+class _FakeGmailRequest:
+    def __init__(self, service):
+        self._service = service
+
+    def execute(self):
+        self._service._wait()
+        return self._service._response()
+
+
+class _FakeGmailBatch:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._request_ids = []
+
+    def add(self, request, request_id):
+        self._request_ids.append(request_id)
+
+    def execute(self):
+        self._service._wait() # Una sola petición HTTP para todo el lote, como la API real
+        for request_id in self._request_ids:
+            try:
+                response, exception = self._service._response(), None
+            except HttpError as e:
+                response, exception = None, e
+            self._callback(request_id, response, exception)
+
+
+class FakeGmailService:
+    """
+    Sustituto en memoria del servicio Gmail (`users().messages().send()` y peticiones
+    batch) con latencia por petición HTTP y tasa de error configurables. Uso:
+
+        with fake_gmail_service(FakeGmailService(latency=0.05)): ...
+    """
+
+    def __init__(self, latency=0.05, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0 # Peticiones HTTP (un lote cuenta como una)
+        self.message_count = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _response(self):
+        with self._lock:
+            self.message_count += 1
+        if self.error_rate and random.random() < self.error_rate:
+            raise HttpError(httplib2.Response({'status': 429, 'reason': 'Too Many Requests'}), b'rateLimitExceeded')
+        return {'id': uuid.uuid4().hex[:16]}
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        return _FakeGmailRequest(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeGmailBatch(self, callback)
+
+
+@contextmanager
+def fake_gmail_service(service):
+    """Hace que los envíos de email de este proceso usen `service` en lugar de la API de Gmail."""
+    with mock.patch.object(services, '_get_gmail_service', return_value=service):
+        yield service
+
+
+class TaskTimer:
+    """
+    Tiempo propio de cada ejecución de tarea Celery del proceso, por nombre de tarea.
+    En modo eager las tareas se anidan (el fan-out ejecuta los lotes dentro de su llamada):
+    a cada tarea se le descuenta el tiempo de las que ejecutó dentro.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self._local = threading.local()
+
+    def _on_prerun(self, task_id=None, task=None, **kwargs):
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append([time.perf_counter(), 0.0])
+
+    def _on_postrun(self, task_id=None, task=None, **kwargs):
+        stack = getattr(self._local, 'stack', None)
+        if not stack:
+            return
+        start, nested = stack.pop()
+        elapsed = time.perf_counter() - start
+        if stack:
+            stack[-1][1] += elapsed
+        self.durations[task.name.rsplit('.', 1)[-1]].append(elapsed - nested)
+
+    def __enter__(self):
+        task_prerun.connect(self._on_prerun, weak=False)
+        task_postrun.connect(self._on_postrun, weak=False)
+        return self
+
+    def __exit__(self, *exc_info):
+        task_prerun.disconnect(self._on_prerun)
+        task_postrun.disconnect(self._on_postrun)
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    """Percentiles (rango más cercano), máximo y número de muestras de `values`."""
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0}
+    summary = {'count': len(ordered)}
+    for point in points:
+        summary[f'p{point}'] = ordered[max(0, math.ceil(point / 100 * len(ordered)) - 1)]
+    summary['max'] = ordered[-1]
+    return summary
@@ -0,0 +1,258 @@
+"""
+Circuit breaker compartido por todo el clúster, con un circuito por proveedor (gmail,
+twilio) y cuenta emisora. Igual que el limitador de tasa, el estado vive en Redis y se
+actualiza con scripts Lua atómicos; con MESSAGING_CIRCUIT_BREAKER_BACKEND='memory'
+(tests, desarrollo) o si Redis no responde se usa un circuito en memoria del proceso.
+
+- closed: las llamadas pasan. MESSAGING_CIRCUIT_FAILURE_THRESHOLD fallos del proveedor
+  (5xx, 429, red) en MESSAGING_CIRCUIT_FAILURE_WINDOW segundos, sin un éxito entre
+  medias, abren el circuito.
+- open: las llamadas se rechazan sin tocar la red durante MESSAGING_CIRCUIT_OPEN_SECONDS
+  (el doble cada vez que vuelve a abrirse, hasta MESSAGING_CIRCUIT_OPEN_MAX).
+- half_open: pasado ese tiempo, una única llamada de prueba pasa; si funciona el
+  circuito se cierra, si falla se vuelve a abrir. Si la prueba no llega al proveedor
+  (error local, límite de tasa) se libera con `release` y la siguiente llamada es la
+  nueva prueba; si no informa de nada en MESSAGING_CIRCUIT_PROBE_TIMEOUT segundos
+  (worker caído), se concede otra.
+
+Con el circuito cerrado y sin fallos recientes, cada llamada cuesta una lectura (HMGET);
+los éxitos solo se escriben si había fallos pendientes o era la llamada de prueba.
+"""
+import logging
+import os
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Estados devueltos por `check`: se permite la llamada (closed, failing, probe) o se
+# rechaza (open, half_open con otra prueba en curso)
+CLOSED = 'closed'
+FAILING = 'failing' # Cerrado, pero con fallos recientes: informar también de los éxitos
+PROBE = 'probe' # Semiabierto: esta llamada es la prueba
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_CHECK_SCRIPT = """
+local probe_timeout = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'state', 'failures', 'open_until', 'probe_until')
+local state = data[1] or 'closed'
+if state == 'closed' then
+    if tonumber(data[2] or '0') > 0 then
+        return {'failing', '0'}
+    end
+    return {'closed', '0'}
+end
+if state == 'open' then
+    local open_until = tonumber(data[3])
+    if now < open_until then
+        return {'open', tostring(open_until - now)}
+    end
+else
+    local probe_until = tonumber(data[4])
+    if now < probe_until then
+        return {'half_open', tostring(probe_until - now)}
+    end
+end
+redis.call('HSET', KEYS[1], 'state', 'half_open', 'probe_until', tostring(now + probe_timeout))
+return {'probe', '0'}
+"""
+
+_RECORD_SCRIPT = """
+local ok = ARGV[1] == '1'
+local threshold = tonumber(ARGV[2])
+local window = tonumber(ARGV[3])
+local open_seconds = tonumber(ARGV[4])
+local open_max = tonumber(ARGV[5])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'state', 'failures', 'window_start', 'opens')
+local state = data[1] or 'closed'
+if ok then
+    redis.call('DEL', KEYS[1])
+    if state ~= 'closed' then
+        return 'closed'
+    end
+    return ''
+end
+if state == 'open' then
+    return ''
+end
+local opens = tonumber(data[4] or '0')
+if state == 'closed' then
+    local failures = tonumber(data[2] or '0')
+    local window_start = tonumber(data[3] or tostring(now))
+    if now - window_start > window then
+        failures = 0
+        window_start = now
+    end
+    failures = failures + 1
+    if failures < threshold then
+        redis.call('HSET', KEYS[1], 'failures', failures, 'window_start', tostring(window_start))
+        redis.call('EXPIRE', KEYS[1], math.ceil(window) + 60)
+        return ''
+    end
+end
+local duration = math.min(open_seconds * 2 ^ opens, open_max)
+redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', tostring(now + duration), 'opens', opens + 1, 'failures', 0)
+redis.call('EXPIRE', KEYS[1], math.ceil(duration) + 3600)
+return 'open'
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') == 'half_open' then
+    redis.call('HSET', KEYS[1], 'probe_until', '0')
+end
+return ''
+"""
+
+
+class MemoryCircuitStore:
+    """Circuitos en memoria del proceso; misma semántica que los scripts Lua."""
+
+    def __init__(self):
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def check(self, key, probe_timeout):
+        now = time.time()
+        with self._lock:
+            data = self._circuits.get(key, {})
+            state = data.get('state', CLOSED)
+            if state == CLOSED:
+                return (FAILING if data.get('failures') else CLOSED), 0.0
+            if state == OPEN and now < data['open_until']:
+                return OPEN, data['open_until'] - now
+            if state == HALF_OPEN and now < data['probe_until']:
+                return HALF_OPEN, data['probe_until'] - now
+            data.update(state=HALF_OPEN, probe_until=now + probe_timeout)
+            return PROBE, 0.0
+
+    def record(self, key, ok, threshold, window, open_seconds, open_max):
+        now = time.time()
+        with self._lock:
+            data = self._circuits.get(key, {})
+            state = data.get('state', CLOSED)
+            if ok:
+                self._circuits.pop(key, None)
+                return CLOSED if state != CLOSED else ''
+            if state == OPEN:
+                return ''
+            if state == CLOSED:
+                failures, window_start = data.get('failures', 0), data.get('window_start', now)
+                if now - window_start > window:
+                    failures, window_start = 0, now
+                failures += 1
+                if failures < threshold:
+                    self._circuits[key] = {'failures': failures, 'window_start': window_start}
+                    return ''
+            opens = data.get('opens', 0)
+            duration = min(open_seconds * 2 ** opens, open_max)
+            self._circuits[key] = {'state': OPEN, 'open_until': now + duration, 'opens': opens + 1}
+            return OPEN
+
+    def release(self, key):
+        with self._lock:
+            data = self._circuits.get(key, {})
+            if data.get('state') == HALF_OPEN:
+                data['probe_until'] = 0.0
+
+
+class RedisCircuitStore:
+    """Circuitos en hashes de Redis compartidos por todos los workers."""
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self._check = self._client.register_script(_CHECK_SCRIPT)
+        self._record = self._client.register_script(_RECORD_SCRIPT)
+        self._release = self._client.register_script(_RELEASE_SCRIPT)
+
+    def check(self, key, probe_timeout):
+        state, wait = self._check(keys=[key], args=[probe_timeout])
+        return state.decode(), float(wait)
+
+    def record(self, key, ok, threshold, window, open_seconds, open_max):
+        return self._record(keys=[key], args=[int(ok), threshold, window, open_seconds, open_max]).decode()
+
+    def release(self, key):
+        self._release(keys=[key])
+
+
+_backend_lock = threading.Lock()
+_backend = {'pid': None, 'store': None, 'fallback': None, 'warned': False}
+
+
+def _get_stores():
+    """Devuelve (almacén principal, almacén de respaldo en memoria) del proceso actual."""
+    pid = os.getpid()
+    if _backend['pid'] != pid:
+        with _backend_lock:
+            if _backend['pid'] != pid:
+                fallback = MemoryCircuitStore()
+                if settings.MESSAGING_CIRCUIT_BREAKER_BACKEND == 'redis':
+                    store = RedisCircuitStore(settings.MESSAGING_CIRCUIT_BREAKER_REDIS_URL)
+                else:
+                    store = fallback
+                _backend.update(pid=pid, store=store, fallback=fallback, warned=False)
+    return _backend['store'], _backend['fallback']
+
+
+def _call(method, *args):
+    store, fallback = _get_stores()
+    try:
+        return getattr(store, method)(*args)
+    except redis.RedisError as e:
+        if not _backend['warned']:
+            logger.error(f"Circuit breaker Redis unavailable, falling back to per-process circuits: {e}")
+            _backend['warned'] = True
+        return getattr(fallback, method)(*args)
+
+
+def _key(provider, account):
+    return f"messaging:circuit:{provider}:{account or 'default'}"
+
+
+def check(provider, account):
+    """
+    Estado del circuito para una llamada a `provider` con la cuenta `account` y segundos
+    que faltan para poder llamar (0 si la llamada puede hacerse). Con PROBE o FAILING el
+    llamador debe informar del resultado con `record`, también si tiene éxito.
+    """
+    if settings.MESSAGING_CIRCUIT_BREAKER_BACKEND == 'off':
+        return CLOSED, 0.0
+    state, wait = _call('check', _key(provider, account), settings.MESSAGING_CIRCUIT_PROBE_TIMEOUT)
+    if state == PROBE:
+        logger.warning(f"Circuit for {provider}:{account} half-open, sending a probe request.")
+        metrics.record_circuit_transition(provider, HALF_OPEN)
+    return state, wait
+
+
+def record(provider, account, ok):
+    """Registra el resultado de una llamada al proveedor (`ok`: el proveedor respondió)."""
+    if settings.MESSAGING_CIRCUIT_BREAKER_BACKEND == 'off':
+        return
+    transition = _call(
+        'record', _key(provider, account), ok,
+        settings.MESSAGING_CIRCUIT_FAILURE_THRESHOLD, settings.MESSAGING_CIRCUIT_FAILURE_WINDOW,
+        settings.MESSAGING_CIRCUIT_OPEN_SECONDS, settings.MESSAGING_CIRCUIT_OPEN_MAX,
+    )
+    if transition == OPEN:
+        logger.error(f"Circuit for {provider}:{account} opened: provider failing, deferring sends.")
+    elif transition == CLOSED:
+        logger.info(f"Circuit for {provider}:{account} closed: provider recovered.")
+    if transition:
+        metrics.record_circuit_transition(provider, transition)
+
+
+def release(provider, account):
+    """Libera la llamada de prueba (PROBE) que no llegó al proveedor para que otra la repita."""
+    if settings.MESSAGING_CIRCUIT_BREAKER_BACKEND == 'off':
+        return
+    _call('release', _key(provider, account))
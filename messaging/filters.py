@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+_TRUE_VALUES = {'1', 'true', 'yes'}
+_FALSE_VALUES = {'0', 'false', 'no'}
+
+
+def _parse_bool(name, value):
+    value = value.strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    raise ValidationError({name: _("Must be 'true' or 'false'.")})
+
+
+def _parse_datetime(name, value):
+    """Fecha y hora ISO 8601 (o solo fecha, a medianoche) con zona horaria."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValidationError({name: _("Must be an ISO 8601 date or datetime.")})
+        parsed = datetime(date.year, date.month, date.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class SubscriberFilterBackend(BaseFilterBackend):
+    """
+    Filtros de suscriptores por parámetros de consulta, los mismos que el listado del admin:
+    `is_active`, `subscribed_to_email`, `subscribed_to_sms`, `subscribed_to_whatsapp`
+    (true/false) y rango de `created_at` con `created_after` / `created_before` (ISO 8601).
+    """
+    boolean_fields = ('is_active', 'subscribed_to_email', 'subscribed_to_sms', 'subscribed_to_whatsapp')
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {}
+        for field in self.boolean_fields:
+            if params.get(field):
+                filters[field] = _parse_bool(field, params[field])
+        if params.get('created_after'):
+            filters['created_at__gte'] = _parse_datetime('created_after', params['created_after'])
+        if params.get('created_before'):
+            filters['created_at__lt'] = _parse_datetime('created_before', params['created_before'])
+        return queryset.filter(**filters) if filters else queryset
+
+
+class MessageFilterBackend(BaseFilterBackend):
+    """Filtro de mensajes por `status` (uno o varios separados por comas)."""
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get('status')
+        if not value:
+            return queryset
+        statuses = [status.strip() for status in value.split(',') if status.strip()]
+        valid = {choice for choice, _label in queryset.model.STATUS_CHOICES}
+        invalid = [status for status in statuses if status not in valid]
+        if invalid:
+            raise ValidationError({'status': _("Unknown status: %(statuses)s.") % {'statuses': ', '.join(invalid)}})
+        return queryset.filter(status__in=statuses)
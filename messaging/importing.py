@@ -0,0 +1,262 @@
+"""
+Importación masiva de suscriptores desde ficheros CSV o NDJSON.
+
+El fichero se lee en streaming desde el almacenamiento (nunca entero en memoria) y se
+procesa en lotes de MESSAGING_IMPORT_BATCH_SIZE filas: la validación se hace columna a
+columna sobre el lote, sin instanciar un Subscriber por fila ni llamar a clean(), y las
+filas válidas se insertan o actualizan con `bulk_create(update_conflicts=True)` sobre el
+campo único de contacto de cada fila. Las filas rechazadas se escriben en un CSV de
+errores (línea, error, contenido original) que queda en `SubscriberImport.error_file`.
+"""
+import csv
+import io
+import json
+import logging
+import tempfile
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Subscriber, SubscriberImport
+
+logger = logging.getLogger(__name__)
+
+# Campos de contacto, en orden de prioridad para elegir la clave del upsert de cada fila
+CONTACT_FIELDS = ('email', 'phone_number', 'whatsapp_number')
+FLAG_FIELDS = ('subscribed_to_email', 'subscribed_to_sms', 'subscribed_to_whatsapp', 'is_active')
+IMPORT_FIELDS = CONTACT_FIELDS + FLAG_FIELDS
+# Campo de contacto que exige cada suscripción (mismas reglas que Subscriber.clean)
+SUBSCRIPTION_CONTACTS = {
+    'subscribed_to_email': 'email',
+    'subscribed_to_sms': 'phone_number',
+    'subscribed_to_whatsapp': 'whatsapp_number',
+}
+
+_TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'si', 'sí', 'x'}
+_FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+
+
+def guess_format(filename):
+    """Formato de importación a partir de la extensión del fichero, o None."""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def _read_rows(fileobj, file_format):
+    """Genera (línea, fila) leyendo el fichero binario en streaming. Una línea NDJSON inválida se devuelve como texto."""
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = line.rstrip('\r\n')
+        yield line_num, row
+
+
+def _text(value):
+    """Texto sin espacios, o None si está vacío."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _flag(value):
+    """Booleano a partir de JSON o de texto CSV; ValueError si no se reconoce."""
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+def _email_error(value):
+    try:
+        validate_email(value)
+    except ValidationError:
+        return "Invalid email address."
+    return None
+
+
+def _validate_batch(batch):
+    """
+    Valida un lote de filas columna a columna. Devuelve (registros, errores): los registros
+    son (línea, {campo: valor}) con solo los campos que la fila trae con valor, para no pisar
+    en los suscriptores existentes lo que el fichero deja vacío; los errores son
+    (línea, fila original, mensaje).
+    """
+    rows = [row if isinstance(row, dict) else None for _, row in batch]
+    errors = [None if row is not None else "Invalid JSON object." for row in rows]
+
+    columns = {}
+    for field in CONTACT_FIELDS:
+        columns[field] = [_text(row.get(field)) if row is not None else None for row in rows]
+    for field in FLAG_FIELDS:
+        values = []
+        for index, row in enumerate(rows):
+            if row is None or _text(row.get(field)) is None:
+                values.append(None) # Celda vacía: se conserva el valor actual (o el por defecto)
+                continue
+            try:
+                values.append(_flag(row[field]))
+            except ValueError:
+                values.append(None)
+                errors[index] = errors[index] or f"Invalid boolean value for {field}."
+        columns[field] = values
+
+    # Formato y longitud de los campos de contacto
+    checks = {
+        'email': _email_error,
+        'phone_number': lambda v: "Phone number is too long." if len(v) > 20 else None,
+        'whatsapp_number': lambda v: (
+            "WhatsApp number is too long." if len(v) > 30
+            else None if v.startswith('whatsapp:+')
+            else "WhatsApp number must start with 'whatsapp:+' followed by the country code and number."
+        ),
+    }
+    for field, check in checks.items():
+        for index, value in enumerate(columns[field]):
+            if value is not None and errors[index] is None:
+                errors[index] = check(value)
+
+    # Reglas de Subscriber.clean: cada suscripción necesita su contacto
+    has_contact = [any(columns[field][i] for field in CONTACT_FIELDS) for i in range(len(rows))]
+    for index in range(len(rows)):
+        if errors[index] is None and not has_contact[index]:
+            errors[index] = "Row has no contact method (email, phone_number or whatsapp_number)."
+    for flag, contact in SUBSCRIPTION_CONTACTS.items():
+        for index, subscribed in enumerate(columns[flag]):
+            if subscribed and errors[index] is None and not columns[contact][index]:
+                errors[index] = f"{contact} is required for {flag}."
+
+    records = []
+    rejected = []
+    for index, (line, raw) in enumerate(batch):
+        if errors[index]:
+            rejected.append((line, raw, errors[index]))
+            continue
+        # Solo los campos con valor: una celda vacía no pisa lo que ya tenga el suscriptor
+        records.append((line, {
+            field: columns[field][index] for field in IMPORT_FIELDS if columns[field][index] is not None
+        }))
+    return records, rejected
+
+
+def _conflict_key(values):
+    """Campo de contacto que identifica la fila en el upsert (el primero presente) y su valor."""
+    target = next(field for field in CONTACT_FIELDS if values.get(field))
+    return target, values[target]
+
+
+def _merge_duplicates(records):
+    """
+    Une los registros de un lote con la misma clave de conflicto (p. ej. un email repetido):
+    la fila posterior gana en los campos que trae, igual que si se aplicaran en orden. Un
+    INSERT ... ON CONFLICT DO UPDATE no puede tocar la misma fila dos veces (PostgreSQL lo
+    rechaza) y cada suscriptor debe contar una sola vez. Devuelve (registros, repetidas).
+    """
+    merged = {}
+    for line, values in records:
+        key = _conflict_key(values)
+        if key in merged:
+            values = {**merged[key][1], **values}
+        merged[key] = (line, values)
+    return list(merged.values()), len(records) - len(merged)
+
+
+def _upsert(records):
+    """
+    Inserta o actualiza los registros válidos de un lote, sin claves repetidas (ver
+    `_merge_duplicates`). Se agrupan por clave de conflicto (primer contacto presente) y
+    columnas, con un INSERT ... ON CONFLICT DO UPDATE por grupo. Si un grupo choca con otro
+    campo único (p. ej. un teléfono que ya usa otro suscriptor), se repite fila a fila para
+    aislar las culpables. Devuelve las filas rechazadas.
+    """
+    groups = {}
+    for line, values in records:
+        target, _ = _conflict_key(values)
+        groups.setdefault((target, tuple(values)), []).append((line, values))
+
+    errors = []
+    for (target, fields), rows in groups.items():
+        update_fields = [field for field in fields if field != target] + ['updated_at']
+        options = {'update_conflicts': True, 'unique_fields': [target], 'update_fields': update_fields}
+        try:
+            with transaction.atomic():
+                Subscriber.objects.bulk_create([Subscriber(**values) for _, values in rows], **options)
+            continue
+        except IntegrityError:
+            pass
+        for line, values in rows:
+            try:
+                with transaction.atomic():
+                    Subscriber.objects.bulk_create([Subscriber(**values)], **options)
+            except IntegrityError as e:
+                errors.append((line, values, f"Conflicts with an existing subscriber: {e}"[:255]))
+    return errors
+
+
+def run_import(import_id):
+    """Procesa una importación completa, actualizando sus contadores de progreso tras cada lote."""
+    # Reclamar la importación: una tarea entregada dos veces no la procesa de nuevo
+    if not SubscriberImport.objects.filter(pk=import_id, status='pending').update(status='running', updated_at=timezone.now()):
+        logger.info(f"Subscriber import {import_id} is not pending. Skipping.")
+        return
+    job = SubscriberImport.objects.get(pk=import_id)
+
+    batch_size = settings.MESSAGING_IMPORT_BATCH_SIZE
+    processed = imported = failed = duplicates = 0
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='') as error_fh:
+        writer = csv.writer(error_fh)
+        writer.writerow(['line', 'error', 'row'])
+        with job.file.open('rb') as fh:
+            rows = _read_rows(fh.file, job.format)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                records, rejected = _validate_batch(batch)
+                records, repeated = _merge_duplicates(records)
+                conflicts = _upsert(records)
+                for line, raw, error in rejected + conflicts:
+                    raw = raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False, default=str)
+                    writer.writerow([line, error, raw])
+                processed += len(batch)
+                imported += len(records) - len(conflicts)
+                failed += len(rejected) + len(conflicts)
+                duplicates += repeated
+                SubscriberImport.objects.filter(pk=import_id).update(
+                    processed_rows=processed, imported_rows=imported, failed_rows=failed,
+                    duplicate_rows=duplicates, updated_at=timezone.now(),
+                )
+
+        job.refresh_from_db()
+        if failed:
+            error_fh.seek(0)
+            job.error_file.save(f"subscriber_import_{import_id}_errors.csv", File(error_fh), save=False)
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error_file', 'finished_at', 'updated_at'])
+    logger.info(
+        f"Subscriber import {import_id} finished: {imported} imported, {duplicates} merged duplicate(s), "
+        f"{failed} failed of {processed} row(s)."
+    )
@@ -0,0 +1,92 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from messaging.models import Subscriber
+from messaging.tasks import _audience_queryset
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el recorrido completo de la audiencia de queue_message_sending (paginación por clave) "
+        "sobre una base de datos de pruebas desechable, sin y con el índice parcial subscriber_audience_idx."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1_000_000, help="Número de suscriptores a generar.")
+        parser.add_argument(
+            '--audience-ratio', type=float, default=0.2,
+            help="Fracción de suscriptores activos y suscritos a algún canal.",
+        )
+        parser.add_argument('--page-size', type=int, default=settings.MESSAGING_AUDIENCE_PAGE_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._seed(options['count'], options['audience_ratio'], random.Random(options['seed']))
+            index = next(i for i in Subscriber._meta.indexes if i.name == 'subscriber_audience_idx')
+
+            with connection.schema_editor() as editor:
+                editor.remove_index(Subscriber, index)
+            self._analyze()
+            before, rows = self._scan(options['page_size'])
+            self._report("sin índice", before, rows)
+
+            with connection.schema_editor() as editor:
+                editor.add_index(Subscriber, index)
+            self._analyze()
+            after, rows = self._scan(options['page_size'])
+            self._report("con índice", after, rows)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: x{before / after:.1f}"))
+
+    def _seed(self, count, ratio, rng):
+        self.stdout.write(f"Generando {count} suscriptores ({ratio:.0%} en la audiencia)...")
+        batch = []
+        for i in range(count):
+            in_audience = rng.random() < ratio
+            channel = rng.randrange(3)
+            batch.append(Subscriber(
+                email=f"user{i}@example.com",
+                phone_number=f"+1555{i:07d}",
+                whatsapp_number=f"whatsapp:+1555{i:07d}",
+                # Fuera de la audiencia: dados de baja o sin ningún canal
+                is_active=in_audience or rng.random() < 0.5,
+                subscribed_to_email=in_audience and channel == 0,
+                subscribed_to_sms=in_audience and channel == 1,
+                subscribed_to_whatsapp=in_audience and channel == 2,
+            ))
+            if len(batch) == 10_000:
+                Subscriber.objects.bulk_create(batch)
+                batch = []
+        Subscriber.objects.bulk_create(batch)
+
+    def _analyze(self):
+        # Estadísticas actualizadas para que el planificador pueda elegir el índice
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Subscriber._meta.db_table}")
+
+    def _scan(self, page_size):
+        """Misma secuencia de consultas que _dispatch_audience, sin publicar tareas."""
+        audience = _audience_queryset()
+        cursor, rows = 0, 0
+        start = time.perf_counter()
+        while True:
+            page = list(audience.filter(id__gt=cursor)[:page_size])
+            if not page:
+                break
+            rows += len(page)
+            cursor = page[-1][0]
+        return time.perf_counter() - start, rows
+
+    def _report(self, label, elapsed, rows):
+        plan = _audience_queryset().filter(id__gt=0)[:1].explain()
+        self.stdout.write(f"{label}: {rows} filas en {elapsed:.2f}s")
+        self.stdout.write(f"  plan: {plan}")
@@ -0,0 +1,39 @@
+import base64
+import time
+
+from django.core.management.base import BaseCommand
+
+from messaging.services import _build_raw_email, _get_mime_template, _render_mime
+
+
+class Command(BaseCommand):
+    help = "Compara construir el correo MIME por destinatario con la plantilla MIME por campaña de send_email_batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help="Número de destinatarios.")
+        parser.add_argument('--size-kb', type=int, default=100, help="Tamaño aproximado del cuerpo HTML en KB.")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        paragraph = "<p>Newsletter de prueba con acentos: canción, año, pingüino.</p>\n"
+        body_html = paragraph * (options['size_kb'] * 1024 // len(paragraph.encode()) + 1)
+        body_text = "Newsletter de prueba con acentos: canción, año, pingüino.\n" * 50
+        sender, subject = 'newsletter@example.com', "Benchmark MIME"
+        recipients = [f"user{i}@example.com" for i in range(count)]
+
+        start = time.perf_counter()
+        for to_email in recipients:
+            base64.urlsafe_b64encode(_render_mime(sender, subject, body_html, body_text, to_email)).decode()
+        per_recipient = time.perf_counter() - start
+
+        _get_mime_template.cache_clear() # Incluir en la medición la construcción de la plantilla
+        start = time.perf_counter()
+        for to_email in recipients:
+            _build_raw_email(to_email, sender, subject, body_html, body_text)
+        template = time.perf_counter() - start
+
+        size_kb = len(body_html.encode()) / 1024
+        self.stdout.write(f"HTML body: {size_kb:.0f} KB, {count} recipients")
+        self.stdout.write(f"per-recipient MIME build: {per_recipient:.2f}s ({per_recipient / count * 1e6:.0f} us/email)")
+        self.stdout.write(f"campaign MIME template  : {template:.2f}s ({template / count * 1e6:.0f} us/email)")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: x{per_recipient / template:.1f}"))
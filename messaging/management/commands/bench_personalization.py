@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+
+from messaging.personalization import compile_template, unsubscribe_url
+from messaging.services import _build_raw_email, _get_mime_template
+
+
+class Command(BaseCommand):
+    help = "Mide el coste por destinatario de personalizar los cuerpos (plantilla compilada frente a plantilla Django y cuerpo estático)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help="Número de destinatarios.")
+        parser.add_argument('--size-kb', type=int, default=10, help="Tamaño aproximado del cuerpo HTML en KB.")
+
+    def _time(self, label, count, func):
+        start = time.perf_counter()
+        for index in range(count):
+            func(index)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{label}: {elapsed:.2f}s ({elapsed / count * 1e6:.1f} us/recipient)")
+        return elapsed
+
+    def handle(self, *args, **options):
+        count = options['count']
+        paragraph = "<p>Newsletter de prueba con acentos: canción, año, pingüino.</p>\n"
+        filler = paragraph * (options['size_kb'] * 1024 // len(paragraph.encode()) + 1)
+        body_html = "<p>Hola {{ email }}</p>\n" + filler + '<a href="{{ unsubscribe_url }}">Darse de baja</a>\n'
+        body_text = "Hola {{ email }}\n" + "Newsletter de prueba.\n" * 50 + "Baja: {{ unsubscribe_url }}\n"
+        static_html, static_text = filler, "Newsletter de prueba.\n" * 50
+        sender, subject = 'newsletter@example.com', "Benchmark personalización"
+        contexts = [
+            {'subscriber_id': i, 'email': f"user{i}@example.com", 'phone_number': None, 'whatsapp_number': None}
+            for i in range(count)
+        ]
+
+        self.stdout.write(f"HTML body: {len(body_html.encode()) / 1024:.0f} KB, {count} recipients")
+        engine = Engine(autoescape=True)
+        django_html, django_text = engine.from_string(body_html), engine.from_string(body_text)
+
+        def _django_render(i):
+            context = Context(dict(contexts[i], unsubscribe_url=unsubscribe_url(i)))
+            return django_html.render(context), django_text.render(context)
+
+        django_bodies = self._time("Django template render   ", count, _django_render)
+        compiled_html, compiled_text = compile_template(body_html), compile_template(body_text)
+        compiled_bodies = self._time("compiled template render ", count, lambda i: (
+            compiled_html.render(contexts[i], html=True), compiled_text.render(contexts[i])
+        ))
+        self.stdout.write(self.style.SUCCESS(f"Speed-up (bodies): x{django_bodies / compiled_bodies:.1f}"))
+
+        _get_mime_template.cache_clear()
+        self._time("personalized MIME email  ", count, lambda i: _build_raw_email(
+            contexts[i]['email'], sender, subject, body_html, body_text, contexts[i]
+        ))
+        self._time("static MIME email (fast) ", count, lambda i: _build_raw_email(
+            contexts[i]['email'], sender, subject, static_html, static_text, contexts[i]
+        ))
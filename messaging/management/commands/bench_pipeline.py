@@ -0,0 +1,250 @@
+import json
+import logging
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from celery.contrib.testing.worker import start_worker
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from messaging import progress
+from messaging.benchmarking import FakeGmailService, FakeTwilioServer, TaskTimer, fake_gmail_service, percentiles
+from messaging.models import Delivery, Message, Subscriber
+from messaging.services import reset_twilio_client_pool
+from messaging.tasks import (
+    CHANNELS, _create_deliveries, finalize_message, queue_message_sending, task_send_single_email, task_send_single_sms, task_send_single_whatsapp,
+)
+from newsletter_project.celery import app
+
+SINGLE_TASKS = {
+    'email': task_send_single_email,
+    'sms': task_send_single_sms,
+    'whatsapp': task_send_single_whatsapp,
+}
+
+
+def _parse_mix(value):
+    """'email=0.6,sms=0.3,whatsapp=0.1' -> fracción de suscriptores suscritos a cada canal."""
+    mix = dict.fromkeys(CHANNELS, 0.0)
+    for item in value.split(','):
+        channel, _, ratio = item.partition('=')
+        if channel.strip() not in CHANNELS:
+            raise CommandError(f"Unknown channel in --mix: {channel!r}")
+        mix[channel.strip()] = float(ratio)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark de extremo a extremo del envío de una campaña (fan-out de queue_message_sending y tareas "
+        "de envío) sobre una base de datos de pruebas desechable, con Gmail y Twilio sustituidos por "
+        "proveedores falsos locales. Escribe los resultados en JSON para comparar entre commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help="Número de suscriptores a generar.")
+        parser.add_argument(
+            '--mix', default='email=0.6,sms=0.3,whatsapp=0.1',
+            help="Fracción de suscriptores suscritos a cada canal (p. ej. 'email=0.6,sms=0.3,whatsapp=0.1').",
+        )
+        parser.add_argument(
+            '--mode', choices=['batch', 'single'], default='batch',
+            help="'batch': queue_message_sending + task_send_batch; 'single': una tarea task_send_single_* por entrega.",
+        )
+        parser.add_argument(
+            '--broker', choices=['eager', 'memory'], default='eager',
+            help="'eager': tareas ejecutadas en línea; 'memory': broker en memoria y worker embebido.",
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help="Hilos del worker embebido (--broker memory).")
+        parser.add_argument('--latency-ms', type=float, default=20, help="Latencia simulada por petición al proveedor.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fracción de envíos que el proveedor rechaza.")
+        parser.add_argument('--chunk-size', type=int, default=settings.MESSAGING_SEND_CHUNK_SIZE)
+        parser.add_argument('--retry-delay', type=float, default=0, help="Segundos entre reintentos de las tareas de envío.")
+        parser.add_argument('--timeout', type=float, default=600, help="Espera máxima a que termine la campaña (--broker memory).")
+        parser.add_argument('--personalized', action='store_true', help="Cuerpos con variables por suscriptor ({{ email }}).")
+        parser.add_argument('--tracemalloc', action='store_true', help="Medir también el pico de memoria Python (más lento).")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Fichero JSON de resultados (por defecto, la salida estándar).")
+
+    def handle(self, *args, **options):
+        mix = _parse_mix(options['mix'])
+        # Los logs por envío (y los fallos simulados) distorsionarían la medición; el worker
+        # embebido reconfigura los loggers, así que se desactivan de forma global
+        logging.disable(logging.ERROR)
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._seed(options['count'], mix, random.Random(options['seed']))
+            gmail = FakeGmailService(latency=options['latency_ms'] / 1000, error_rate=options['error_rate'])
+            with FakeTwilioServer(latency=options['latency_ms'] / 1000, error_rate=options['error_rate']) as twilio, \
+                    fake_gmail_service(gmail), override_settings(
+                        MESSAGING_SEND_CHUNK_SIZE=options['chunk_size'],
+                        # Reintentos a como mucho --retry-delay segundos (entre la mitad y el total)
+                        MESSAGING_RETRY_BACKOFF_BASE=options['retry_delay'],
+                        MESSAGING_RETRY_BACKOFF_MAX=options['retry_delay'],
+                        MESSAGING_RATE_LIMIT_BACKEND='off',
+                        MESSAGING_CIRCUIT_BREAKER_BACKEND='off',
+                        MESSAGING_PROGRESS_BACKEND='memory',
+                        GMAIL_SENDER_EMAIL='newsletter@example.com',
+                        TWILIO_API_BASE_URL=twilio.base_url,
+                        TWILIO_ACCOUNT_SID='AC' + '0' * 32,
+                        TWILIO_AUTH_TOKEN='benchmark',
+                        TWILIO_SMS_NUMBER='+15550000000',
+                        TWILIO_WHATSAPP_NUMBER='whatsapp:+15550000000',
+                    ):
+                reset_twilio_client_pool()
+                results = self._run(options)
+                results['providers'] = {
+                    'gmail': {'requests': gmail.request_count, 'messages': gmail.message_count},
+                    'twilio': {'requests': twilio.request_count},
+                }
+        finally:
+            reset_twilio_client_pool()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'benchmark': 'bench_pipeline',
+            'commit': self._git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'params': {key: options[key] for key in (
+                'count', 'mode', 'broker', 'concurrency', 'latency_ms', 'error_rate', 'chunk_size', 'retry_delay', 'personalized', 'seed',
+            )} | {'mix': mix},
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f"{results['deliveries']['total']} deliveries in {results['wall_time_s']:.2f}s "
+                f"({results['throughput_per_s']:.1f}/s). Results written to {options['output']}"
+            ))
+        else:
+            self.stdout.write(output)
+
+    def _seed(self, count, mix, rng):
+        self.stderr.write(f"Generando {count} suscriptores...")
+        batch = []
+        for i in range(count):
+            batch.append(Subscriber(
+                email=f"user{i}@example.com",
+                phone_number=f"+1555{i:07d}",
+                whatsapp_number=f"whatsapp:+1555{i:07d}",
+                subscribed_to_email=rng.random() < mix['email'],
+                subscribed_to_sms=rng.random() < mix['sms'],
+                subscribed_to_whatsapp=rng.random() < mix['whatsapp'],
+            ))
+            if len(batch) >= 5000:
+                Subscriber.objects.bulk_create(batch)
+                batch = []
+        Subscriber.objects.bulk_create(batch)
+
+    def _run(self, options):
+        """Envía una campaña a toda la audiencia y devuelve las métricas."""
+        greeting = "Hola {{ email }}" if options['personalized'] else "Hola"
+        message = Message.objects.create(
+            subject="Benchmark", body_html=f"<p>{greeting}</p>", body_text=greeting, status='queued',
+        )
+        eager = app.conf.task_always_eager, app.conf.task_eager_propagates
+        if options['tracemalloc']:
+            tracemalloc.start()
+        started_at = timezone.now()
+        start = time.perf_counter()
+        try:
+            with TaskTimer() as timer:
+                if options['broker'] == 'eager':
+                    app.conf.task_always_eager, app.conf.task_eager_propagates = True, False
+                    self._send(message, options['mode'])
+                else:
+                    # Con el namespace CELERY, las claves cargadas de settings tienen prioridad: sobrescribirlas ya cargadas
+                    app.conf.broker_url
+                    app.conf.update(
+                        CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='cache+memory://',
+                        CELERY_BROKER_TRANSPORT_OPTIONS={'polling_interval': 0.01},
+                    )
+                    with start_worker(
+                        app, pool='threads' if options['concurrency'] > 1 else 'solo',
+                        concurrency=options['concurrency'], perform_ping_check=False,
+                    ):
+                        self._send(message, options['mode'])
+                        self._wait(message, options['timeout'])
+            wall_time = time.perf_counter() - start
+        finally:
+            app.conf.task_always_eager, app.conf.task_eager_propagates = eager
+        python_peak = None
+        if options['tracemalloc']:
+            python_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+        message.refresh_from_db()
+        statuses = dict(Delivery.objects.filter(message=message).order_by().values_list('status').annotate(n=Count('id')))
+        finished = Delivery.objects.filter(message=message, status__in=['sent', 'failed', 'skipped'])
+        time_to_result = [
+            round((updated_at - started_at).total_seconds() * 1000, 3) for updated_at in finished.values_list('updated_at', flat=True)
+        ]
+        total = sum(statuses.values())
+        # ru_maxrss: KB en Linux, bytes en macOS; incluye la generación de suscriptores
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+        return {
+            'message_status': message.status,
+            'wall_time_s': wall_time,
+            'deliveries': {'total': total, **{status: statuses.get(status, 0) for status, _ in Delivery.STATUS_CHOICES}},
+            'throughput_per_s': total / wall_time if wall_time else None,
+            # Tiempo propio por ejecución de cada tarea (ms), sin el de las tareas anidadas en modo eager
+            'stages_ms': {name: percentiles([round(d * 1000, 3) for d in durations]) for name, durations in sorted(timer.durations.items())},
+            # Desde el inicio de la campaña hasta el resultado definitivo de cada entrega (ms)
+            'time_to_result_ms': percentiles(time_to_result),
+            'memory': {'peak_rss_mb': peak_rss, 'python_peak_mb': python_peak},
+        }
+
+    def _send(self, message, mode):
+        if mode == 'batch':
+            queue_message_sending.delay(message.id)
+            return
+
+        # Mismo estado que deja el fan-out, pero con una tarea por (suscriptor, canal)
+        Message.objects.filter(pk=message.id).update(status='sending')
+        progress.reset(message.id)
+        audience = {}
+        for channel, (subscribed_field, contact_field, _) in CHANNELS.items():
+            ids = list(
+                Subscriber.objects.filter(is_active=True, **{subscribed_field: True})
+                .exclude(**{f'{contact_field}__isnull': True}).order_by('id').values_list('id', flat=True)
+            )
+            _create_deliveries(message.id, channel, ids)
+            audience[channel] = ids
+        if progress.set_queued(message.id, {channel: len(ids) for channel, ids in audience.items() if ids}):
+            finalize_message.delay(message.id)
+        for channel, ids in audience.items():
+            for subscriber_id in ids:
+                SINGLE_TASKS[channel].delay(message.id, subscriber_id)
+
+    def _wait(self, message, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if Message.objects.filter(pk=message.id, status__in=['sent', 'failed']).exists():
+                return
+            time.sleep(0.05)
+        raise CommandError(f"Campaign did not finish within {timeout:.0f}s.")
+
+    @staticmethod
+    def _git_commit():
+        try:
+            result = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout.strip() or None
@@ -0,0 +1,52 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from messaging.benchmarking import FakeTwilioServer
+from messaging.services import reset_twilio_client_pool, send_sms_message, send_twilio_batch
+
+
+class Command(BaseCommand):
+    help = "Compara el envío SMS síncrono (send_sms_message) con el envío asíncrono por lotes contra un servidor Twilio falso local."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help="Número de SMS a enviar por cada modo.")
+        parser.add_argument('--latency-ms', type=float, default=50, help="Latencia simulada de la API por petición.")
+        parser.add_argument('--concurrency', type=int, default=200, help="Límite de envíos en vuelo del modo asíncrono.")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        numbers = [f"+1555{i:07d}" for i in range(count)]
+        # Los logs por envío distorsionarían la medición
+        logging.getLogger('messaging').setLevel(logging.WARNING)
+        logging.getLogger('twilio').setLevel(logging.WARNING)
+
+        # Sin limitador de tasa ni circuit breaker: se mide el cliente HTTP, no el token bucket
+        with FakeTwilioServer(latency=options['latency_ms'] / 1000) as server, override_settings(
+            MESSAGING_RATE_LIMIT_BACKEND='off',
+            MESSAGING_CIRCUIT_BREAKER_BACKEND='off',
+            TWILIO_API_BASE_URL=server.base_url,
+            TWILIO_ACCOUNT_SID='AC' + '0' * 32,
+            TWILIO_AUTH_TOKEN='benchmark',
+            TWILIO_SMS_NUMBER='+15550000000',
+        ):
+            reset_twilio_client_pool()
+            start = time.perf_counter()
+            for number in numbers:
+                send_sms_message(number, "Benchmark")
+            sync_elapsed = time.perf_counter() - start
+            reset_twilio_client_pool()
+
+            start = time.perf_counter()
+            results = send_twilio_batch('sms', numbers, "Benchmark", concurrency=options['concurrency'])
+            async_elapsed = time.perf_counter() - start
+            failed = sum(1 for result in results if not result.ok)
+
+        self.stdout.write(f"sync  send_sms_message : {count} SMS in {sync_elapsed:.2f}s ({count / sync_elapsed:.1f} msg/s)")
+        self.stdout.write(
+            f"async send_twilio_batch: {count} SMS in {async_elapsed:.2f}s ({count / async_elapsed:.1f} msg/s, "
+            f"concurrency={options['concurrency']}, failed={failed})"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: x{sync_elapsed / async_elapsed:.1f}"))
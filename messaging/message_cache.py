@@ -0,0 +1,108 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MessageSnapshot:
+    """Copia inmutable del contenido de un Message, compartida por todos los envíos de una campaña."""
+    id: int
+    subject: str
+    body_html: str
+    body_text: str
+    updated_at: datetime
+
+    @property
+    def size(self):
+        # Aproximación en caracteres; suficiente para acotar la memoria de la caché
+        return len(self.subject) + len(self.body_html) + len(self.body_text)
+
+
+# Caché LRU por proceso worker, con clave (message_id, updated_at): si el mensaje
+# se edita durante una campaña cambia `updated_at` y la versión anterior se descarta.
+_snapshot_lock = threading.Lock()
+_snapshots = OrderedDict()
+_snapshot_bytes = 0
+_snapshot_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _evict(key):
+    global _snapshot_bytes
+    snapshot = _snapshots.pop(key)
+    _snapshot_bytes -= snapshot.size
+    _snapshot_stats['evictions'] += 1
+
+
+def _store(snapshot):
+    global _snapshot_bytes
+    max_entries = settings.MESSAGE_SNAPSHOT_CACHE_SIZE
+    max_bytes = settings.MESSAGE_SNAPSHOT_CACHE_MAX_BYTES
+    if snapshot.size > max_bytes:
+        return # Demasiado grande para cachear; se leerá de la BD en cada uso
+
+    with _snapshot_lock:
+        for key in [k for k in _snapshots if k[0] == snapshot.id]:
+            _evict(key) # Versiones anteriores del mismo mensaje
+        _snapshots[(snapshot.id, snapshot.updated_at)] = snapshot
+        _snapshot_bytes += snapshot.size
+        while len(_snapshots) > max_entries or _snapshot_bytes > max_bytes:
+            _evict(next(iter(_snapshots)))
+
+
+def get_message_snapshot(message_id):
+    """
+    Devuelve un MessageSnapshot del mensaje. Solo consulta `updated_at` (una fila, sin
+    los cuerpos) para validar la caché; el contenido completo se carga una vez por versión.
+    Lanza Message.DoesNotExist si el mensaje no existe.
+    """
+    updated_at = Message.objects.filter(pk=message_id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        raise Message.DoesNotExist(f"Message {message_id} does not exist.")
+
+    key = (message_id, updated_at)
+    with _snapshot_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is not None:
+            _snapshots.move_to_end(key)
+            _snapshot_stats['hits'] += 1
+            return snapshot
+        _snapshot_stats['misses'] += 1
+
+    row = Message.objects.filter(pk=message_id).values(
+        'id', 'subject', 'body_html', 'body_text', 'updated_at'
+    ).first()
+    if row is None:
+        raise Message.DoesNotExist(f"Message {message_id} does not exist.")
+    snapshot = MessageSnapshot(**row)
+    _store(snapshot)
+    return snapshot
+
+
+def invalidate_message_snapshot(message_id):
+    """Elimina de la caché local todas las versiones de un mensaje."""
+    with _snapshot_lock:
+        for key in [k for k in _snapshots if k[0] == message_id]:
+            _evict(key)
+
+
+def get_message_snapshot_stats():
+    """Devuelve los contadores de la caché y su ocupación actual."""
+    with _snapshot_lock:
+        return dict(_snapshot_stats, entries=len(_snapshots), bytes=_snapshot_bytes)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def _drop_cached_snapshot(sender, instance, **kwargs):
+    # Los otros procesos detectan la edición por el cambio de `updated_at`
+    invalidate_message_snapshot(instance.pk)
@@ -0,0 +1,180 @@
+"""
+Métricas de envío en formato Prometheus: envíos por canal y resultado, latencia de los
+proveedores, reintentos, retraso de la cola de Celery y tiempo desde que se encola una
+campaña hasta su primera y su última entrega. Se exponen en /metrics.
+
+Con varios procesos (workers prefork de Celery, varios procesos web) define
+PROMETHEUS_MULTIPROC_DIR con un directorio vacío compartido antes de arrancarlos: cada
+proceso escribe sus valores en ficheros mmap de ese directorio y /metrics los agrega.
+En hosts que solo ejecutan workers, MESSAGING_METRICS_WORKER_PORT hace que el worker
+principal sirva esas mismas métricas por HTTP.
+Registrar una métrica es una escritura en memoria del proceso, sin red; en el camino de
+envío se registra por lote o por petición al proveedor, nunca por consulta a la base de
+datos. MESSAGING_METRICS_ENABLED=False lo desactiva todo.
+"""
+import functools
+import os
+import time
+from datetime import datetime
+
+from celery.signals import before_task_publish, task_prerun, task_retry, worker_init, worker_process_shutdown
+from django.conf import settings
+from django.db.models import Max, Min
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, start_http_server,
+)
+
+from .models import Delivery
+
+# Proveedor que atiende cada canal
+CHANNEL_PROVIDERS = {
+    'email': 'gmail',
+    'sms': 'twilio',
+    'whatsapp': 'twilio',
+}
+# Cabecera del mensaje Celery con la hora de publicación (para el retraso de la cola)
+PUBLISHED_AT_HEADER = 'published_at'
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+_CAMPAIGN_BUCKETS = (1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, 21600, 86400)
+
+SENDS = Counter(
+    'messaging_sends_total',
+    "Resultados de envío por destinatario ('retry': fallo que se va a reintentar; 'deferred': aplazado por circuito abierto o límite de tasa).",
+    ['channel', 'provider', 'outcome'],
+)
+PROVIDER_LATENCY = Histogram(
+    'messaging_provider_request_seconds', "Duración de cada petición al proveedor (un lote de Gmail cuenta como una).",
+    ['channel', 'provider'], buckets=_LATENCY_BUCKETS,
+)
+CIRCUIT_TRANSITIONS = Counter(
+    'messaging_circuit_transitions_total', "Cambios de estado del circuit breaker de cada proveedor.",
+    ['provider', 'state'],
+)
+TASK_RETRIES = Counter('messaging_task_retries_total', "Reintentos de tareas Celery.", ['task'])
+QUEUE_LAG = Histogram(
+    'messaging_queue_lag_seconds', "Tiempo entre la publicación de una tarea y el inicio de su ejecución.",
+    ['task'], buckets=_LAG_BUCKETS,
+)
+QUEUE_LAG_LAST = Gauge(
+    'messaging_queue_lag_last_seconds', "Retraso de la cola de la última tarea iniciada.",
+    ['task'], multiprocess_mode='livemostrecent',
+)
+CAMPAIGN_FIRST_DELIVERY = Histogram(
+    'messaging_campaign_first_delivery_seconds', "Tiempo desde que se encola una campaña hasta su primera entrega.",
+    ['channel'], buckets=_CAMPAIGN_BUCKETS,
+)
+CAMPAIGN_LAST_DELIVERY = Histogram(
+    'messaging_campaign_last_delivery_seconds', "Tiempo desde que se encola una campaña hasta su última entrega.",
+    ['channel'], buckets=_CAMPAIGN_BUCKETS,
+)
+
+
+def _task_label(task):
+    return task.name.rsplit('.', 1)[-1]
+
+
+@functools.lru_cache(maxsize=None)
+def _provider_latency(channel):
+    # Hijo ya resuelto por canal: se observa una vez por petición al proveedor
+    return PROVIDER_LATENCY.labels(channel, CHANNEL_PROVIDERS[channel])
+
+
+def observe_provider_latency(channel, seconds):
+    if settings.MESSAGING_METRICS_ENABLED:
+        _provider_latency(channel).observe(seconds)
+
+
+def record_results(channel, sent=0, failed=0, retried=0, skipped=0, deferred=0):
+    """Suma los resultados de un lote (una llamada por lote, no por destinatario)."""
+    if not settings.MESSAGING_METRICS_ENABLED:
+        return
+    provider = CHANNEL_PROVIDERS[channel]
+    outcomes = (('sent', sent), ('failed', failed), ('retry', retried), ('skipped', skipped), ('deferred', deferred))
+    for outcome, amount in outcomes:
+        if amount:
+            SENDS.labels(channel, provider, outcome).inc(amount)
+
+
+def record_circuit_transition(provider, state):
+    if settings.MESSAGING_METRICS_ENABLED:
+        CIRCUIT_TRANSITIONS.labels(provider, state).inc()
+
+
+def observe_campaign(message_id, queued_at):
+    """
+    Registra, por canal, el tiempo desde `queued_at` (epoch en segundos) hasta la primera
+    y la última entrega de una campaña terminada. Una consulta agregada sobre Delivery,
+    una vez por campaña.
+    """
+    if not settings.MESSAGING_METRICS_ENABLED or queued_at is None:
+        return
+    rows = (
+        Delivery.objects.filter(message_id=message_id, status='sent').order_by()
+        .values('channel').annotate(first=Min('updated_at'), last=Max('updated_at'))
+    )
+    for row in rows:
+        CAMPAIGN_FIRST_DELIVERY.labels(row['channel']).observe(max(row['first'].timestamp() - queued_at, 0))
+        CAMPAIGN_LAST_DELIVERY.labels(row['channel']).observe(max(row['last'].timestamp() - queued_at, 0))
+
+
+def published_at(task):
+    """Hora de publicación (epoch) de la tarea en ejecución, o None si no se conoce (p. ej. en modo eager)."""
+    return getattr(task.request, PUBLISHED_AT_HEADER, None)
+
+
+def _registry():
+    """Registro con las métricas de todos los procesos del host (o solo de este)."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_latest():
+    """Texto en formato Prometheus para la vista /metrics."""
+    return generate_latest(_registry())
+
+
+@before_task_publish.connect
+def _stamp_published_at(headers=None, **kwargs):
+    if headers is not None and settings.MESSAGING_METRICS_ENABLED:
+        headers[PUBLISHED_AT_HEADER] = time.time() # También en cada reintento
+
+
+@task_prerun.connect
+def _observe_queue_lag(task=None, **kwargs):
+    if not settings.MESSAGING_METRICS_ENABLED:
+        return
+    sent_at = published_at(task)
+    if sent_at is not None:
+        eta = task.request.eta # Tareas con countdown/eta: el retraso cuenta desde que debían ejecutarse
+        if eta:
+            sent_at = max(sent_at, datetime.fromisoformat(eta).timestamp())
+        lag = max(time.time() - sent_at, 0)
+        label = _task_label(task)
+        QUEUE_LAG.labels(label).observe(lag)
+        QUEUE_LAG_LAST.labels(label).set(lag)
+
+
+@task_retry.connect
+def _count_retry(sender=None, **kwargs):
+    if settings.MESSAGING_METRICS_ENABLED and sender is not None:
+        TASK_RETRIES.labels(_task_label(sender)).inc()
+
+
+@worker_init.connect
+def _start_worker_exporter(**kwargs):
+    # Hosts con solo workers: el proceso principal sirve las métricas de sus hijos prefork
+    port = settings.MESSAGING_METRICS_WORKER_PORT
+    if settings.MESSAGING_METRICS_ENABLED and port:
+        start_http_server(port, registry=_registry())
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(pid=None, **kwargs):
+    # Los gauges 'live*' dejan de contar los valores de un proceso hijo que termina
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0002_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='dispatch_checkpoint',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Dispatch Checkpoint'),
+        ),
+    ]
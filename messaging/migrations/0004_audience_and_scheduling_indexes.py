@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0003_message_dispatch_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['status', 'scheduled_at'], name='message_status_scheduled_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(condition=models.Q(('is_active', True), models.Q(('subscribed_to_email', True), ('subscribed_to_sms', True), ('subscribed_to_whatsapp', True), _connector='OR')), fields=['id'], name='subscriber_audience_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_message_scheduled_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Idempotency Key'),
+        ),
+        migrations.AlterField(
+            model_name='delivery',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='queued', max_length=10, verbose_name='Status'),
+        ),
+    ]
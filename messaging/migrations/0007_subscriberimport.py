@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_delivery_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriberImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='subscriber_imports/', verbose_name='File')),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], max_length=10, verbose_name='Format')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='Processed Rows')),
+                ('imported_rows', models.PositiveIntegerField(default=0, help_text='Subscribers created or updated.', verbose_name='Imported Rows')),
+                ('failed_rows', models.PositiveIntegerField(default=0, verbose_name='Failed Rows')),
+                ('error_file', models.FileField(blank=True, upload_to='subscriber_imports/errors/', verbose_name='Error File')),
+                ('error', models.TextField(blank=True, help_text='Critical error that stopped the import.', verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+            ],
+            options={
+                'verbose_name': 'Subscriber Import',
+                'verbose_name_plural': 'Subscriber Imports',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
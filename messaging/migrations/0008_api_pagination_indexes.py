@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_subscriberimport'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-created_at', '-id'], name='message_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='message_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(fields=['-created_at', '-id'], name='subscriber_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='subscriber_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(condition=models.Q(('subscribed_to_email', True)), fields=['-created_at', '-id'], name='subscriber_email_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(condition=models.Q(('subscribed_to_sms', True)), fields=['-created_at', '-id'], name='subscriber_sms_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(condition=models.Q(('subscribed_to_whatsapp', True)), fields=['-created_at', '-id'], name='subscriber_wa_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0008_api_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='duplicate_rows',
+            field=models.PositiveIntegerField(default=0, help_text='Rows merged into a later row of the same batch with the same contact.', verbose_name='Duplicate Rows'),
+        ),
+    ]
@@ -1,8 +1,16 @@
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 import re
 
+# Suscriptores a los que se envía una campaña: activos y suscritos a algún canal.
+# queue_message_sending filtra exactamente con esta condición para que el planificador
+# use el índice parcial `subscriber_audience_idx`.
+AUDIENCE_CONDITION = Q(is_active=True) & (
+    Q(subscribed_to_email=True) | Q(subscribed_to_sms=True) | Q(subscribed_to_whatsapp=True)
+)
+
 class Subscriber(models.Model):
     """Almacena información de los suscriptores."""
     email = models.EmailField(_("Email Address"), max_length=254, unique=True, null=True, blank=True)
@@ -22,6 +30,20 @@ class Subscriber(models.Model):
         verbose_name = _("Subscriber")
         verbose_name_plural = _("Subscribers")
         ordering = ['-created_at']
+        indexes = [
+            # Índice parcial: el recorrido paginado por id solo visita suscriptores de la audiencia
+            models.Index(
+                fields=['id'],
+                condition=AUDIENCE_CONDITION,
+                name='subscriber_audience_idx',
+            ),
+            # Paginación por cursor de la API (created_at, id) y filtros indexados del listado
+            models.Index(fields=['-created_at', '-id'], name='subscriber_created_idx'),
+            models.Index(fields=['is_active', '-created_at', '-id'], name='subscriber_active_created_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=Q(subscribed_to_email=True), name='subscriber_email_created_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=Q(subscribed_to_sms=True), name='subscriber_sms_created_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=Q(subscribed_to_whatsapp=True), name='subscriber_wa_created_idx'),
+        ]
 
     def __str__(self):
         parts = []
@@ -62,6 +84,45 @@ class Subscriber(models.Model):
                 "WhatsApp number must start with 'whatsapp:+' followed by the country code and number.")})
 
 
+class SubscriberImport(models.Model):
+    """Importación masiva de suscriptores desde un fichero CSV o NDJSON, procesada en segundo plano."""
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', _('Pending')),
+        ('running', _('Running')),
+        ('done', _('Done')),
+        ('failed', _('Failed')),
+    ]
+
+    file = models.FileField(_("File"), upload_to='subscriber_imports/')
+    format = models.CharField(_("Format"), max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(_("Status"), max_length=10, choices=STATUS_CHOICES, default='pending')
+    processed_rows = models.PositiveIntegerField(_("Processed Rows"), default=0)
+    imported_rows = models.PositiveIntegerField(_("Imported Rows"), default=0, help_text=_("Subscribers created or updated."))
+    failed_rows = models.PositiveIntegerField(_("Failed Rows"), default=0)
+    duplicate_rows = models.PositiveIntegerField(
+        _("Duplicate Rows"), default=0, help_text=_("Rows merged into a later row of the same batch with the same contact."),
+    )
+    # CSV con una fila por línea rechazada: número de línea, error y contenido original
+    error_file = models.FileField(_("Error File"), upload_to='subscriber_imports/errors/', blank=True)
+    error = models.TextField(_("Error"), blank=True, help_text=_("Critical error that stopped the import."))
+
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+    finished_at = models.DateTimeField(_("Finished At"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Subscriber Import")
+        verbose_name_plural = _("Subscriber Imports")
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.format}, {self.get_status_display()})"
+
+
 class Message(models.Model):
     """Almacena el contenido de los mensajes a enviar."""
     subject = models.CharField(_("Subject (for Email)"), max_length=255, blank=True)
@@ -70,6 +131,7 @@ class Message(models.Model):
 
     STATUS_CHOICES = [
         ('draft', _('Draft')),
+        ('scheduled', _('Scheduled')), # Esperando a scheduled_at (ver dispatch_scheduled_messages)
         ('queued', _('Queued')),
         ('sending', _('Sending')),
         ('sent', _('Sent')),
@@ -88,11 +150,67 @@ class Message(models.Model):
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
     scheduled_at = models.DateTimeField(_("Scheduled At"), null=True, blank=True, help_text=_("If set, the message will be sent around this time.")) # Opcional: Para envíos programados
+    # Último subscriber_id publicado por canal durante el fan-out; None cuando no hay fan-out en curso
+    dispatch_checkpoint = models.JSONField(_("Dispatch Checkpoint"), null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = _("Message")
         verbose_name_plural = _("Messages")
         ordering = ['-created_at']
+        indexes = [
+            # Filtros del admin y búsqueda de mensajes programados vencidos (status='scheduled', scheduled_at <= ahora)
+            models.Index(fields=['status', 'scheduled_at'], name='message_status_scheduled_idx'),
+            # Paginación por cursor de la API (created_at, id), con y sin filtro por estado
+            models.Index(fields=['-created_at', '-id'], name='message_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='message_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.subject or f"Message {self.pk} ({self.get_status_display()})"
+
+    def delivery_report(self):
+        """Recuento de entregas por canal y estado, calculado con una consulta agregada."""
+        report = {}
+        rows = self.deliveries.order_by().values('channel', 'status').annotate(count=models.Count('id'))
+        for row in rows:
+            report.setdefault(row['channel'], {})[row['status']] = row['count']
+        return report
+
+class Delivery(models.Model):
+    """Resultado del envío de un mensaje a un suscriptor por un canal concreto."""
+    CHANNEL_CHOICES = [
+        ('email', _('Email')),
+        ('sms', _('SMS')),
+        ('whatsapp', _('WhatsApp')),
+    ]
+    STATUS_CHOICES = [
+        ('queued', _('Queued')),
+        ('sending', _('Sending')), # Reclamada por un lote en curso
+        ('sent', _('Sent')),
+        ('failed', _('Failed')),
+        ('skipped', _('Skipped')),
+    ]
+
+    message = models.ForeignKey(Message, verbose_name=_("Message"), on_delete=models.CASCADE, related_name='deliveries')
+    subscriber = models.ForeignKey(Subscriber, verbose_name=_("Subscriber"), on_delete=models.CASCADE, related_name='deliveries')
+    channel = models.CharField(_("Channel"), max_length=10, choices=CHANNEL_CHOICES)
+    status = models.CharField(_("Status"), max_length=10, choices=STATUS_CHOICES, default='queued')
+    provider_id = models.CharField(_("Provider ID"), max_length=100, blank=True, help_text=_("Gmail message ID or Twilio SID."))
+    attempts = models.PositiveSmallIntegerField(_("Attempts"), default=0)
+    error_code = models.CharField(_("Error Code"), max_length=20, blank=True)
+    last_error = models.CharField(_("Last Error"), max_length=255, blank=True)
+    # Clave de idempotencia del intento que reclamó la fila (ID de la tarea Celery, estable entre reintentos)
+    idempotency_key = models.CharField(_("Idempotency Key"), max_length=64, blank=True, editable=False)
+
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Delivery")
+        verbose_name_plural = _("Deliveries")
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'subscriber', 'channel'], name='unique_delivery_per_channel'),
+        ]
 
     def __str__(self):
-        return self.subject or f"Message {self.pk} ({self.get_status_display()})"
\ No newline at end of file
+        return f"{self.message_id} -> {self.subscriber_id} ({self.channel}): {self.status}"
@@ -0,0 +1,121 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por clave sobre (created_at, id), de más reciente a más antiguo.
+
+    El cursor opaco guarda el (created_at, id) del último elemento visto y la siguiente
+    página se pide con `WHERE (created_at, id) < cursor ORDER BY created_at DESC, id DESC
+    LIMIT n`: sin COUNT(*) ni OFFSET, así que una página profunda cuesta lo mismo que la
+    primera si hay un índice que empiece por (created_at, id). El tamaño de página se
+    puede elegir con `page_size` hasta `max_page_size`.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+
+        if reverse:
+            # Hacia atrás: elementos más recientes que el cursor, en orden ascendente
+            queryset = queryset.order_by('created_at', 'id')
+            if position:
+                queryset = queryset.filter(created_at__gte=position[0]).filter(
+                    Q(created_at__gt=position[0]) | Q(id__gt=position[1])
+                )
+        else:
+            queryset = queryset.order_by('-created_at', '-id')
+            if position:
+                # (created_at, id) < cursor; la cota simple sobre created_at delimita el rango del índice
+                queryset = queryset.filter(created_at__lte=position[0]).filter(
+                    Q(created_at__lt=position[0]) | Q(id__lt=position[1])
+                )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_item = self.previous_item = None
+        if results:
+            # Hacia delante hay más si sobró una fila, o siempre que se haya retrocedido desde un cursor
+            if (has_more and not reverse) or (reverse and position):
+                self.next_item = results[-1]
+            if (has_more and reverse) or (position and not reverse):
+                self.previous_item = results[0]
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except ValueError:
+                pass
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_item is None:
+            return None
+        return self.encode_cursor(self.next_item, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_item is None:
+            return None
+        return self.encode_cursor(self.previous_item, reverse=True)
+
+    def decode_cursor(self, request):
+        """Devuelve ((created_at, id), reverse) del cursor, o (None, False) en la primera página."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            created_at = parse_datetime(data['c'])
+            if created_at is None:
+                raise ValueError(data['c'])
+            return (created_at, int(data['i'])), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, item, reverse):
+        data = {'c': item.created_at.isoformat(), 'i': item.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
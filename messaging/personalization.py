@@ -0,0 +1,87 @@
+"""
+Personalización de los cuerpos de los mensajes por suscriptor.
+
+Los cuerpos admiten variables con la sintaxis `{{ variable }}` (ver VARIABLES); cualquier
+otro texto entre llaves se deja tal cual. Cada cuerpo se compila una vez por proceso en una
+lista de literales y nombres de variable, y renderizarlo para un destinatario es un simple
+`join`. Un cuerpo sin variables se marca como estático y se envía sin renderizar.
+"""
+import functools
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.html import escape
+
+VARIABLES = ('subscriber_id', 'email', 'phone_number', 'whatsapp_number', 'unsubscribe_url')
+_VARIABLE_RE = re.compile(r'\{\{\s*(' + '|'.join(VARIABLES) + r')\s*\}\}')
+_UNSUBSCRIBE_SALT = 'messaging.unsubscribe'
+
+
+@functools.lru_cache(maxsize=1)
+def _signer():
+    return signing.Signer(salt=_UNSUBSCRIBE_SALT)
+
+
+def unsubscribe_token(subscriber_id):
+    """Token firmado que identifica al suscriptor en el enlace de baja."""
+    return _signer().sign(str(subscriber_id))
+
+
+def subscriber_from_token(token):
+    """ID del suscriptor de un token de baja; signing.BadSignature si no es válido."""
+    return int(_signer().unsign(token))
+
+
+@functools.lru_cache(maxsize=1)
+def _unsubscribe_base_url():
+    return settings.MESSAGING_PUBLIC_BASE_URL.rstrip('/') + reverse('subscriber-unsubscribe') + '?token='
+
+
+def unsubscribe_url(subscriber_id):
+    return _unsubscribe_base_url() + unsubscribe_token(subscriber_id)
+
+
+def subscriber_context(subscriber):
+    """Variables de un suscriptor (la URL de baja se calcula solo si el cuerpo la usa)."""
+    return {
+        'subscriber_id': subscriber.id,
+        'email': subscriber.email,
+        'phone_number': subscriber.phone_number,
+        'whatsapp_number': subscriber.whatsapp_number,
+    }
+
+
+class CompiledTemplate:
+    """Cuerpo compilado: literales intercalados con nombres de variable."""
+
+    def __init__(self, source):
+        self.source = source
+        pieces = _VARIABLE_RE.split(source or '')
+        self._literals = pieces[0::2] # len(_literals) == len(_names) + 1
+        self._names = pieces[1::2]
+
+    @property
+    def is_static(self):
+        return not self._names
+
+    def render(self, context, html=False):
+        if not self._names:
+            return self.source
+        parts = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            value = context.get(name)
+            if value is None and name == 'unsubscribe_url':
+                # Se firma una vez por suscriptor y se reutiliza en el resto de cuerpos
+                value = context[name] = unsubscribe_url(context['subscriber_id'])
+            value = '' if value is None else str(value)
+            parts.append(escape(value) if html else value)
+            parts.append(literal)
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_template(source):
+    """Plantilla compilada de un cuerpo; una vez por proceso y cuerpo distinto."""
+    return CompiledTemplate(source)
@@ -0,0 +1,182 @@
+"""
+Contadores de progreso por campaña (mensaje) y canal: encolados, enviados, fallidos y
+omitidos. Viven en un hash de Redis que los workers actualizan con HINCRBY, sin tocar
+la fila Message, así que cientos de workers pueden registrar resultados a la vez.
+
+El worker cuyo incremento hace que `done` alcance `total` es el único que detecta el
+fin de la campaña y lanza el finalizador. Con MESSAGING_PROGRESS_BACKEND='memory'
+(tests, desarrollo) los contadores son por proceso.
+"""
+import logging
+import os
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('sent', 'failed', 'skipped')
+_KEY_TTL = 7 * 24 * 3600 # Los contadores de campañas antiguas caducan solos
+_RATE_MIN_INTERVAL = 1.0 # Segundos mínimos entre dos muestras de la tasa de envío
+_RATE_SAMPLE_TTL = 60 # Sin consultas durante este tiempo, la tasa vuelve a calcularse desde el inicio
+
+
+def _key(message_id):
+    return f"messaging:progress:{message_id}"
+
+
+class MemoryProgressStore:
+    """Contadores en memoria del proceso; misma semántica que RedisProgressStore."""
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def reset(self, key):
+        with self._lock:
+            self._hashes.pop(key, None)
+
+    def increment(self, key, fields):
+        with self._lock:
+            data = self._hashes.setdefault(key, {})
+            for field, amount in fields.items():
+                data[field] = data.get(field, 0) + amount
+            return data.get('done', 0), data.get('total')
+
+    def set_fields(self, key, fields):
+        with self._lock:
+            data = self._hashes.setdefault(key, {})
+            data.update(fields)
+            return data.get('done', 0)
+
+    def get_all(self, key):
+        with self._lock:
+            return dict(self._hashes.get(key, {}))
+
+
+class RedisProgressStore:
+    """Contadores en un hash de Redis, compartidos por todos los workers."""
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+    def reset(self, key):
+        self._client.delete(key)
+
+    def increment(self, key, fields):
+        pipe = self._client.pipeline() # MULTI/EXEC: los incrementos y la lectura son atómicos
+        for field, amount in fields.items():
+            pipe.hincrby(key, field, amount)
+        pipe.hget(key, 'total')
+        pipe.expire(key, _KEY_TTL)
+        results = pipe.execute()
+        done = results[list(fields).index('done')]
+        total = results[len(fields)]
+        return done, int(total) if total is not None else None
+
+    def set_fields(self, key, fields):
+        pipe = self._client.pipeline()
+        pipe.hset(key, mapping=fields)
+        pipe.hget(key, 'done')
+        pipe.expire(key, _KEY_TTL)
+        done = pipe.execute()[1]
+        return int(done or 0)
+
+    def get_all(self, key):
+        return {field.decode(): int(value) for field, value in self._client.hgetall(key).items()}
+
+
+_store_lock = threading.Lock()
+_store = {'pid': None, 'backend': None}
+
+
+def _get_store():
+    pid = os.getpid()
+    if _store['pid'] != pid:
+        with _store_lock:
+            if _store['pid'] != pid:
+                if settings.MESSAGING_PROGRESS_BACKEND == 'redis':
+                    backend = RedisProgressStore(settings.MESSAGING_PROGRESS_REDIS_URL)
+                else:
+                    backend = MemoryProgressStore()
+                _store.update(pid=pid, backend=backend)
+    return _store['backend']
+
+
+def reset(message_id, queued_at=None):
+    """
+    Borra los contadores de un mensaje (al empezar un nuevo envío) y guarda cuándo se
+    encoló (epoch en segundos), para medir el tiempo hasta la primera y la última entrega.
+    """
+    _get_store().reset(_key(message_id))
+    if queued_at is not None:
+        _get_store().set_fields(_key(message_id), {'queued_at': int(queued_at * 1000)})
+
+
+def set_queued(message_id, queued_by_channel):
+    """
+    Registra cuántos destinatarios se encolaron por canal al terminar el fan-out.
+    Devuelve True si todos los lotes ya habían terminado (la campaña está completa).
+    """
+    total = sum(queued_by_channel.values())
+    fields = {f"{channel}:queued": count for channel, count in queued_by_channel.items()}
+    fields['total'] = total
+    done = _get_store().set_fields(_key(message_id), fields)
+    return done >= total
+
+
+def record(message_id, channel, sent=0, failed=0, skipped=0):
+    """
+    Suma resultados definitivos de un canal. Devuelve True solo para la llamada que
+    completa la campaña (done pasa a ser igual a total).
+    """
+    amount = sent + failed + skipped
+    if not amount:
+        return False
+    fields = {f"{channel}:{status}": count for status, count in zip(STATUSES, (sent, failed, skipped)) if count}
+    fields['done'] = amount
+    done, total = _get_store().increment(_key(message_id), fields)
+    return total is not None and done - amount < total <= done
+
+
+def get(message_id):
+    """
+    Devuelve {'total', 'done', 'queued_at', 'channels': {canal: {'queued', 'sent', 'failed', 'skipped'}}}
+    o None si no hay contadores para el mensaje. Coste constante: una lectura de hash.
+    """
+    data = _get_store().get_all(_key(message_id))
+    if not data:
+        return None
+    channels = {}
+    for field, value in data.items():
+        channel, sep, status = field.partition(':')
+        if sep:
+            channels.setdefault(channel, dict.fromkeys(('queued',) + STATUSES, 0))[status] = value
+    queued_at = data['queued_at'] / 1000 if 'queued_at' in data else None
+    return {'total': data.get('total'), 'done': data.get('done', 0), 'queued_at': queued_at, 'channels': channels}
+
+
+def send_rate(message_id, done, started_at=None):
+    """
+    Resultados por segundo de una campaña, suavizados entre consultas sucesivas. Guarda la
+    última muestra (hora, done, tasa) en la caché de Django y solo la renueva si ha pasado
+    al menos un segundo; sin muestra previa usa la media desde `started_at` (epoch).
+    Coste constante: una lectura y como mucho una escritura en la caché.
+    """
+    key = f"messaging:progress-rate:{message_id}"
+    now = time.time()
+    average = done / (now - started_at) if started_at and done and now > started_at else None
+    sample = cache.get(key)
+    if sample is not None and now - sample[0] < _RATE_MIN_INTERVAL:
+        return sample[2] if sample[2] is not None else average
+    if sample is None:
+        rate = average
+    else:
+        last_at, last_done, last_rate = sample
+        current = max(done - last_done, 0) / (now - last_at)
+        rate = current if last_rate is None else (current + last_rate) / 2
+    cache.set(key, (now, done, rate), _RATE_SAMPLE_TTL)
+    return rate
@@ -0,0 +1,184 @@
+"""
+Limitador de tasa (token bucket) compartido por todo el clúster, con un bucket por
+canal y cuenta emisora. El estado vive en Redis (el mismo broker de Celery) y se
+actualiza con un script Lua atómico; con MESSAGING_RATE_LIMIT_BACKEND='memory'
+(tests, desarrollo) o si Redis no responde se usa un bucket en memoria del proceso.
+
+Los buckets funcionan por reserva: cada llamada descuenta sus tokens aunque el saldo
+quede negativo y devuelve cuánto debe esperar el llamador. Así los workers se
+reparten la tasa en orden de llegada sin sondear Redis en bucle.
+"""
+import logging
+import os
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_RESERVE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens < requested then
+    wait = (requested - tokens) / rate
+end
+if wait <= max_wait then
+    tokens = tokens - requested
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class RateLimitTimeout(ConnectionError):
+    """No hay tokens disponibles dentro de MESSAGING_RATE_LIMIT_MAX_WAIT; el envío debe reintentarse más tarde."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after # Segundos hasta que habría tokens para este envío
+
+
+def parse_rate(value):
+    """Convierte 'tasa/ráfaga' (p. ej. '2.5/50') en (tokens por segundo, capacidad). None si está desactivado."""
+    if not value or value in ('0', 'off'):
+        return None
+    rate, _, burst = str(value).partition('/')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+class MemoryTokenBucket:
+    """Buckets en memoria del proceso; misma semántica de reserva que el script Lua."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, rate, capacity, tokens, max_wait):
+        now = time.monotonic()
+        with self._lock:
+            available, ts = self._buckets.get(key, (capacity, now))
+            available = min(capacity, available + max(0.0, now - ts) * rate)
+            wait = (tokens - available) / rate if available < tokens else 0.0
+            if wait <= max_wait:
+                available -= tokens
+            self._buckets[key] = (available, now)
+        return wait
+
+
+class RedisTokenBucket:
+    """Buckets en Redis compartidos por todos los workers."""
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self._script = self._client.register_script(_RESERVE_SCRIPT)
+
+    def reserve(self, key, rate, capacity, tokens, max_wait):
+        return float(self._script(keys=[key], args=[rate, capacity, tokens, max_wait]))
+
+
+_backend_lock = threading.Lock()
+_backend = {'pid': None, 'bucket': None, 'fallback': None, 'warned': False}
+
+
+def _get_buckets():
+    """Devuelve (bucket principal, bucket de respaldo en memoria) del proceso actual."""
+    pid = os.getpid()
+    if _backend['pid'] != pid:
+        with _backend_lock:
+            if _backend['pid'] != pid:
+                fallback = MemoryTokenBucket()
+                if settings.MESSAGING_RATE_LIMIT_BACKEND == 'redis':
+                    bucket = RedisTokenBucket(settings.MESSAGING_RATE_LIMIT_REDIS_URL)
+                else:
+                    bucket = fallback
+                _backend.update(pid=pid, bucket=bucket, fallback=fallback, warned=False)
+    return _backend['bucket'], _backend['fallback']
+
+
+def _limit(channel):
+    """(tokens por segundo, capacidad) del canal, o None si no se limita."""
+    if settings.MESSAGING_RATE_LIMIT_BACKEND == 'off':
+        return None
+    return parse_rate(settings.MESSAGING_RATE_LIMITS.get(channel))
+
+
+def _reserve(channel, account, tokens):
+    """Reserva `tokens` del bucket (canal, cuenta) y devuelve los segundos a esperar."""
+    limit = _limit(channel)
+    if limit is None:
+        return 0.0
+    rate, capacity = limit
+    max_wait = settings.MESSAGING_RATE_LIMIT_MAX_WAIT
+    key = f"messaging:ratelimit:{channel}:{account or 'default'}"
+
+    bucket, fallback = _get_buckets()
+    try:
+        wait = bucket.reserve(key, rate, capacity, tokens, max_wait)
+    except redis.RedisError as e:
+        if not _backend['warned']:
+            logger.error(f"Rate limiter Redis unavailable, falling back to per-process buckets: {e}")
+            _backend['warned'] = True
+        wait = fallback.reserve(key, rate, capacity, tokens, max_wait)
+
+    if wait > max_wait:
+        raise RateLimitTimeout(
+            f"Rate limit for {channel}:{account} would require waiting {wait:.1f}s (max {max_wait}s).",
+            retry_after=wait,
+        )
+    return wait
+
+
+def acquire(channel, account, tokens=1):
+    """Bloquea hasta disponer de `tokens` envíos para el canal y la cuenta emisora."""
+    wait = _reserve(channel, account, tokens)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def schedule(channel, account, tokens):
+    """
+    Reserva hasta `tokens` envíos y devuelve, para cada envío concedido, los segundos que
+    debe esperar antes de enviarse para respetar la tasa. Se reserva en tramos de como
+    mucho la capacidad del bucket (una llamada a Redis por tramo): un lote mayor que
+    capacidad + tasa * MESSAGING_RATE_LIMIT_MAX_WAIT no cabría nunca de una vez, así que
+    se conceden los primeros envíos y el llamador aplaza el resto. RateLimitTimeout si
+    no se concede ninguno.
+    """
+    limit = _limit(channel)
+    if limit is None:
+        return [0.0] * tokens
+    rate, capacity = limit
+    step = max(int(capacity), 1)
+    delays = []
+    while len(delays) < tokens:
+        size = min(step, tokens - len(delays))
+        try:
+            wait = _reserve(channel, account, size)
+        except RateLimitTimeout:
+            if delays:
+                break
+            raise
+        # El token i-ésimo del tramo está disponible (size - 1 - i) / rate antes que el último
+        delays.extend(max(wait - (size - 1 - i) / rate, 0.0) for i in range(size))
+    return delays
+
+
+def partial_grant_error(channel, account, requested, delays):
+    """Error de los envíos que `schedule` no concedió: se aplazan hasta que salgan los concedidos."""
+    return RateLimitTimeout(
+        f"Rate limit for {channel}:{account} granted {len(delays)} of {requested} sends within the max wait.",
+        retry_after=max(delays[-1], 1.0),
+    )
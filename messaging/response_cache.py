@@ -0,0 +1,47 @@
+"""
+Caché opcional de la representación de detalle de la API (mensajes y suscriptores).
+
+Cada entrada guarda (etag, datos) bajo una clave por objeto; la vista solo la usa si el
+ETag calculado en la petición coincide, así que una entrada desfasada nunca se sirve.
+Además se borra al guardar o eliminar el objeto en este proceso. Se activa con
+API_RESPONSE_CACHE_TIMEOUT > 0; para compartirla entre procesos configura
+API_RESPONSE_CACHE_URL (Redis).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Message, Subscriber
+
+
+def _key(model, pk):
+    return f"messaging:api:{model._meta.model_name}:{pk}"
+
+
+def get_cached_response(model, pk, etag):
+    """Datos serializados de la versión `etag` del objeto, o None."""
+    if not settings.API_RESPONSE_CACHE_TIMEOUT:
+        return None
+    entry = cache.get(_key(model, pk))
+    if entry is not None and entry[0] == etag:
+        return entry[1]
+    return None
+
+
+def cache_response(model, pk, etag, data):
+    if settings.API_RESPONSE_CACHE_TIMEOUT:
+        cache.set(_key(model, pk), (etag, data), settings.API_RESPONSE_CACHE_TIMEOUT)
+
+
+def invalidate_response(model, pk):
+    if settings.API_RESPONSE_CACHE_TIMEOUT:
+        cache.delete(_key(model, pk))
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+@receiver(post_save, sender=Subscriber)
+@receiver(post_delete, sender=Subscriber)
+def _drop_cached_response(sender, instance, **kwargs):
+    invalidate_response(sender, instance.pk)
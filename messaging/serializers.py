@@ -1,7 +1,27 @@
 from rest_framework import serializers
-from .models import Subscriber, Message
+from rest_framework.reverse import reverse
+from .models import Subscriber, SubscriberImport, Message
 
-class SubscriberSerializer(serializers.ModelSerializer):
+
+def requested_fields(request):
+    """Conjunto de campos pedidos con `?fields=a,b` en una petición GET, o None si no se limitan."""
+    if request is None or request.method != 'GET' or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',') if name.strip()}
+
+
+class SparseFieldsetSerializerMixin:
+    """Serializador que devuelve solo los campos pedidos con `?fields=` (los desconocidos se ignoran)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+class SubscriberSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Subscriber
         fields = [
@@ -55,17 +75,52 @@ class SubscriberSerializer(serializers.ModelSerializer):
         return data
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class SubscriberImportSerializer(serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
+    errors_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SubscriberImport
+        fields = [
+            'id', 'format', 'status', 'status_display',
+            'processed_rows', 'imported_rows', 'duplicate_rows', 'failed_rows', 'errors_url', 'error',
+            'created_at', 'updated_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+    def get_errors_url(self, obj):
+        # Descarga del CSV de filas rechazadas (solo cuando hay errores)
+        if not obj.error_file:
+            return None
+        return reverse('subscriberimport-errors', args=[obj.pk], request=self.context.get('request'))
+
+
+class MessageSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    delivery_report = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
         fields = [
             'id', 'subject', 'body_html', 'body_text',
             'status', 'status_display', 'scheduled_at',
-            'created_at', 'updated_at', 'sent_to_report'
+            'created_at', 'updated_at', 'sent_to_report', 'delivery_report'
         ]
         # Hacer la mayoría de campos de solo lectura si la creación/edición es solo vía Admin
-        read_only_fields = ('id', 'status', 'status_display', 'created_at', 'updated_at', 'sent_to_report')
+        read_only_fields = ('id', 'status', 'status_display', 'created_at', 'updated_at', 'sent_to_report', 'delivery_report')
         # Permitir crear/editar estos campos vía API si se desea:
-        # read_only_fields = ('id', 'created_at', 'updated_at', 'status', 'status_display', 'sent_to_report')
\ No newline at end of file
+        # read_only_fields = ('id', 'created_at', 'updated_at', 'status', 'status_display', 'sent_to_report')
+
+    def get_delivery_report(self, obj):
+        # Recuento por canal y estado a partir de la tabla Delivery
+        return obj.delivery_report()
+
+
+class MessageListSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """Representación compacta para el listado: sin cuerpos, informe de envío ni recuento de entregas."""
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'subject', 'status', 'status_display', 'scheduled_at', 'created_at', 'updated_at']
+        read_only_fields = fields
@@ -1,6 +1,18 @@
 import os
+import asyncio
 import base64
+import binascii
+import datetime
+import email.utils
+import functools
 import logging
+import queue
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from email.message import Message as EmailMessage
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from google.oauth2.credentials import Credentials
@@ -8,20 +20,45 @@ from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from aiohttp import ClientError, ClientSession, TCPConnector
+from requests.exceptions import RequestException
 from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.http_client import TwilioHttpClient
 from twilio.base.exceptions import TwilioRestException
 from django.conf import settings
 from django.template.loader import render_to_string # Para plantillas HTML
 
+from . import circuitbreaker, metrics, ratelimit
+from .personalization import compile_template
+
+try:
+    import fcntl # Solo POSIX; en Windows se omite el bloqueo entre procesos del token
+except ImportError:
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# Máximo de llamadas por petición batch que admite la API de Gmail
+GMAIL_MAX_BATCH_SIZE = 100
+# Plantillas MIME de campaña guardadas por proceso (una por mensaje en envío)
+MIME_TEMPLATE_CACHE_SIZE = 16
+
 # --- Gmail Service ---
 
-def _get_gmail_service():
-    """Autentica y obtiene el objeto de servicio de la API de Gmail."""
-    creds = None
+# Caché a nivel de proceso del servicio Gmail. Las credenciales se comparten entre
+# hilos del proceso (se renuevan in-place), pero el objeto `service` se guarda por hilo
+# porque httplib2 (usado por googleapiclient) no es thread-safe.
+_gmail_lock = threading.RLock()
+_gmail_refresh_lock = threading.Lock() # Serializa las renovaciones sin bloquear el camino de envío
+_gmail_stats_lock = threading.Lock()
+_gmail_state = {'pid': None, 'generation': 0, 'creds': None, 'token_path': None, 'timer': None}
+_gmail_local = threading.local()
+_gmail_cache_stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_failures': 0}
+
 
-    # --- INICIO DE CAMBIOS ---
+def _gmail_token_paths():
+    """Devuelve las rutas absolutas (token, credenciales) configuradas para Gmail."""
     # Construir rutas absolutas desde BASE_DIR
     base_dir = settings.BASE_DIR
     token_filename = settings.GMAIL_TOKEN_FILE # Nombre del archivo desde .env
@@ -30,22 +67,69 @@ def _get_gmail_service():
     # Asegurarse de que los nombres de archivo están definidos
     if not token_filename or not creds_filename:
          logger.error("GMAIL_TOKEN_FILE or GMAIL_CREDENTIALS_FILE setting is missing.")
-         # Podrías lanzar un error aquí o simplemente retornar None más abajo
-         # return None # O manejarlo más adelante
 
     token_path = os.path.join(base_dir, token_filename) if token_filename else None
     creds_path = os.path.join(base_dir, creds_filename) if creds_filename else None
+    return token_path, creds_path
+
+
+def _seconds_to_expiry(creds):
+    """Segundos hasta que expire el access token (None si no se conoce la expiración)."""
+    if not creds or not creds.expiry:
+        return None
+    expiry = creds.expiry
+    if expiry.tzinfo is not None: # google-auth usa datetimes UTC naive
+        expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (expiry - now).total_seconds()
+
+
+@contextmanager
+def _token_file_lock(token_path):
+    """Bloqueo exclusivo entre procesos sobre el archivo de token (no-op sin fcntl, p. ej. Windows)."""
+    if fcntl is None or not token_path:
+        yield
+        return
+    with open(f"{token_path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_gmail_token(token_path, creds):
+    """Escribe el token de forma atómica (archivo temporal + os.replace)."""
+    token_dir = os.path.dirname(token_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=token_dir, prefix='.token-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(creds.to_json())
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, token_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Gmail token saved to {token_path}")
+
+
+def _load_gmail_credentials(token_path, creds_path):
+    """Carga las credenciales desde token.json, renovándolas o lanzando el flujo OAuth si hace falta."""
+    creds = None
 
     # El archivo token.json almacena los tokens de acceso y actualización del usuario,
     # y se crea automáticamente cuando el flujo de autorización se completa por primera vez.
-    if os.path.exists(token_path):
+    if token_path and os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, settings.GMAIL_SCOPES)
 
     # Si no hay credenciales (válidas) disponibles, permite que el usuario inicie sesión.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             try:
-                creds.refresh(Request())
+                _refresh_gmail_credentials(creds, token_path)
+                return creds
             except Exception as e:
                  logger.error(f"Failed to refresh Gmail token: {e}")
                  # Podríamos necesitar re-autenticación manual
@@ -55,7 +139,7 @@ def _get_gmail_service():
                  creds = flow.run_local_server(port=0) # O flow.run_console()
         else:
             # Iniciar el flujo de autenticación si no hay token o refresh token
-            if not os.path.exists(creds_path):
+            if not creds_path or not os.path.exists(creds_path):
                  logger.error(f"Gmail credentials file not found at {creds_path}")
                  return None
             try:
@@ -68,20 +152,141 @@ def _get_gmail_service():
 
         # Guarda las credenciales para la próxima ejecución
         try:
-            with open(token_path, 'w') as token_file:
-                token_file.write(creds.to_json())
-            logger.info(f"Gmail token saved to {token_path}")
+            with _token_file_lock(token_path):
+                _write_gmail_token(token_path, creds)
         except Exception as e:
              logger.error(f"Failed to save Gmail token: {e}")
 
+    return creds
 
-    if not creds or not creds.valid:
-         logger.error("Failed to obtain valid Gmail credentials.")
-         return None
+
+def _refresh_gmail_credentials(creds, token_path):
+    """
+    Renueva `creds` in-place y persiste el nuevo token. Bajo el lock de archivo se relee
+    token.json primero: si otro worker ya lo renovó, se adopta ese token en lugar de
+    pedir uno nuevo a Google.
+    """
+    margin = settings.GMAIL_TOKEN_REFRESH_MARGIN
+    with _gmail_refresh_lock, _token_file_lock(token_path):
+        if token_path and os.path.exists(token_path):
+            try:
+                disk_creds = Credentials.from_authorized_user_file(token_path, settings.GMAIL_SCOPES)
+                remaining = _seconds_to_expiry(disk_creds)
+                if disk_creds.token != creds.token and remaining is not None and remaining > margin:
+                    creds.token = disk_creds.token
+                    creds.expiry = disk_creds.expiry
+                    logger.info("Gmail token already refreshed by another worker; reusing it.")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not re-read Gmail token file before refresh: {e}")
+
+        creds.refresh(Request())
+        _bump_gmail_stat('refreshes')
+        if token_path:
+            _write_gmail_token(token_path, creds)
+
+
+def _schedule_gmail_refresh():
+    """Programa la renovación en segundo plano un margen antes de que expire el token."""
+    with _gmail_lock:
+        if _gmail_state['timer'] is not None:
+            _gmail_state['timer'].cancel()
+            _gmail_state['timer'] = None
+
+        creds = _gmail_state['creds']
+        remaining = _seconds_to_expiry(creds)
+        if remaining is None or not creds.refresh_token:
+            return
+        delay = max(remaining - settings.GMAIL_TOKEN_REFRESH_MARGIN, 0)
+        timer = threading.Timer(delay, _background_gmail_refresh, args=(_gmail_state['generation'],))
+        timer.daemon = True
+        _gmail_state['timer'] = timer
+        timer.start()
+
+
+def _background_gmail_refresh(generation):
+    """Callback del Timer: renueva el token compartido sin bloquear a los envíos."""
+    with _gmail_lock:
+        if generation != _gmail_state['generation'] or _gmail_state['creds'] is None:
+            return # La caché se reinició (fork o reset) desde que se programó
+        creds, token_path = _gmail_state['creds'], _gmail_state['token_path']
+    try:
+        _refresh_gmail_credentials(creds, token_path)
+    except Exception as e:
+        _bump_gmail_stat('refresh_failures')
+        logger.error(f"Background Gmail token refresh failed: {e}")
+        return
+    _schedule_gmail_refresh()
+
+
+def _reset_gmail_state_if_forked():
+    """Descarta la caché heredada del proceso padre (workers prefork de Celery)."""
+    pid = os.getpid()
+    if _gmail_state['pid'] != pid:
+        with _gmail_lock:
+            if _gmail_state['pid'] != pid:
+                _gmail_state.update(pid=pid, creds=None, token_path=None, timer=None)
+                _gmail_state['generation'] += 1
+
+
+def reset_gmail_service_cache():
+    """Invalida la caché de Gmail del proceso actual (p. ej. tras cambiar token.json a mano)."""
+    with _gmail_lock:
+        if _gmail_state['timer'] is not None:
+            _gmail_state['timer'].cancel()
+        _gmail_state.update(creds=None, token_path=None, timer=None)
+        _gmail_state['generation'] += 1
+
+
+def _bump_gmail_stat(name):
+    with _gmail_stats_lock:
+        _gmail_cache_stats[name] += 1
+
+
+def get_gmail_cache_stats():
+    """Devuelve una copia de los contadores hits/misses/refreshes de la caché de Gmail."""
+    with _gmail_stats_lock:
+        return dict(_gmail_cache_stats)
+
+
+def _get_gmail_service():
+    """
+    Devuelve el servicio de la API de Gmail cacheado para este proceso/hilo.
+    Solo se lee token.json y se construye el servicio en el primer uso; el token
+    se renueva en segundo plano antes de expirar.
+    """
+    _reset_gmail_state_if_forked()
+
+    cached = getattr(_gmail_local, 'service', None)
+    creds = _gmail_state['creds']
+    if cached is not None and creds is not None and _gmail_local.generation == _gmail_state['generation']:
+        if not creds.valid:
+            # El Timer no llegó a tiempo (p. ej. worker suspendido): renovar de forma síncrona
+            try:
+                _refresh_gmail_credentials(creds, _gmail_state['token_path'])
+            except Exception as e:
+                logger.error(f"Failed to refresh Gmail token: {e}")
+                reset_gmail_service_cache()
+                return None
+            _schedule_gmail_refresh()
+        _bump_gmail_stat('hits')
+        return cached
+
+    _bump_gmail_stat('misses')
+    with _gmail_lock:
+        if _gmail_state['creds'] is None:
+            token_path, creds_path = _gmail_token_paths()
+            creds = _load_gmail_credentials(token_path, creds_path)
+            if not creds or not creds.valid:
+                 logger.error("Failed to obtain valid Gmail credentials.")
+                 return None
+            _gmail_state.update(creds=creds, token_path=token_path)
+            _schedule_gmail_refresh()
+        creds = _gmail_state['creds']
+        generation = _gmail_state['generation']
 
     try:
-        service = build('gmail', 'v1', credentials=creds)
-        return service
+        service = build('gmail', 'v1', credentials=creds, cache_discovery=False)
     except HttpError as error:
         logger.error(f'An error occurred building Gmail service: {error}')
         return None
@@ -89,115 +294,590 @@ def _get_gmail_service():
         logger.error(f'An unexpected error occurred building Gmail service: {e}')
         return None
 
-def send_email_message(to_email, subject, body_html, body_text):
-    """Envía un correo electrónico usando la API de Gmail."""
+    _gmail_local.service = service
+    _gmail_local.generation = generation
+    return service
+
+class SendResult(namedtuple('SendResult', ['recipient', 'provider_id', 'error'])):
+    """Resultado de un envío individual dentro de un lote: ID del proveedor o la excepción."""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class SendError(Exception):
+    """Error de envío ya clasificado (ver PermanentSendError y TransientSendError)."""
+
+
+class PermanentSendError(SendError, ValueError):
+    """El envío no puede tener éxito aunque se reintente (destinatario inválido, plantilla requerida...)."""
+
+
+class TransientSendError(SendError, ConnectionError):
+    """Fallo temporal (429, 5xx, red): se puede reintentar. `retry_after`: segundos indicados por el proveedor."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(TransientSendError):
+    """El circuito del proveedor está abierto: el envío se aplaza sin llamar a la API."""
+
+
+# Razones de un 403 de Gmail que indican cuota agotada (temporal), no falta de permisos
+GMAIL_RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded', b'dailyLimitExceeded')
+# Códigos Twilio temporales aunque lleguen con un estado 4xx
+TWILIO_TRANSIENT_CODES = {20429, 20003, 30001}
+
+
+def _parse_retry_after(value):
+    """Segundos de una cabecera Retry-After (número o fecha HTTP), o None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+def _gmail_error(error):
+    """Clasifica un HttpError de Gmail (o un error de red) como permanente o temporal."""
+    if not isinstance(error, HttpError):
+        return TransientSendError(f"Gmail API error: {error}")
+    status = error.resp.status
+    if status == 429 or status >= 500 or (
+        status == 403 and any(reason in error.content for reason in GMAIL_RATE_LIMIT_REASONS)
+    ):
+        return TransientSendError(f"Gmail API error: {error}", retry_after=_parse_retry_after(error.resp.get('retry-after')))
+    if status in (401, 408):
+        return TransientSendError(f"Gmail API error: {error}") # Credenciales caducadas / timeout
+    return PermanentSendError(f"Gmail API error: {error}") # 400 (dirección inválida), 403, 404...
+
+
+def _twilio_error(error):
+    """Clasifica un TwilioRestException: 429/5xx temporales, el resto de 4xx permanentes (21211, 21610, 63016...)."""
+    if error.status == 429 or error.status >= 500 or error.code in TWILIO_TRANSIENT_CODES:
+        return TransientSendError(f"Twilio API error: {error}")
+    return PermanentSendError(f"Twilio API error: {error}")
+
+
+def _provider_failed(error):
+    """Fallo del proveedor o de la red (no cuentan los locales, p. ej. sin cliente libre en el pool)."""
+    return isinstance(error, TransientSendError) and error.__cause__ is not None
+
+
+def _provider_answered(result):
+    return result.ok or (isinstance(result.error, PermanentSendError) and result.error.__cause__ is not None)
+
+
+def _check_circuit(provider, account):
+    """Estado del circuito antes de llamar al proveedor; CircuitOpenError si está abierto."""
+    state, wait = circuitbreaker.check(provider, account)
+    if wait > 0:
+        raise CircuitOpenError(f"{provider} circuit open for {account}, retry in {wait:.0f}s.", retry_after=wait)
+    return state
+
+
+def _report_circuit(provider, account, state, results):
+    """
+    Informa al circuito del resultado de una petición al proveedor (uno o varios envíos).
+    Una prueba que no llegó al proveedor (error local, límite de tasa) se libera.
+    """
+    results = [result for result in results if result is not None]
+    if any(_provider_answered(result) for result in results):
+        if state != circuitbreaker.CLOSED:
+            circuitbreaker.record(provider, account, ok=True)
+    elif any(_provider_failed(result.error) for result in results):
+        circuitbreaker.record(provider, account, ok=False)
+    elif state == circuitbreaker.PROBE:
+        circuitbreaker.release(provider, account)
+
+
+@contextmanager
+def _circuit(provider, account):
+    """Envuelve un envío individual: lo rechaza con el circuito abierto e informa de su resultado."""
+    state = _check_circuit(provider, account)
+    try:
+        yield
+    except Exception as e:
+        _report_circuit(provider, account, state, [SendResult(None, None, e)])
+        raise
+    _report_circuit(provider, account, state, [SendResult(None, '', None)])
+
+
+def _render_mime(sender, subject, body_html, body_text, to_email=None):
+    """Construye el mensaje MIME multipart (texto plano + HTML) y devuelve sus bytes."""
+    # Crear un mensaje multipart para incluir HTML y texto plano
+    message = MIMEMultipart('alternative')
+    if to_email is not None:
+        message['to'] = to_email
+    message['from'] = sender
+    message['subject'] = subject
+
+    # Adjuntar parte de texto plano
+    part_text = MIMEText(body_text, 'plain', _charset='utf-8') # Especificar charset
+    message.attach(part_text)
+
+    # Adjuntar parte HTML si existe
+    if body_html:
+        part_html = MIMEText(body_html, 'html', _charset='utf-8') # Especificar charset
+        message.attach(part_html)
+
+    return message.as_bytes()
+
+
+def _encode_body(body):
+    """Cuerpo en base64 con líneas de 76 caracteres, igual que lo codifica MIMEText con utf-8."""
+    encoded = binascii.b2a_base64(body.encode(), newline=False)
+    if not encoded:
+        return b''
+    return b'\n'.join([encoded[i:i + 76] for i in range(0, len(encoded), 76)]) + b'\n'
+
+
+class _MimeTemplate:
+    """
+    Mensaje MIME de una campaña construido y codificado en base64url una sola vez.
+    Solo la cabecera To cambia entre destinatarios: se antepone ya codificada, rellenada
+    con espacios (FWS) hasta un múltiplo de 3 bytes para que su base64 se pueda
+    concatenar con el del resto del mensaje sin recodificarlo.
+
+    Si los cuerpos llevan variables por suscriptor se usa en su lugar un esqueleto con
+    huecos para los cuerpos (cabeceras y fronteras MIME generadas una vez): por
+    destinatario solo se codifican los cuerpos ya renderizados y el mensaje completo.
+    """
+    _TEXT_SLOT = '\x00personalization-text\x00'
+    _HTML_SLOT = '\x00personalization-html\x00'
+
+    def __init__(self, sender, subject, body_html, body_text):
+        self._parts = (sender, subject, body_html, body_text)
+        self._encoded_rest = None
+        self._skeleton = None
+
+    @staticmethod
+    def _to_header(to_email):
+        if to_email.isascii() and '\r' not in to_email and '\n' not in to_email:
+            value = to_email.encode()
+        else:
+            # Mismo formato (y validación) que aplica el paquete email a la cabecera
+            header = EmailMessage()
+            header['to'] = to_email
+            value = header.as_bytes()[len(b'to: '):].rstrip(b'\n')
+        padding = 1 + (-(len(b'to: ') + len(value) + 1)) % 3
+        return b'to:' + b' ' * padding + value + b'\n'
+
+    def _get_skeleton(self):
+        """(antes, entre, después) de los cuerpos de texto y HTML en el mensaje MIME."""
+        if self._skeleton is None:
+            sender, subject, body_html, _body_text = self._parts
+            raw = _render_mime(sender, subject, self._HTML_SLOT if body_html else None, self._TEXT_SLOT)
+            head, tail = raw.split(_encode_body(self._TEXT_SLOT), 1)
+            middle, end = tail.split(_encode_body(self._HTML_SLOT), 1) if body_html else (tail, b'')
+            self._skeleton = (head, middle, end)
+        return self._skeleton
+
+    def render(self, to_email, body_text=None, body_html=None):
+        """
+        Mensaje completo para `to_email`, codificado en base64url. `body_text` y
+        `body_html` sustituyen a los cuerpos de la campaña (ya personalizados).
+        """
+        if body_text is None and body_html is None:
+            if self._encoded_rest is None:
+                self._encoded_rest = base64.urlsafe_b64encode(_render_mime(*self._parts)).decode()
+            return base64.urlsafe_b64encode(self._to_header(to_email)).decode() + self._encoded_rest
+
+        _sender, _subject, default_html, default_text = self._parts
+        body_text = default_text if body_text is None else body_text
+        head, middle, end = self._get_skeleton()
+        raw = [self._to_header(to_email), head, _encode_body(body_text), middle]
+        if default_html:
+            body_html = default_html if body_html is None else body_html
+            raw.append(_encode_body(body_html))
+        raw.append(end)
+        return base64.urlsafe_b64encode(b''.join(raw)).decode()
+
+
+@functools.lru_cache(maxsize=MIME_TEMPLATE_CACHE_SIZE)
+def _get_mime_template(sender, subject, body_html, body_text):
+    # Los str de un MessageSnapshot guardan su hash: la búsqueda no recorre los cuerpos
+    return _MimeTemplate(sender, subject, body_html, body_text)
+
+
+def _build_raw_email(to_email, sender, subject, body_html, body_text, context=None):
+    """
+    Devuelve el mensaje para `to_email` codificado en base64url, a partir de la plantilla
+    MIME de la campaña. Con `context` se sustituyen las variables de los cuerpos; si no
+    tienen ninguna se usa el mensaje ya codificado.
+    """
+    template = _get_mime_template(sender, subject, body_html, body_text)
+    if context is None:
+        return template.render(to_email)
+    text_template = compile_template(body_text)
+    html_template = compile_template(body_html)
+    if text_template.is_static and html_template.is_static:
+        return template.render(to_email)
+    return template.render(
+        to_email,
+        body_text=text_template.render(context),
+        body_html=html_template.render(context, html=True) if body_html else None,
+    )
+
+
+def send_email_message(to_email, subject, body_html, body_text, context=None):
+    """Envía un correo electrónico usando la API de Gmail (`context`: variables del suscriptor)."""
     service = _get_gmail_service()
     if not service:
         logger.error(f"Could not get Gmail service. Email to {to_email} not sent.")
-        raise ConnectionError("Failed to connect to Gmail service.")
+        raise TransientSendError("Failed to connect to Gmail service.")
 
     sender = settings.GMAIL_SENDER_EMAIL
     if not sender:
          logger.error("GMAIL_SENDER_EMAIL setting is missing.")
          raise ValueError("Sender email address is not configured.")
 
-    try:
-        # Crear un mensaje multipart para incluir HTML y texto plano
-        message = MIMEMultipart('alternative')
-        message['to'] = to_email
-        message['from'] = sender
-        message['subject'] = subject
+    with _circuit('gmail', sender):
+        ratelimit.acquire('email', sender)
+        try:
+            create_message = {'raw': _build_raw_email(to_email, sender, subject, body_html, body_text, context)}
+
+            # Enviar el mensaje
+            started = time.perf_counter()
+            try:
+                send_message = (service.users().messages().send(userId='me', body=create_message).execute())
+            finally:
+                metrics.observe_provider_latency('email', time.perf_counter() - started)
+            logger.info(f'Email sent successfully to {to_email}. Message ID: {send_message["id"]}')
+            return send_message['id']
+
+        except HttpError as error:
+            logger.error(f'An HTTP error occurred sending email to {to_email}: {error}')
+            raise _gmail_error(error) from error
+        except (RequestException, OSError) as e:
+            logger.error(f'A network error occurred sending email to {to_email}: {e}')
+            raise _gmail_error(e) from e
+        except Exception as e:
+            logger.error(f'An unexpected error occurred sending email to {to_email}: {e}')
+            raise RuntimeError(f"Unexpected error sending email: {e}") from e
 
-        # Adjuntar parte de texto plano
-        part_text = MIMEText(body_text, 'plain', _charset='utf-8') # Especificar charset
-        message.attach(part_text)
 
-        # Adjuntar parte HTML si existe
-        if body_html:
-            part_html = MIMEText(body_html, 'html', _charset='utf-8') # Especificar charset
-            message.attach(part_html)
+def send_email_batch(to_emails, subject, body_html, body_text, contexts=None):
+    """
+    Envía el mismo correo a varios destinatarios agrupando hasta GMAIL_BATCH_SIZE
+    llamadas `messages.send` en cada petición HTTP batch de la API de Gmail.
+    `contexts`, si se indica, lleva las variables de cada destinatario (mismo orden).
+    Devuelve una lista de SendResult en el mismo orden que `to_emails`; los errores
+    de un destinatario no afectan al resto.
+    """
+    service = _get_gmail_service()
+    if not service:
+        logger.error(f"Could not get Gmail service. Batch of {len(to_emails)} emails not sent.")
+        raise TransientSendError("Failed to connect to Gmail service.")
+
+    sender = settings.GMAIL_SENDER_EMAIL
+    if not sender:
+         logger.error("GMAIL_SENDER_EMAIL setting is missing.")
+         raise ValueError("Sender email address is not configured.")
+
+    results = [None] * len(to_emails)
+    batch_size = min(max(settings.GMAIL_BATCH_SIZE, 1), GMAIL_MAX_BATCH_SIZE)
+
+    def _callback(request_id, response, exception):
+        index = int(request_id)
+        to_email = to_emails[index]
+        if exception is not None:
+            logger.error(f'An HTTP error occurred sending email to {to_email}: {exception}')
+            error = _gmail_error(exception)
+            error.__cause__ = exception
+            results[index] = SendResult(to_email, None, error)
         else:
-             # Si no hay HTML, el mensaje ya es texto plano
-             # (Aunque técnicamente sigue siendo multipart/alternative con una sola parte)
-             pass
+            logger.info(f'Email sent successfully to {to_email}. Message ID: {response["id"]}')
+            results[index] = SendResult(to_email, response['id'], None)
 
+    def _defer_from(first, error):
+        """Aplaza sin llamar a la API los correos desde `first` que aún no tienen resultado."""
+        for index in range(first, len(to_emails)):
+            if results[index] is None:
+                results[index] = SendResult(to_emails[index], None, error)
 
-        # Codificar el mensaje en base64url
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        create_message = {'raw': raw_message}
+    messages_api = service.users().messages()
+    start = 0
+    while start < len(to_emails):
+        try:
+            state = _check_circuit('gmail', sender)
+        except CircuitOpenError as e:
+            # Circuito abierto: aplazar el resto sin llamar a la API
+            logger.warning(f'{e} Deferring {len(to_emails) - start} emails.')
+            for index in range(start, len(to_emails)):
+                results[index] = SendResult(to_emails[index], None, e)
+            break
+        # Con el circuito semiabierto, un único correo de prueba decide si se envía el resto
+        end = start + 1 if state == circuitbreaker.PROBE else min(start + batch_size, len(to_emails))
+        indexes = range(start, end)
+        start = end
+        try:
+            raws = [] # (índice, mensaje codificado) de los correos que se pudieron construir
+            for index in indexes:
+                try:
+                    context = contexts[index] if contexts is not None else None
+                    raws.append((index, _build_raw_email(to_emails[index], sender, subject, body_html, body_text, context)))
+                except Exception as e:
+                    logger.error(f'An unexpected error occurred building email to {to_emails[index]}: {e}')
+                    results[index] = SendResult(to_emails[index], None, RuntimeError(f"Unexpected error sending email: {e}"))
 
-        # Enviar el mensaje
-        send_message = (service.users().messages().send(userId='me', body=create_message).execute())
-        logger.info(f'Email sent successfully to {to_email}. Message ID: {send_message["id"]}')
-        return send_message['id']
+            if not raws:
+                continue
+            try:
+                # Si el lote no cabe en la espera máxima del limitador se envían los correos concedidos
+                delays = ratelimit.schedule('email', sender, len(raws))
+                if delays[-1] > 0:
+                    time.sleep(delays[-1]) # La petición batch sale de una vez: esperar al último token
+                batch = service.new_batch_http_request(callback=_callback)
+                for index, raw in raws[:len(delays)]:
+                    batch.add(messages_api.send(userId='me', body={'raw': raw}), request_id=str(index))
+                started = time.perf_counter()
+                try:
+                    batch.execute()
+                finally:
+                    metrics.observe_provider_latency('email', time.perf_counter() - started)
+                if len(delays) < len(raws):
+                    e = ratelimit.partial_grant_error('email', sender, len(raws), delays)
+                    first = raws[len(delays)][0]
+                    logger.warning(f'Rate limit reached sending Gmail batch, deferring {len(to_emails) - first} emails: {e}')
+                    _defer_from(first, e)
+                    break
+            except ratelimit.RateLimitTimeout as e:
+                # Sin tokens a tiempo: el resto del lote se aplaza sin llamar a la API
+                logger.warning(f'Rate limit reached sending Gmail batch, deferring {len(to_emails) - indexes.start} emails: {e}')
+                _defer_from(indexes.start, e)
+                break
+        except Exception as e:
+                # Fallo de la petición batch completa: marcar como fallidos los que no tengan resultado
+                logger.error(f'Gmail batch request failed ({len(indexes)} emails): {e}')
+                for index in indexes:
+                    if results[index] is None:
+                        error = _gmail_error(e)
+                        error.__cause__ = e
+                        results[index] = SendResult(to_emails[index], None, error)
+        finally:
+            # También si el tramo no llegó a enviarse: una prueba sin informar bloquearía el circuito
+            _report_circuit('gmail', sender, state, [results[index] for index in indexes])
 
-    except HttpError as error:
-        logger.error(f'An HTTP error occurred sending email to {to_email}: {error}')
-        raise ConnectionError(f"Gmail API error: {error}") from error
-    except Exception as e:
-        logger.error(f'An unexpected error occurred sending email to {to_email}: {e}')
-        raise RuntimeError(f"Unexpected error sending email: {e}") from e
+    return results
 
 
 # --- Twilio Service ---
 
-def _get_twilio_client():
-    """Inicializa y devuelve el cliente Twilio."""
+def _apply_twilio_base_url(client):
+    """Redirige el cliente a TWILIO_API_BASE_URL si está configurado (servidores falsos en benchmarks)."""
+    if settings.TWILIO_API_BASE_URL:
+        client.api.base_url = settings.TWILIO_API_BASE_URL
+    return client
+
+
+class _PooledTwilioClient:
+    """Cliente Twilio con su propia sesión HTTP keep-alive y marca de último uso."""
+
+    def __init__(self, account_sid, auth_token):
+        self.http_client = TwilioHttpClient(pool_connections=True, timeout=settings.TWILIO_HTTP_TIMEOUT)
+        self.client = _apply_twilio_base_url(Client(account_sid, auth_token, http_client=self.http_client))
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.http_client.session is not None:
+            self.http_client.session.close()
+
+
+class _TwilioClientPool:
+    """
+    Pool de clientes Twilio por proceso. Cada cliente mantiene una sesión `requests`
+    con conexiones keep-alive; un cliente solo lo usa un hilo a la vez (TwilioHttpClient
+    guarda `last_response`), así que el mismo pool sirve para workers prefork (1 hilo)
+    y para workers con hilos (`--pool threads`).
+    """
+
+    def __init__(self, account_sid, auth_token, size, idle_timeout):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.size = max(size, 1)
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue() # LIFO: reutilizar primero la conexión más "caliente"
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, pooled):
+        # Las conexiones inactivas demasiado tiempo suelen haber sido cerradas por el servidor
+        return time.monotonic() - pooled.last_used < self.idle_timeout
+
+    def _discard(self, pooled):
+        pooled.close()
+        with self._lock:
+            self._created -= 1
+
+    def _acquire(self):
+        deadline = time.monotonic() + settings.TWILIO_POOL_ACQUIRE_TIMEOUT
+        wait = False # Primero sin esperar; solo se bloquea si el pool está lleno
+        while True:
+            try:
+                if wait:
+                    pooled = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+                else:
+                    pooled = self._idle.get_nowait()
+            except queue.Empty:
+                if wait:
+                    raise TransientSendError("Timed out waiting for a free Twilio client in the pool.")
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return _PooledTwilioClient(self.account_sid, self.auth_token)
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                wait = True
+                continue
+            # Misma comprobación tanto si estaba libre como si se obtuvo tras esperar
+            if self._is_healthy(pooled):
+                return pooled
+            logger.debug("Discarding idle Twilio client (keep-alive connection likely stale).")
+            self._discard(pooled)
+            wait = False # Se liberó un hueco: se puede crear un cliente nuevo
+
+    @contextmanager
+    def client(self):
+        """Presta un `twilio.rest.Client` del pool y lo devuelve al terminar."""
+        pooled = self._acquire()
+        try:
+            yield pooled.client
+        except RequestException:
+            # Error de red: la conexión puede estar rota, no devolverla al pool
+            self._discard(pooled)
+            raise
+        except BaseException:
+            pooled.last_used = time.monotonic()
+            self._idle.put(pooled)
+            raise
+        else:
+            pooled.last_used = time.monotonic()
+            self._idle.put(pooled)
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_twilio_pool_lock = threading.Lock()
+_twilio_pool = None
+
+
+def _get_twilio_pool():
+    """Devuelve el pool de clientes Twilio del proceso actual (compartido por SMS y WhatsApp)."""
+    global _twilio_pool
+    pool = _twilio_pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+
     account_sid = settings.TWILIO_ACCOUNT_SID
     auth_token = settings.TWILIO_AUTH_TOKEN
 
     if not account_sid or not auth_token:
         logger.error("Twilio credentials (SID or Auth Token) are missing.")
         return None
-    try:
-         client = Client(account_sid, auth_token)
-         return client
-    except Exception as e:
-         logger.error(f"Failed to initialize Twilio client: {e}")
-         return None
+
+    with _twilio_pool_lock:
+        # Re-crear tras un fork: las sesiones del padre no deben compartirse con los hijos
+        if _twilio_pool is None or _twilio_pool.pid != os.getpid():
+            _twilio_pool = _TwilioClientPool(
+                account_sid, auth_token,
+                size=settings.TWILIO_CLIENT_POOL_SIZE,
+                idle_timeout=settings.TWILIO_CLIENT_IDLE_TIMEOUT,
+            )
+        return _twilio_pool
 
 
-def send_sms_message(to_number, body_text):
-    """Envía un mensaje SMS usando Twilio."""
-    client = _get_twilio_client()
-    if not client:
-         raise ConnectionError("Failed to initialize Twilio client.")
+def reset_twilio_client_pool():
+    """Cierra las sesiones de Twilio (síncronas y asíncronas) del proceso actual; se recrean en el próximo envío."""
+    global _twilio_pool, _twilio_runner
+    with _twilio_pool_lock:
+        if _twilio_pool is not None and _twilio_pool.pid == os.getpid():
+            _twilio_pool.close()
+        _twilio_pool = None
+    with _twilio_runner_lock:
+        if _twilio_runner is not None and _twilio_runner.pid == os.getpid():
+            _twilio_runner.close()
+        _twilio_runner = None
+
+
+def send_sms_message(to_number, body_text, context=None):
+    """Envía un mensaje SMS usando Twilio (`context`: variables del suscriptor)."""
+    pool = _get_twilio_pool()
+    if not pool:
+         raise TransientSendError("Failed to initialize Twilio client.")
 
     from_number = settings.TWILIO_SMS_NUMBER
     if not from_number:
          raise ValueError("Twilio SMS sender number is not configured.")
 
     if not to_number:
-        raise ValueError("Recipient phone number is required for SMS.")
+        raise PermanentSendError("Recipient phone number is required for SMS.")
 
-    try:
-        message = client.messages.create(
-            body=body_text,
-            from_=from_number,
-            to=to_number
-        )
-        logger.info(f'SMS sent successfully to {to_number}. SID: {message.sid}')
-        return message.sid
-    except TwilioRestException as e:
-        logger.error(f'Twilio error sending SMS to {to_number}: {e}')
-        raise ConnectionError(f"Twilio API error: {e}") from e
-    except Exception as e:
-         logger.error(f'An unexpected error occurred sending SMS to {to_number}: {e}')
-         raise RuntimeError(f"Unexpected error sending SMS: {e}") from e
+    if context is not None:
+        body_text = compile_template(body_text).render(context)
+    with _circuit('twilio', from_number):
+        ratelimit.acquire('sms', from_number)
+        try:
+            with pool.client() as client:
+                started = time.perf_counter()
+                try:
+                    message = client.messages.create(
+                        body=body_text,
+                        from_=from_number,
+                        to=to_number
+                    )
+                finally:
+                    metrics.observe_provider_latency('sms', time.perf_counter() - started)
+            logger.info(f'SMS sent successfully to {to_number}. SID: {message.sid}')
+            return message.sid
+        except TwilioRestException as e:
+            logger.error(f'Twilio error sending SMS to {to_number}: {e}')
+            raise _twilio_error(e) from e
+        except TransientSendError:
+            raise # Sin cliente libre en el pool
+        except RequestException as e:
+            logger.error(f'A network error occurred sending SMS to {to_number}: {e}')
+            raise TransientSendError(f"Twilio network error: {e}") from e
+        except Exception as e:
+             logger.error(f'An unexpected error occurred sending SMS to {to_number}: {e}')
+             raise RuntimeError(f"Unexpected error sending SMS: {e}") from e
 
 
-def send_whatsapp_message(to_whatsapp_number, body_text):
-    """Envía un mensaje de WhatsApp usando Twilio."""
-    client = _get_twilio_client()
-    if not client:
-         raise ConnectionError("Failed to initialize Twilio client.")
+def send_whatsapp_message(to_whatsapp_number, body_text, context=None):
+    """Envía un mensaje de WhatsApp usando Twilio (`context`: variables del suscriptor)."""
+    pool = _get_twilio_pool()
+    if not pool:
+         raise TransientSendError("Failed to initialize Twilio client.")
 
     from_whatsapp_number = settings.TWILIO_WHATSAPP_NUMBER
     if not from_whatsapp_number:
          raise ValueError("Twilio WhatsApp sender number is not configured.")
 
     if not to_whatsapp_number or not to_whatsapp_number.startswith('whatsapp:'):
-        raise ValueError("Recipient WhatsApp number (starting with 'whatsapp:+') is required.")
+        raise PermanentSendError("Recipient WhatsApp number (starting with 'whatsapp:+') is required.")
 
     # --- ¡IMPORTANTE! Consideración sobre Plantillas de WhatsApp ---
     # Twilio (y WhatsApp Business API en general) a menudo requiere el uso de
@@ -209,18 +889,213 @@ def send_whatsapp_message(to_whatsapp_number, body_text):
     # Aquí, intentamos el envío directo con 'body' para simplicidad del ejemplo.
     # logger.warning("Sending WhatsApp message using 'body'. This might require pre-approved templates in production.")
 
-    try:
-        message = client.messages.create(
-            from_=from_whatsapp_number,
-            body=body_text,
-            to=to_whatsapp_number
-        )
-        logger.info(f'WhatsApp message sent successfully to {to_whatsapp_number}. SID: {message.sid}')
-        return message.sid
-    except TwilioRestException as e:
-        logger.error(f'Twilio error sending WhatsApp to {to_whatsapp_number}: {e}')
-        # Errores comunes aquí pueden ser 63016 (requiere plantilla) o 63003 (canal no conectado)
-        raise ConnectionError(f"Twilio API error: {e}") from e
-    except Exception as e:
-         logger.error(f'An unexpected error occurred sending WhatsApp to {to_whatsapp_number}: {e}')
-         raise RuntimeError(f"Unexpected error sending WhatsApp: {e}") from e
\ No newline at end of file
+    if context is not None:
+        body_text = compile_template(body_text).render(context)
+    with _circuit('twilio', from_whatsapp_number):
+        ratelimit.acquire('whatsapp', from_whatsapp_number)
+        try:
+            with pool.client() as client:
+                started = time.perf_counter()
+                try:
+                    message = client.messages.create(
+                        from_=from_whatsapp_number,
+                        body=body_text,
+                        to=to_whatsapp_number
+                    )
+                finally:
+                    metrics.observe_provider_latency('whatsapp', time.perf_counter() - started)
+            logger.info(f'WhatsApp message sent successfully to {to_whatsapp_number}. SID: {message.sid}')
+            return message.sid
+        except TwilioRestException as e:
+            logger.error(f'Twilio error sending WhatsApp to {to_whatsapp_number}: {e}')
+            # 63016 (requiere plantilla) o 63003 (canal no conectado) son permanentes: no se reintentan
+            raise _twilio_error(e) from e
+        except TransientSendError:
+            raise # Sin cliente libre en el pool
+        except RequestException as e:
+            logger.error(f'A network error occurred sending WhatsApp to {to_whatsapp_number}: {e}')
+            raise TransientSendError(f"Twilio network error: {e}") from e
+        except Exception as e:
+             logger.error(f'An unexpected error occurred sending WhatsApp to {to_whatsapp_number}: {e}')
+             raise RuntimeError(f"Unexpected error sending WhatsApp: {e}") from e
+
+
+# --- Twilio asíncrono (envíos por lotes) ---
+
+TWILIO_CHANNEL_SENDERS = {
+    'sms': 'TWILIO_SMS_NUMBER',
+    'whatsapp': 'TWILIO_WHATSAPP_NUMBER',
+}
+
+
+class _TwilioAsyncRunner:
+    """
+    Event loop propio del proceso, en un hilo en segundo plano, con una sesión aiohttp
+    (conexiones keep-alive) y un cliente Twilio que reutilizan todos los lotes. Las
+    tareas Celery, síncronas, le pasan corrutinas desde cualquier hilo.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='twilio-async', daemon=True)
+        self._thread.start()
+        self._clients = {} # (account_sid, auth_token, base_url) -> Client; solo se usa desde el loop
+
+    def client(self, account_sid, auth_token):
+        """Cliente asíncrono para las credenciales dadas (llamar desde el loop)."""
+        key = (account_sid, auth_token, settings.TWILIO_API_BASE_URL)
+        client = self._clients.get(key)
+        if client is None:
+            # La sesión aiohttp debe crearse dentro del event loop que la usa; sin límite
+            # propio de conexiones: cada lote limita las suyas con un semáforo
+            http_client = AsyncTwilioHttpClient(pool_connections=False, timeout=settings.TWILIO_HTTP_TIMEOUT)
+            http_client.session = ClientSession(connector=TCPConnector(limit=0))
+            client = self._clients[key] = _apply_twilio_base_url(Client(account_sid, auth_token, http_client=http_client))
+        return client
+
+    def run(self, coro):
+        """Ejecuta `coro` en el loop del proceso y espera su resultado."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        async def _close():
+            for client in self._clients.values():
+                await client.http_client.close()
+            self._clients.clear()
+
+        self.run(_close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+_twilio_runner_lock = threading.Lock()
+_twilio_runner = None
+
+
+def _get_twilio_runner():
+    global _twilio_runner
+    runner = _twilio_runner
+    if runner is not None and runner.pid == os.getpid():
+        return runner
+    with _twilio_runner_lock:
+        # Re-crear tras un fork: el hilo del loop no existe en el proceso hijo
+        if _twilio_runner is None or _twilio_runner.pid != os.getpid():
+            _twilio_runner = _TwilioAsyncRunner()
+        return _twilio_runner
+
+
+async def _send_twilio_batch_async(runner, channel, account_sid, auth_token, from_number, to_numbers, bodies, delays, concurrency):
+    """
+    Envía a cada número su texto de `bodies` con como mucho `concurrency` peticiones en
+    vuelo. `delays`: segundos que espera cada envío por el limitador de tasa (ya reservado).
+    """
+    client = runner.client(account_sid, auth_token)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _send_one(to_number, body_text, delay):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            try:
+                started = time.perf_counter()
+                try:
+                    message = await client.messages.create_async(from_=from_number, body=body_text, to=to_number)
+                finally:
+                    metrics.observe_provider_latency(channel, time.perf_counter() - started)
+            except TwilioRestException as e:
+                logger.error(f'Twilio error sending to {to_number}: {e}')
+                error = _twilio_error(e)
+                error.__cause__ = e
+                return SendResult(to_number, None, error)
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.error(f'A network error occurred sending to {to_number}: {e}')
+                error = TransientSendError(f"Twilio network error: {e}")
+                error.__cause__ = e
+                return SendResult(to_number, None, error)
+            except Exception as e:
+                logger.error(f'An unexpected error occurred sending to {to_number}: {e}')
+                error = RuntimeError(f"Unexpected error sending Twilio message: {e}")
+                error.__cause__ = e
+                return SendResult(to_number, None, error)
+            logger.info(f'Twilio message sent successfully to {to_number}. SID: {message.sid}')
+            return SendResult(to_number, message.sid, None)
+
+    return await asyncio.gather(*(_send_one(*args) for args in zip(to_numbers, bodies, delays)))
+
+
+def send_twilio_batch(channel, to_numbers, body_text, concurrency=None, contexts=None):
+    """
+    Envía el mismo texto por SMS o WhatsApp a varios destinatarios usando el cliente
+    HTTP asíncrono de Twilio (aiohttp), con hasta TWILIO_ASYNC_CONCURRENCY envíos en
+    vuelo desde un único proceso. `contexts`, si se indica, lleva las variables de cada
+    destinatario (mismo orden). Devuelve una lista de SendResult en el mismo orden
+    que `to_numbers`. Pensado para llamarse desde tareas Celery síncronas.
+    """
+    account_sid = settings.TWILIO_ACCOUNT_SID
+    auth_token = settings.TWILIO_AUTH_TOKEN
+    if not account_sid or not auth_token:
+        logger.error("Twilio credentials (SID or Auth Token) are missing.")
+        raise TransientSendError("Failed to initialize Twilio client.")
+
+    from_number = getattr(settings, TWILIO_CHANNEL_SENDERS[channel])
+    if not from_number:
+         raise ValueError(f"Twilio {channel} sender number is not configured.")
+
+    results = [None] * len(to_numbers)
+    pending = [] # (índice, número) de los destinatarios válidos
+    for index, to_number in enumerate(to_numbers):
+        if not to_number or (channel == 'whatsapp' and not to_number.startswith('whatsapp:')):
+            results[index] = SendResult(to_number, None, PermanentSendError(f"Invalid recipient for {channel}: {to_number!r}"))
+        else:
+            pending.append((index, to_number))
+
+    if pending:
+        template = compile_template(body_text)
+        if contexts is None or template.is_static:
+            bodies = [body_text] * len(pending)
+        else:
+            bodies = [template.render(contexts[index]) for index, _ in pending]
+    start = 0
+    while start < len(pending):
+        try:
+            state = _check_circuit('twilio', from_number)
+        except CircuitOpenError as e:
+            logger.warning(f'{e} Deferring {len(pending) - start} {channel} messages.')
+            for index, to_number in pending[start:]:
+                results[index] = SendResult(to_number, None, e)
+            break
+        # Con el circuito semiabierto, un único envío de prueba decide si se envía el resto
+        end = start + 1 if state == circuitbreaker.PROBE else len(pending)
+        sent = []
+        try:
+            try:
+                # Los tokens se reservan antes de entrar en el event loop, que nunca espera a Redis
+                delays = ratelimit.schedule(channel, from_number, end - start)
+            except ratelimit.RateLimitTimeout as e:
+                logger.warning(f'Rate limit reached, deferring {len(pending) - start} {channel} messages: {e}')
+                for index, to_number in pending[start:]:
+                    results[index] = SendResult(to_number, None, e)
+                break
+            granted = start + len(delays)
+            runner = _get_twilio_runner()
+            sent = runner.run(_send_twilio_batch_async(
+                runner, channel, account_sid, auth_token, from_number,
+                [to_number for _, to_number in pending[start:granted]], bodies[start:granted], delays,
+                concurrency or settings.TWILIO_ASYNC_CONCURRENCY,
+            ))
+            for (index, _), result in zip(pending[start:granted], sent):
+                results[index] = result
+            if granted < end:
+                # Lo que no cabe en la espera máxima del limitador se aplaza tras enviar lo concedido
+                e = ratelimit.partial_grant_error(channel, from_number, end - start, delays)
+                logger.warning(f'Rate limit reached, deferring {len(pending) - granted} {channel} messages: {e}')
+                for index, to_number in pending[granted:]:
+                    results[index] = SendResult(to_number, None, e)
+                break
+        finally:
+            # También si el tramo no llegó a enviarse: una prueba sin informar bloquearía el circuito
+            _report_circuit('twilio', from_number, state, sent)
+        start = end
+    return results
@@ -1,19 +1,293 @@
 import logging
-from celery import shared_task
+import random
+import time
+import uuid
+
+from celery import group, shared_task
+from celery.exceptions import Retry
+from django.conf import settings
+from django.db.models import Count, F, Value
+from django.db.models.functions import Concat
 from django.utils import timezone
-from django.db import transaction
 
-from .models import Message, Subscriber
-from .services import send_email_message, send_sms_message, send_whatsapp_message
+from redis.exceptions import RedisError
+
+from . import metrics, progress
+from .ratelimit import RateLimitTimeout
+from .importing import run_import
+from .message_cache import get_message_snapshot
+from .models import AUDIENCE_CONDITION, Delivery, Message, Subscriber, SubscriberImport
+from .personalization import compile_template, subscriber_context
+from .services import (
+    CircuitOpenError, PermanentSendError, SendResult, send_email_batch, send_email_message, send_sms_message, send_twilio_batch,
+    send_whatsapp_message,
+)
 
 logger = logging.getLogger(__name__)
 
+# Canales soportados: campo de suscripción, campo de contacto y etiqueta para logs/reportes
+CHANNELS = {
+    'email': ('subscribed_to_email', 'email', 'Email'),
+    'sms': ('subscribed_to_sms', 'phone_number', 'SMS'),
+    'whatsapp': ('subscribed_to_whatsapp', 'whatsapp_number', 'WA'),
+}
+
+
+def _send_to_channel(channel, message, contact, context=None):
+    """Envía `message` a `contact` por el canal indicado y devuelve el ID del proveedor."""
+    if channel == 'email':
+        return send_email_message(
+            to_email=contact,
+            subject=message.subject,
+            body_html=message.body_html,
+            body_text=message.body_text,
+            context=context
+        )
+    if channel == 'sms':
+        return send_sms_message(to_number=contact, body_text=message.body_text, context=context)
+    if channel == 'whatsapp':
+        return send_whatsapp_message(to_whatsapp_number=contact, body_text=message.body_text, context=context)
+    raise ValueError(f"Unknown channel '{channel}'.")
+
+
+def _is_personalized(channel, message):
+    """Si los cuerpos que usa el canal llevan variables por suscriptor."""
+    if not compile_template(message.body_text).is_static:
+        return True
+    return channel == 'email' and not compile_template(message.body_html).is_static
+
+
+def _send_batch_to_channel(channel, message, recipients, contexts=None):
+    """
+    Envía `message` a una lista de (subscriber_id, contacto) y devuelve pares
+    (subscriber_id, SendResult). `contexts` lleva las variables de personalización de
+    cada destinatario (mismo orden). El email usa peticiones batch de Gmail; SMS y
+    WhatsApp usan el cliente asíncrono de Twilio (o envíos uno a uno si
+    TWILIO_ASYNC_SENDS está desactivado).
+    """
+    if channel == 'email':
+        results = send_email_batch(
+            [contact for _, contact in recipients],
+            subject=message.subject,
+            body_html=message.body_html,
+            body_text=message.body_text,
+            contexts=contexts
+        )
+        return [(subscriber_id, result) for (subscriber_id, _), result in zip(recipients, results)]
+
+    if settings.TWILIO_ASYNC_SENDS:
+        results = send_twilio_batch(channel, [contact for _, contact in recipients], message.body_text, contexts=contexts)
+        return [(subscriber_id, result) for (subscriber_id, _), result in zip(recipients, results)]
+
+    outcomes = []
+    for index, (subscriber_id, contact) in enumerate(recipients):
+        try:
+            context = contexts[index] if contexts is not None else None
+            provider_id = _send_to_channel(channel, message, contact, context)
+            outcomes.append((subscriber_id, SendResult(contact, provider_id, None)))
+        except Exception as exc:
+            outcomes.append((subscriber_id, SendResult(contact, None, exc)))
+    return outcomes
+
+
+def _create_deliveries(message_id, channel, subscriber_ids):
+    """Crea las filas Delivery de un lote con un solo INSERT (las ya existentes se respetan)."""
+    Delivery.objects.bulk_create(
+        [Delivery(message_id=message_id, subscriber_id=sub_id, channel=channel) for sub_id in subscriber_ids],
+        ignore_conflicts=True,
+    )
+
+
+def _audience_queryset():
+    """Filas (id, suscrito, contacto × canal) de la audiencia, ordenadas por id para paginar por clave."""
+    columns = ['id']
+    for subscribed_field, contact_field, _ in CHANNELS.values():
+        columns += [subscribed_field, contact_field]
+    return Subscriber.objects.filter(AUDIENCE_CONDITION).order_by('id').values_list(*columns)
+
+
+def _dispatch_audience(message_id, checkpoint, chunk_size, skip_sent=False):
+    """
+    Recorre la audiencia en una sola pasada para los tres canales, paginando por clave
+    (id > cursor) con `values_list` y sin instanciar modelos. Por cada página crea las
+    filas Delivery, publica los lotes completos con un `group` y guarda en
+    `Message.dispatch_checkpoint` el último ID publicado de cada canal, de modo que si
+    el worker muere se puede continuar desde ahí. La memoria usada no depende del
+    tamaño de la audiencia (una página + un lote pendiente por canal).
+    Con `skip_sent` (reanudación de una campaña) no se publican los pares
+    (suscriptor, canal) que ya tienen una entrega 'sent'.
+    """
+    page_size = settings.MESSAGING_AUDIENCE_PAGE_SIZE
+    audience = _audience_queryset()
+
+    buffers = {channel: [] for channel in CHANNELS}
+    cursor = min(checkpoint.get(channel, 0) for channel in CHANNELS)
+
+    def _publish(ready):
+        for channel, chunk in ready:
+            _create_deliveries(message_id, channel, chunk)
+        group(task_send_batch.s(message_id, channel, chunk) for channel, chunk in ready).apply_async()
+        for channel, chunk in ready:
+            checkpoint[channel] = chunk[-1]
+        Message.objects.filter(pk=message_id).update(dispatch_checkpoint=checkpoint)
+
+    while True:
+        page = list(audience.filter(id__gt=cursor)[:page_size])
+        if not page:
+            break
+        ready = []
+        sent = set()
+        if skip_sent:
+            # Una consulta por página sobre el rango de IDs (índice único message, subscriber, channel)
+            sent = set(Delivery.objects.filter(
+                message_id=message_id, status='sent', subscriber_id__gte=page[0][0], subscriber_id__lte=page[-1][0]
+            ).values_list('subscriber_id', 'channel'))
+        for row in page:
+            sub_id = row[0]
+            for index, channel in enumerate(CHANNELS):
+                subscribed, contact = row[1 + 2 * index], row[2 + 2 * index]
+                # Al reanudar, saltar lo ya publicado en este canal
+                if subscribed and contact and sub_id > checkpoint.get(channel, 0) and (sub_id, channel) not in sent:
+                    buffers[channel].append(sub_id)
+                    if len(buffers[channel]) >= chunk_size:
+                        ready.append((channel, buffers[channel]))
+                        buffers[channel] = []
+        if ready:
+            _publish(ready)
+        cursor = page[-1][0]
+
+    remaining = [(channel, chunk) for channel, chunk in buffers.items() if chunk]
+    if remaining:
+        _publish(remaining)
+
+
+def _error_code(exc):
+    """Código de error del proveedor (Twilio `code`, estado HTTP de Gmail) o el tipo de excepción."""
+    cause = exc.__cause__ or exc
+    code = getattr(cause, 'code', None)
+    if code is None and getattr(cause, 'resp', None) is not None:
+        code = getattr(cause.resp, 'status', None)
+    return str(code if code is not None else type(exc).__name__)[:20]
+
+
+def _is_final(error, final):
+    """Un fallo es definitivo si no quedan reintentos o si reintentarlo no puede tener éxito."""
+    return final or isinstance(error, PermanentSendError)
+
+
+def _retry_countdown(retries, exc=None):
+    """
+    Segundos hasta el reintento número `retries` + 1. Si el proveedor indicó Retry-After
+    se respeta (con un pequeño jitter); si no, backoff exponencial desde
+    MESSAGING_RETRY_BACKOFF_BASE hasta MESSAGING_RETRY_BACKOFF_MAX con "equal jitter"
+    (entre la mitad y el total), para que los fallos simultáneos no reintenten a la vez.
+    """
+    retry_after = getattr(exc, 'retry_after', None)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, max(retry_after * 0.1, 1))
+    cap = min(settings.MESSAGING_RETRY_BACKOFF_MAX, settings.MESSAGING_RETRY_BACKOFF_BASE * 2 ** retries)
+    return random.uniform(cap / 2, cap)
+
+
+# Envíos que no llegaron al proveedor (circuito abierto, límite de tasa): se aplazan sin contar como intento
+DEFERRED_ERRORS = (CircuitOpenError, RateLimitTimeout)
+
+
+def _deferral_countdown(retries, exc):
+    """Espera de un envío aplazado: la del limitador de tasa tal cual, o la del circuito con jitter."""
+    if isinstance(exc, RateLimitTimeout) and exc.retry_after is not None:
+        return exc.retry_after
+    return _retry_countdown(retries, exc)
+
+
+def _defer(task, exc, args=None, countdown=None):
+    """
+    Vuelve a publicar la tarea cuando se cierre el circuito o haya tokens en el limitador
+    (`exc.retry_after`) sin gastar uno de sus reintentos: no se llegó a llamar al proveedor.
+    En modo eager no hay broker y es un reintento normal.
+    """
+    request = task.request
+    if countdown is None:
+        countdown = _deferral_countdown(request.retries, exc)
+    if request.is_eager or request.called_directly:
+        raise task.retry(exc=exc, args=args, countdown=countdown)
+    signature = task.signature_from_request(request, args, countdown=countdown, retries=request.retries)
+    signature.apply_async()
+    raise Retry(exc=exc, when=countdown, sig=signature)
+
+
+def _claim_delivery(task, message_id, channel, subscriber_id):
+    """
+    Reclama la fila Delivery de un envío individual igual que los lotes: 'queued' ->
+    'sending' con la clave de idempotencia de la tarea (su ID, el mismo en reintentos y
+    reentregas). Devuelve la fila, o None si ya tiene un resultado definitivo o la tiene
+    reclamada otra tarea; así un reintento o una reentrega no vuelven a enviar.
+    """
+    _create_deliveries(message_id, channel, [subscriber_id]) # Por si se encoló sin pasar por el fan-out
+    idempotency_key = task.request.id or uuid.uuid4().hex
+    rows = Delivery.objects.filter(message_id=message_id, channel=channel, subscriber_id=subscriber_id)
+    rows.filter(status='queued').update(status='sending', idempotency_key=idempotency_key, updated_at=timezone.now())
+    return rows.filter(status='sending', idempotency_key=idempotency_key).first()
+
+
+def _record_results(message_id, channel, outcomes, skipped_ids, final, deliveries=None):
+    """
+    Guarda el resultado de un lote en sus filas Delivery con un único UPDATE (bulk_update)
+    y suma los resultados definitivos a los contadores de progreso de la campaña.
+    Los fallos que se van a reintentar quedan en 'queued'; pasan a 'failed' si `final` o si
+    el error es permanente.
+    """
+    results = dict(outcomes)
+    skipped_ids = set(skipped_ids)
+    if deliveries is None:
+        deliveries = Delivery.objects.filter(
+            message_id=message_id, channel=channel, subscriber_id__in=list(results) + list(skipped_ids)
+        )
+    deliveries = [d for d in deliveries if d.subscriber_id in results or d.subscriber_id in skipped_ids]
+    now = timezone.now()
+    for delivery in deliveries:
+        delivery.updated_at = now # bulk_update no aplica auto_now
+        if delivery.subscriber_id in skipped_ids:
+            delivery.status = 'skipped'
+            continue
+        result = results[delivery.subscriber_id]
+        delivery.attempts += 1
+        if result.ok:
+            delivery.status = 'sent'
+            delivery.provider_id = result.provider_id or ''
+            delivery.error_code = delivery.last_error = ''
+        else:
+            delivery.status = 'failed' if _is_final(result.error, final) else 'queued'
+            delivery.error_code = _error_code(result.error)
+            delivery.last_error = str(result.error)[:255]
+
+    Delivery.objects.bulk_update(
+        deliveries, ['status', 'provider_id', 'attempts', 'error_code', 'last_error', 'updated_at']
+    )
+
+    sent = sum(1 for result in results.values() if result.ok)
+    failed = sum(1 for result in results.values() if not result.ok and _is_final(result.error, final))
+    metrics.record_results(
+        channel, sent=sent, failed=failed, retried=len(results) - sent - failed, skipped=len(skipped_ids)
+    )
+    try:
+        completed = progress.record(message_id, channel, sent=sent, failed=failed, skipped=len(skipped_ids))
+    except RedisError as e:
+        # finalize_sending_messages cerrará la campaña a partir de la tabla Delivery
+        logger.error(f"[Msg:{message_id}] Could not update progress counters: {e}")
+        return
+    if completed:
+        finalize_message.delay(message_id)
+
+
 # Tarea principal que decide qué enviar y a quién
-@shared_task(bind=True, max_retries=3, default_retry_delay=60) # Reintentar 3 veces con 1 min de espera
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, acks_late=True, reject_on_worker_lost=True) # Reintentar 3 veces con 1 min de espera
 def queue_message_sending(self, message_id):
     """
     Tarea principal para procesar un mensaje. Encuentra suscriptores y
-    encola tareas individuales de envío para cada canal/suscriptor.
+    encola tareas de envío por lotes (MESSAGING_SEND_CHUNK_SIZE suscriptores
+    por tarea) para cada canal. Con `acks_late`, si el worker muere durante el
+    fan-out la tarea se vuelve a entregar y continúa desde el último checkpoint.
     """
     try:
         message = Message.objects.get(pk=message_id)
@@ -21,61 +295,81 @@ def queue_message_sending(self, message_id):
         logger.error(f"Message with ID {message_id} not found. Cannot queue sending.")
         return
 
-    if message.status not in ['queued', 'retrying']: # Solo procesar si está encolado o reintentando
+    resuming = message.status == 'sending' and message.dispatch_checkpoint is not None
+    if not resuming and message.status not in ['queued', 'retrying']: # Solo procesar si está encolado o reintentando
          if message.status == 'draft':
              logger.warning(f"Message {message_id} is still in draft. Marking as queued before processing.")
              message.status = 'queued'
-             # No guardar aquí, se guarda al final si hay éxito en encolar
+             # No guardar aquí, se guarda al empezar el fan-out
          else:
             logger.info(f"Message {message_id} has status '{message.status}'. Skipping queueing.")
             return
 
-    subscribers_to_email = []
-    subscribers_to_sms = []
-    subscribers_to_whatsapp = []
+    chunk_size = settings.MESSAGING_SEND_CHUNK_SIZE
 
-    # Encontrar suscriptores activos para cada canal relevante
-    active_subscribers = Subscriber.objects.filter(is_active=True)
+    # Encolar tareas por lotes (un mensaje al broker por cada `chunk_size` suscriptores)
+    try:
+        # Entregas ya realizadas: de un envío anterior (mensaje que vuelve a encolarse tras fallar)
+        # o, al reanudar el fan-out, de los lotes publicados antes de la caída. No se vuelven a
+        # enviar ni cuentan como encoladas en el informe.
+        delivered = dict(
+            Delivery.objects.filter(message_id=message.id, status='sent').order_by()
+            .values_list('channel').annotate(count=Count('id'))
+        )
+        if resuming:
+            checkpoint = dict(message.dispatch_checkpoint)
+            logger.warning(f"Message {message_id}: resuming interrupted fan-out from checkpoint {checkpoint}.")
+        else:
+            checkpoint = {}
+            if delivered:
+                message.sent_to_report += (
+                    f"\n[{timezone.now()}] Resuming message {message_id}: "
+                    f"skipping {sum(delivered.values())} recipient(s) already delivered."
+                )
+                logger.info(f"Message {message_id}: resuming, {delivered} recipient(s) already delivered.")
+            else:
+                message.sent_to_report = f"[{timezone.now()}] Starting processing for message {message_id}."
+            message.status = 'sending' # Marcar como enviando ahora que empezamos a encolar tareas
+            message.dispatch_checkpoint = checkpoint
+            message.save(update_fields=['status', 'sent_to_report', 'dispatch_checkpoint', 'updated_at'])
+            # Resultados no entregados de un envío anterior ('sending' son lotes aún en curso)
+            Delivery.objects.filter(message_id=message.id, status__in=['queued', 'failed', 'skipped']).delete()
+            # Hora de publicación de esta tarea: cuándo se pidió el envío (queue-send, admin o planificador)
+            progress.reset(message.id, queued_at=metrics.published_at(self) or time.time())
+            for channel, count in delivered.items():
+                progress.record(message.id, channel, sent=count) # Cuentan para el total de la campaña
 
-    email_subs = active_subscribers.filter(subscribed_to_email=True, email__isnull=False).exclude(email__exact='')
-    sms_subs = active_subscribers.filter(subscribed_to_sms=True, phone_number__isnull=False).exclude(phone_number__exact='')
-    whatsapp_subs = active_subscribers.filter(subscribed_to_whatsapp=True, whatsapp_number__isnull=False).exclude(whatsapp_number__exact='')
+        _dispatch_audience(message.id, checkpoint, chunk_size, skip_sent=bool(delivered))
 
-    total_queued = 0
-    report_lines = [f"[{timezone.now()}] Starting processing for message {message_id}."]
+        # Recuento desde Delivery: correcto también si el fan-out se reanudó
+        queued_by_channel = dict(
+            Delivery.objects.filter(message_id=message.id).order_by()
+            .values_list('channel').annotate(count=Count('id'))
+        )
+        total_queued = sum(queued_by_channel.values())
 
-    # Encolar tareas individuales
-    try:
-        with transaction.atomic(): # Asegurar que el estado del mensaje se actualice correctamente
-            message.status = 'sending' # Marcar como enviando ahora que empezamos a encolar tareas
-            message.sent_to_report = "" # Limpiar reporte anterior si se reintenta
-
-            for sub in email_subs:
-                task_send_single_email.delay(message.id, sub.id)
-                report_lines.append(f"- Queued email for {sub.email} (Sub ID: {sub.id})")
-                total_queued += 1
-
-            for sub in sms_subs:
-                task_send_single_sms.delay(message.id, sub.id)
-                report_lines.append(f"- Queued SMS for {sub.phone_number} (Sub ID: {sub.id})")
-                total_queued += 1
-
-            for sub in whatsapp_subs:
-                task_send_single_whatsapp.delay(message.id, sub.id)
-                report_lines.append(f"- Queued WhatsApp for {sub.whatsapp_number} (Sub ID: {sub.id})")
-                total_queued += 1
-
-            if total_queued == 0:
-                logger.warning(f"Message {message_id}: No active subscribers found for any channel.")
-                message.status = 'failed' # Marcar como fallido si no hay nadie a quien enviar
-                report_lines.append("! No active subscribers found for configured channels.")
-            else:
-                 report_lines.append(f"* Total tasks queued: {total_queued}")
-                 logger.info(f"Message {message_id}: Queued {total_queued} individual sending tasks.")
+        report_lines = [message.sent_to_report]
+        for channel, (_, _, label) in CHANNELS.items():
+            pending = queued_by_channel.get(channel, 0) - delivered.get(channel, 0)
+            if pending:
+                report_lines.append(f"- Queued {pending} {label} recipient(s)")
+        if total_queued == 0:
+            logger.warning(f"Message {message_id}: No active subscribers found for any channel.")
+            message.status = 'failed' # Marcar como fallido si no hay nadie a quien enviar
+            report_lines.append("! No active subscribers found for configured channels.")
+        else:
+             pending_total = total_queued - sum(delivered.values())
+             report_lines.append(f"* Total recipients queued: {pending_total} (batches of up to {chunk_size})")
+             logger.info(f"Message {message_id}: Queued {pending_total} recipients in batches of up to {chunk_size}.")
+
+        # Actualizar reporte y cerrar el fan-out
+        message.sent_to_report = "\n".join(report_lines)
+        message.dispatch_checkpoint = None
+        message.save(update_fields=['status', 'sent_to_report', 'dispatch_checkpoint', 'updated_at'])
 
-            # Actualizar estado y reporte inicial
-            message.sent_to_report = "\n".join(report_lines)
-            message.save(update_fields=['status', 'sent_to_report', 'updated_at'])
+        # Fijar el total al final: hasta entonces ningún lote puede dar la campaña por completada
+        if total_queued and progress.set_queued(message.id, queued_by_channel):
+            finalize_message.delay(message.id) # Todos los lotes terminaron antes que el fan-out
 
     except Exception as exc:
          logger.error(f"Error queueing sending tasks for message {message_id}: {exc}", exc_info=True)
@@ -91,134 +385,352 @@ def queue_message_sending(self, message_id):
          # self.retry(exc=exc) # Comentado: reintentar el encolamiento puede ser peligroso
 
 
+# Tarea por lotes: un mismo mensaje a un grupo de suscriptores de un canal
+@shared_task(bind=True, max_retries=2, acks_late=True, reject_on_worker_lost=True)
+def task_send_batch(self, message_id, channel, subscriber_ids):
+    """
+    Envía un mensaje a un lote de suscriptores por un canal. Carga el mensaje y los
+    suscriptores con una consulta cada uno; si algún envío falla, la tarea se reintenta
+    solo con los IDs que fallaron. Con `acks_late`, si el worker muere a mitad del lote
+    la tarea se vuelve a entregar con el mismo ID y recupera las filas que había reclamado.
+    """
+    subscribed_field, contact_field, label = CHANNELS[channel]
+    log_prefix = f"[Msg:{message_id}|Batch:{len(subscriber_ids)}|{label}]"
+    try:
+        message = get_message_snapshot(message_id)
+    except Message.DoesNotExist:
+        logger.error(f"{log_prefix} Message not found.")
+        return
+
+    # Reclamar las filas aún pendientes con un UPDATE condicional y la clave de idempotencia
+    # del intento (el ID de la tarea se mantiene entre reintentos). Un lote publicado dos veces
+    # (p. ej. al reanudar el fan-out) o un reintento no vuelven a enviar a quien ya tiene un
+    # resultado definitivo ni a quien está reclamado por otro lote en curso.
+    idempotency_key = self.request.id or uuid.uuid4().hex
+    batch_deliveries = Delivery.objects.filter(message_id=message_id, channel=channel, subscriber_id__in=subscriber_ids)
+    batch_deliveries.filter(status='queued').update(
+        status='sending', idempotency_key=idempotency_key, updated_at=timezone.now()
+    )
+    deliveries = list(batch_deliveries.filter(status='sending', idempotency_key=idempotency_key))
+    pending_ids = {delivery.subscriber_id for delivery in deliveries}
+    if len(pending_ids) < len(subscriber_ids):
+        logger.info(f"{log_prefix} {len(subscriber_ids) - len(pending_ids)} recipient(s) already processed or claimed by another batch. Skipping them.")
+
+    # Los demás datos de contacto solo se cargan si el mensaje usa variables por suscriptor
+    personalized = _is_personalized(channel, message)
+    contact_fields = [CHANNELS[name][1] for name in CHANNELS] if personalized else [contact_field]
+    subscribers = Subscriber.objects.filter(pk__in=pending_ids).only(
+        'id', 'is_active', subscribed_field, *contact_fields
+    )
+    found_ids = set()
+    skipped_ids = []
+    recipients = [] # (subscriber_id, contacto) que siguen cumpliendo las condiciones
+    contexts = [] if personalized else None
+
+    for subscriber in subscribers:
+        found_ids.add(subscriber.id)
+        contact = getattr(subscriber, contact_field)
+
+        if not subscriber.is_active or not getattr(subscriber, subscribed_field) or not contact:
+            logger.warning(f"[Msg:{message_id}|Sub:{subscriber.id}|{label}] Subscriber inactive, unsubscribed, or no contact. Skipping.")
+            skipped_ids.append(subscriber.id)
+            continue
+        recipients.append((subscriber.id, contact))
+        if personalized:
+            contexts.append(subscriber_context(subscriber))
+
+    missing_ids = pending_ids - found_ids
+    if missing_ids:
+        logger.error(f"{log_prefix} {len(missing_ids)} subscriber(s) not found.")
+        skipped_ids.extend(missing_ids) # Cuentan como omitidos para que la campaña pueda completarse
+
+    try:
+        outcomes = _send_batch_to_channel(channel, message, recipients, contexts) if recipients else []
+    except Exception as exc:
+        # Fallo antes de llegar al proveedor (servicio no disponible, configuración...): afecta a todo el lote
+        logger.error(f"{log_prefix} Batch send failed: {exc}", exc_info=True)
+        outcomes = [(subscriber_id, SendResult(contact, None, exc)) for subscriber_id, contact in recipients]
+    # Aplazados (circuito abierto, límite de tasa): no llegaron al proveedor, así que no cuentan como intento
+    deferred = [(subscriber_id, result.error) for subscriber_id, result in outcomes if isinstance(result.error, DEFERRED_ERRORS)]
+    if deferred:
+        outcomes = [(subscriber_id, result) for subscriber_id, result in outcomes if not isinstance(result.error, DEFERRED_ERRORS)]
+        metrics.record_results(channel, deferred=len(deferred))
+    final = self.request.retries >= self.max_retries
+    if outcomes or skipped_ids:
+        _record_results(message_id, channel, outcomes, skipped_ids, final, deliveries=deliveries)
+
+    failed_ids = []
+    permanent_ids = []
+    last_exc = None
+    countdown = 0
+    for subscriber_id, result in outcomes:
+        sub_prefix = f"[Msg:{message_id}|Sub:{subscriber_id}|{label}]"
+        if result.ok:
+            logger.info(f"{sub_prefix} {label} sent successfully to {result.recipient}")
+        elif isinstance(result.error, PermanentSendError):
+            logger.error(f"{sub_prefix} FAILED permanently sending {label} to {result.recipient}: {result.error}")
+            permanent_ids.append(subscriber_id)
+        else:
+            logger.error(f"{sub_prefix} FAILED sending {label} to {result.recipient}: {result.error}")
+            failed_ids.append(subscriber_id)
+            last_exc = result.error
+            countdown = max(countdown, _retry_countdown(self.request.retries, result.error))
+
+    deferred_ids = [subscriber_id for subscriber_id, _ in deferred]
+    deferral = max((_deferral_countdown(self.request.retries, error) for _, error in deferred), default=0)
+    if permanent_ids:
+        logger.info(f"{log_prefix} Not retrying {len(permanent_ids)} recipient(s) with permanent errors.")
+    if failed_ids:
+        if final:
+            logger.error(f"{log_prefix} Max retries exceeded for {len(failed_ids)} recipient(s): {failed_ids}")
+        else:
+            countdown = max(countdown, deferral)
+            logger.info(f"{log_prefix} Retrying {len(failed_ids) + len(deferred_ids)} recipient(s) in {countdown:.0f}s.")
+            # Reintentar solo los destinatarios con errores temporales (y los aplazados), no el lote completo
+            raise self.retry(exc=last_exc, args=(message_id, channel, failed_ids + deferred_ids), countdown=countdown)
+    if deferred:
+        logger.warning(f"{log_prefix} {deferred[0][1]} Deferring {len(deferred_ids)} recipient(s) for {deferral:.0f}s.")
+        _defer(self, deferred[0][1], args=(message_id, channel, deferred_ids), countdown=deferral)
+
+
+@shared_task
+def finalize_message(message_id):
+    """
+    Cierra una campaña cuando todos sus destinatarios tienen un resultado definitivo:
+    'sent' si al menos un envío tuvo éxito (o todos se omitieron), 'failed' si ninguno.
+    Es idempotente: solo actúa sobre mensajes que siguen en 'sending' y cuyo fan-out terminó.
+    """
+    counts = None
+    try:
+        counts = progress.get(message_id)
+    except RedisError as e:
+        logger.error(f"[Msg:{message_id}] Could not read progress counters: {e}")
+
+    if counts and counts['total'] is not None:
+        if counts['done'] < counts['total']:
+            return
+        totals = {status: sum(c[status] for c in counts['channels'].values()) for status in progress.STATUSES}
+    else:
+        # Sin contadores (Redis reiniciado o caído): usar la tabla Delivery
+        totals = dict.fromkeys(progress.STATUSES, 0)
+        for row in Delivery.objects.filter(message_id=message_id).order_by().values('status').annotate(count=Count('id')):
+            if row['status'] in ('queued', 'sending') and row['count']:
+                return # Aún hay envíos pendientes o en reintento
+            totals[row['status']] = row['count']
+
+    new_status = 'failed' if totals['sent'] == 0 and totals['failed'] > 0 else 'sent'
+    now = timezone.now()
+    summary = f"\n[{now}] Finished: sent={totals['sent']}, failed={totals['failed']}, skipped={totals['skipped']}."
+    updated = Message.objects.filter(pk=message_id, status='sending', dispatch_checkpoint__isnull=True).update(
+        status=new_status,
+        sent_to_report=Concat(F('sent_to_report'), Value(summary)),
+        updated_at=now,
+    )
+    if updated:
+        logger.info(f"Message {message_id}: campaign finished with status '{new_status}' ({totals}).")
+        if counts:
+            metrics.observe_campaign(message_id, counts['queued_at'])
+
+
+@shared_task
+def dispatch_scheduled_messages():
+    """
+    Tarea periódica (Celery beat): encola los mensajes programados cuya hora ya llegó.
+    La búsqueda usa el índice (status, scheduled_at) y solo lee los vencidos. Cada mensaje
+    se reclama con un UPDATE condicional 'scheduled' -> 'queued', de modo que aunque varios
+    nodos ejecuten esta tarea a la vez, solo uno lo entrega al fan-out.
+    """
+    batch_size = settings.MESSAGING_SCHEDULER_BATCH_SIZE
+    dispatched = 0
+    while True:
+        due_ids = list(
+            Message.objects.filter(status='scheduled', scheduled_at__lte=timezone.now())
+            .order_by('scheduled_at').values_list('id', flat=True)[:batch_size]
+        )
+        for message_id in due_ids:
+            claimed = Message.objects.filter(pk=message_id, status='scheduled').update(
+                status='queued', updated_at=timezone.now()
+            )
+            if claimed: # 0 si otro nodo ya lo reclamó
+                queue_message_sending.delay(message_id)
+                dispatched += 1
+        if len(due_ids) < batch_size:
+            break
+    if dispatched:
+        logger.info(f"Dispatched {dispatched} scheduled message(s).")
+    return dispatched
+
+
+@shared_task
+def import_subscribers(import_id):
+    """Procesa en segundo plano una importación masiva de suscriptores (ver messaging/importing.py)."""
+    try:
+        run_import(import_id)
+    except Exception as exc:
+        logger.error(f"Subscriber import {import_id} failed: {exc}", exc_info=True)
+        SubscriberImport.objects.filter(pk=import_id).update(
+            status='failed', error=str(exc), finished_at=timezone.now(), updated_at=timezone.now()
+        )
+
+
+@shared_task
+def finalize_sending_messages():
+    """Tarea periódica (Celery beat) de respaldo: intenta cerrar todas las campañas en 'sending'."""
+    for message_id in Message.objects.filter(status='sending').values_list('id', flat=True):
+        finalize_message(message_id)
+
+
 # Tareas individuales para cada canal/suscriptor
-@shared_task(bind=True, max_retries=2, default_retry_delay=120) # Reintentos más espaciados para envíos individuales
+@shared_task(bind=True, max_retries=2, acks_late=True, reject_on_worker_lost=True) # Espera entre reintentos: _retry_countdown
 def task_send_single_email(self, message_id, subscriber_id):
     """Envía un email a un suscriptor específico."""
     log_prefix = f"[Msg:{message_id}|Sub:{subscriber_id}|Email]"
+    delivery = None
     try:
-        message = Message.objects.get(pk=message_id)
+        message = get_message_snapshot(message_id)
         subscriber = Subscriber.objects.get(pk=subscriber_id)
+        delivery = _claim_delivery(self, message_id, 'email', subscriber_id)
+        if delivery is None:
+            logger.info(f"{log_prefix} Already processed or claimed by another task. Skipping.")
+            return
 
         if not subscriber.is_active or not subscriber.subscribed_to_email or not subscriber.email:
             logger.warning(f"{log_prefix} Subscriber inactive, unsubscribed, or no email. Skipping.")
+            _record_results(message_id, 'email', [], [subscriber_id], final=True, deliveries=[delivery])
             return # No hacer nada si el suscriptor ya no cumple las condiciones
 
         logger.info(f"{log_prefix} Attempting to send email to {subscriber.email}")
-        send_email_message(
+        provider_id = send_email_message(
             to_email=subscriber.email,
             subject=message.subject,
             body_html=message.body_html,
-            body_text=message.body_text
+            body_text=message.body_text,
+            context=subscriber_context(subscriber)
         )
         logger.info(f"{log_prefix} Email sent successfully to {subscriber.email}")
-        # Opcional: Actualizar reporte del mensaje (puede causar contención de DB)
-        # _update_message_report(message_id, f"{log_prefix} OK: Email sent to {subscriber.email}")
+        _record_results(message_id, 'email', [(subscriber_id, SendResult(subscriber.email, provider_id, None))], [], final=True, deliveries=[delivery])
 
     except Message.DoesNotExist:
         logger.error(f"{log_prefix} Message not found.")
     except Subscriber.DoesNotExist:
          logger.error(f"{log_prefix} Subscriber not found.")
+    except DEFERRED_ERRORS as exc:
+        logger.warning(f"{log_prefix} {exc} Deferring email.")
+        metrics.record_results('email', deferred=1)
+        _defer(self, exc)
     except Exception as exc:
         logger.error(f"{log_prefix} FAILED sending email to {subscriber.email}: {exc}", exc_info=True)
-        # Opcional: Actualizar reporte del mensaje
-        # _update_message_report(message_id, f"{log_prefix} FAILED: {subscriber.email} - {exc}")
+        _record_results(
+            message_id, 'email', [(subscriber_id, SendResult(subscriber.email, None, exc))], [],
+            final=self.request.retries >= self.max_retries, deliveries=[delivery] if delivery else None
+        )
+        if isinstance(exc, PermanentSendError):
+            logger.warning(f"{log_prefix} Permanent error, not retrying email to {subscriber.email}.")
+            return
         try:
-            # Reintentar la tarea si es posible
-            self.retry(exc=exc)
+            # Reintentar la tarea si es posible (backoff exponencial o Retry-After del proveedor)
+            self.retry(exc=exc, countdown=_retry_countdown(self.request.retries, exc))
         except self.MaxRetriesExceededError:
              logger.error(f"{log_prefix} Max retries exceeded for email to {subscriber.email}.")
              # Marcar el mensaje como fallido si aún no lo está? Es complejo si otros envíos funcionan.
              # Quizás solo registrar en el reporte es suficiente.
 
 
-@shared_task(bind=True, max_retries=2, default_retry_delay=120)
+@shared_task(bind=True, max_retries=2, acks_late=True, reject_on_worker_lost=True)
 def task_send_single_sms(self, message_id, subscriber_id):
     """Envía un SMS a un suscriptor específico."""
     log_prefix = f"[Msg:{message_id}|Sub:{subscriber_id}|SMS]"
+    delivery = None
     try:
-        message = Message.objects.get(pk=message_id)
+        message = get_message_snapshot(message_id)
         subscriber = Subscriber.objects.get(pk=subscriber_id)
+        delivery = _claim_delivery(self, message_id, 'sms', subscriber_id)
+        if delivery is None:
+            logger.info(f"{log_prefix} Already processed or claimed by another task. Skipping.")
+            return
 
         if not subscriber.is_active or not subscriber.subscribed_to_sms or not subscriber.phone_number:
             logger.warning(f"{log_prefix} Subscriber inactive, unsubscribed, or no phone number. Skipping.")
+            _record_results(message_id, 'sms', [], [subscriber_id], final=True, deliveries=[delivery])
             return
 
         logger.info(f"{log_prefix} Attempting to send SMS to {subscriber.phone_number}")
-        send_sms_message(
+        provider_id = send_sms_message(
             to_number=subscriber.phone_number,
-            body_text=message.body_text
+            body_text=message.body_text,
+            context=subscriber_context(subscriber)
         )
         logger.info(f"{log_prefix} SMS sent successfully to {subscriber.phone_number}")
-        # _update_message_report(message_id, f"{log_prefix} OK: SMS sent to {subscriber.phone_number}")
+        _record_results(message_id, 'sms', [(subscriber_id, SendResult(subscriber.phone_number, provider_id, None))], [], final=True, deliveries=[delivery])
 
     except Message.DoesNotExist:
         logger.error(f"{log_prefix} Message not found.")
     except Subscriber.DoesNotExist:
          logger.error(f"{log_prefix} Subscriber not found.")
+    except DEFERRED_ERRORS as exc:
+        logger.warning(f"{log_prefix} {exc} Deferring SMS.")
+        metrics.record_results('sms', deferred=1)
+        _defer(self, exc)
     except Exception as exc:
         logger.error(f"{log_prefix} FAILED sending SMS to {subscriber.phone_number}: {exc}", exc_info=True)
-        # _update_message_report(message_id, f"{log_prefix} FAILED: {subscriber.phone_number} - {exc}")
+        _record_results(
+            message_id, 'sms', [(subscriber_id, SendResult(subscriber.phone_number, None, exc))], [],
+            final=self.request.retries >= self.max_retries, deliveries=[delivery] if delivery else None
+        )
+        if isinstance(exc, PermanentSendError):
+            logger.warning(f"{log_prefix} Permanent error, not retrying SMS to {subscriber.phone_number}.")
+            return
         try:
-            self.retry(exc=exc)
+            self.retry(exc=exc, countdown=_retry_countdown(self.request.retries, exc))
         except self.MaxRetriesExceededError:
              logger.error(f"{log_prefix} Max retries exceeded for SMS to {subscriber.phone_number}.")
 
 
-@shared_task(bind=True, max_retries=2, default_retry_delay=120)
+@shared_task(bind=True, max_retries=2, acks_late=True, reject_on_worker_lost=True)
 def task_send_single_whatsapp(self, message_id, subscriber_id):
     """Envía un mensaje de WhatsApp a un suscriptor específico."""
     log_prefix = f"[Msg:{message_id}|Sub:{subscriber_id}|WA]"
+    delivery = None
     try:
-        message = Message.objects.get(pk=message_id)
+        message = get_message_snapshot(message_id)
         subscriber = Subscriber.objects.get(pk=subscriber_id)
+        delivery = _claim_delivery(self, message_id, 'whatsapp', subscriber_id)
+        if delivery is None:
+            logger.info(f"{log_prefix} Already processed or claimed by another task. Skipping.")
+            return
 
         if not subscriber.is_active or not subscriber.subscribed_to_whatsapp or not subscriber.whatsapp_number:
             logger.warning(f"{log_prefix} Subscriber inactive, unsubscribed, or no WhatsApp number. Skipping.")
+            _record_results(message_id, 'whatsapp', [], [subscriber_id], final=True, deliveries=[delivery])
             return
 
         logger.info(f"{log_prefix} Attempting to send WhatsApp to {subscriber.whatsapp_number}")
-        send_whatsapp_message(
+        provider_id = send_whatsapp_message(
             to_whatsapp_number=subscriber.whatsapp_number,
-            body_text=message.body_text
+            body_text=message.body_text,
+            context=subscriber_context(subscriber)
         )
         logger.info(f"{log_prefix} WhatsApp sent successfully to {subscriber.whatsapp_number}")
-        # _update_message_report(message_id, f"{log_prefix} OK: WhatsApp sent to {subscriber.whatsapp_number}")
+        _record_results(message_id, 'whatsapp', [(subscriber_id, SendResult(subscriber.whatsapp_number, provider_id, None))], [], final=True, deliveries=[delivery])
 
     except Message.DoesNotExist:
         logger.error(f"{log_prefix} Message not found.")
     except Subscriber.DoesNotExist:
          logger.error(f"{log_prefix} Subscriber not found.")
+    except DEFERRED_ERRORS as exc:
+        logger.warning(f"{log_prefix} {exc} Deferring WhatsApp.")
+        metrics.record_results('whatsapp', deferred=1)
+        _defer(self, exc)
     except Exception as exc:
         logger.error(f"{log_prefix} FAILED sending WhatsApp to {subscriber.whatsapp_number}: {exc}", exc_info=True)
-        # _update_message_report(message_id, f"{log_prefix} FAILED: {subscriber.whatsapp_number} - {exc}")
+        _record_results(
+            message_id, 'whatsapp', [(subscriber_id, SendResult(subscriber.whatsapp_number, None, exc))], [],
+            final=self.request.retries >= self.max_retries, deliveries=[delivery] if delivery else None
+        )
+        if isinstance(exc, PermanentSendError):
+            logger.warning(f"{log_prefix} Permanent error, not retrying WhatsApp to {subscriber.whatsapp_number}.")
+            return
         try:
-            # Considerar si reintentar errores de plantilla (ej. Twilio 63016) tiene sentido
-            # if isinstance(exc, ConnectionError) and '63016' in str(exc):
-            #    logger.warning(f"{log_prefix} WhatsApp failed due to template requirement. Not retrying.")
-            # else:
-            self.retry(exc=exc)
+            self.retry(exc=exc, countdown=_retry_countdown(self.request.retries, exc))
         except self.MaxRetriesExceededError:
              logger.error(f"{log_prefix} Max retries exceeded for WhatsApp to {subscriber.whatsapp_number}.")
-
-# --- Opcional: Función para actualizar el reporte del mensaje ---
-# ¡PRECAUCIÓN! Llamar a esto desde muchas tareas concurrentes puede causar
-# problemas de bloqueo/contención en la base de datos al actualizar el mismo registro Message.
-# Es más seguro registrar en logs y quizás tener una tarea periódica que actualice
-# el estado final del mensaje basado en los logs o estados de tareas.
-#
-# def _update_message_report(message_id, report_line):
-#     try:
-#         # Usar select_for_update para bloquear la fila y evitar race conditions
-#         with transaction.atomic():
-#             message = Message.objects.select_for_update().get(pk=message_id)
-#             timestamp = timezone.now().strftime('%Y-%m-%d %H:%M:%S')
-#             message.sent_to_report = f"{message.sent_to_report}\n[{timestamp}] {report_line}"
-#             # No cambiar el estado aquí, podría ser prematuro.
-#             # El estado 'sent' debería marcarse cuando *todas* las tareas terminen.
-#             # Esto es complejo de rastrear directamente.
-#             message.save(update_fields=['sent_to_report', 'updated_at'])
-#     except Message.DoesNotExist:
-#         logger.warning(f"Could not update report for message {message_id}: Message not found.")
-#     except Exception as e:
-#         logger.error(f"Error updating message report for {message_id}: {e}")
\ No newline at end of file
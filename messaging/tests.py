@@ -1,3 +1,550 @@
-from django.test import TestCase
+import base64
+import datetime
+import email.policy
+import email.utils
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import httplib2
+from celery.exceptions import Retry
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from googleapiclient.errors import HttpError
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from twilio.base.exceptions import TwilioRestException
+
+from . import circuitbreaker, importing, pagination, personalization, progress, ratelimit, services, tasks
+from .benchmarking import FakeGmailService, FakeTwilioServer, fake_gmail_service
+from .models import Delivery, Message, Subscriber, SubscriberImport
+
+
+@override_settings(TWILIO_POOL_ACQUIRE_TIMEOUT=1)
+class TwilioClientPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = services._TwilioClientPool('AC' + '0' * 32, 'token', size=1, idle_timeout=0.05)
+
+    def test_stale_client_released_while_waiting_is_not_reused(self):
+        stale = self.pool._acquire()
+
+        def release():
+            time.sleep(0.1)
+            stale.last_used = time.monotonic() - 1
+            self.pool._idle.put(stale)
+
+        threading.Thread(target=release).start()
+        pooled = self.pool._acquire()
+        self.assertIsNot(pooled, stale)
+        self.assertEqual(self.pool._created, 1)
+
+    @override_settings(TWILIO_POOL_ACQUIRE_TIMEOUT=0.05)
+    def test_full_pool_times_out(self):
+        self.pool._acquire()
+        with self.assertRaises(services.TransientSendError):
+            self.pool._acquire()
+
+
+@override_settings(MESSAGING_RATE_LIMIT_BACKEND='memory', MESSAGING_RATE_LIMITS={'sms': '10/5'})
+class RateLimitScheduleTests(SimpleTestCase):
+    def setUp(self):
+        ratelimit._backend['pid'] = None # Buckets nuevos en cada test
+
+    def test_burst_then_paced(self):
+        delays = ratelimit.schedule('sms', '+15550000000', 8)
+        self.assertEqual(delays[:5], [0.0] * 5)
+        for previous, current in zip(delays[4:], delays[5:]):
+            self.assertAlmostEqual(current - previous, 0.1, places=2)
+
+    @override_settings(MESSAGING_RATE_LIMIT_MAX_WAIT=1)
+    def test_more_than_fits_in_max_wait_is_granted_in_part(self):
+        # 30 > capacidad (5) + tasa (10/s) * espera máxima (1s): nunca cabría de una vez
+        delays = ratelimit.schedule('sms', '+15550000000', 30)
+        self.assertEqual(len(delays), 15)
+        self.assertLessEqual(delays[-1], 1)
+        with self.assertRaises(ratelimit.RateLimitTimeout) as cm:
+            ratelimit.schedule('sms', '+15550000000', 30) # Bucket agotado: nada concedido
+        self.assertAlmostEqual(cm.exception.retry_after, 1.5, places=1)
+
+
+@override_settings(
+    MESSAGING_RATE_LIMIT_BACKEND='memory', MESSAGING_RATE_LIMITS={'sms': '10/5', 'email': '10/5'},
+    MESSAGING_RATE_LIMIT_MAX_WAIT=1, MESSAGING_CIRCUIT_BREAKER_BACKEND='off', MESSAGING_METRICS_ENABLED=False,
+)
+class OversizedBatchRateLimitTests(SimpleTestCase):
+    """Lotes mayores que capacidad + tasa * espera máxima: se envía lo concedido y se aplaza el resto."""
+
+    def setUp(self):
+        ratelimit._backend['pid'] = None
+
+    def assert_partly_sent(self, results):
+        self.assertTrue(all(result.ok for result in results[:15]))
+        self.assertTrue(all(isinstance(result.error, ratelimit.RateLimitTimeout) for result in results[15:]))
+        self.assertGreaterEqual(results[15].error.retry_after, 1)
+
+    def test_twilio_batch(self):
+        with FakeTwilioServer(latency=0) as twilio, override_settings(
+            TWILIO_API_BASE_URL=twilio.base_url, TWILIO_ACCOUNT_SID='AC' + '0' * 32, TWILIO_AUTH_TOKEN='token',
+            TWILIO_SMS_NUMBER='+15550000000',
+        ):
+            services.reset_twilio_client_pool()
+            try:
+                results = services.send_twilio_batch('sms', [f"+1555111{i:04d}" for i in range(30)], "Hola")
+            finally:
+                services.reset_twilio_client_pool()
+            self.assertEqual(twilio.request_count, 15)
+        self.assert_partly_sent(results)
+
+    @override_settings(GMAIL_SENDER_EMAIL='news@example.com', GMAIL_BATCH_SIZE=50)
+    def test_gmail_batch(self):
+        service = FakeGmailService(latency=0)
+        with fake_gmail_service(service):
+            results = services.send_email_batch([f"user{i}@example.com" for i in range(30)], "Asunto", "<p>Hola</p>", "Hola")
+        self.assertEqual(service.message_count, 15)
+        self.assert_partly_sent(results)
+
+
+class TwilioAsyncSessionTests(SimpleTestCase):
+    def test_batches_reuse_the_process_session(self):
+        with FakeTwilioServer(latency=0) as twilio, override_settings(
+            MESSAGING_RATE_LIMIT_BACKEND='off', MESSAGING_CIRCUIT_BREAKER_BACKEND='off',
+            TWILIO_API_BASE_URL=twilio.base_url, TWILIO_ACCOUNT_SID='AC' + '0' * 32, TWILIO_AUTH_TOKEN='token',
+            TWILIO_SMS_NUMBER='+15550000000',
+        ):
+            services.reset_twilio_client_pool()
+            try:
+                first = services.send_twilio_batch('sms', ['+15551110000', '+15551110001'], "Hola")
+                session = services._get_twilio_runner().client('AC' + '0' * 32, 'token').http_client.session
+                second = services.send_twilio_batch('sms', ['+15551110002'], "Hola")
+                self.assertTrue(all(result.ok for result in first + second))
+                self.assertIs(services._get_twilio_runner().client('AC' + '0' * 32, 'token').http_client.session, session)
+                self.assertFalse(session.closed)
+            finally:
+                services.reset_twilio_client_pool()
+            self.assertTrue(session.closed)
+
+
+def _run_task(task, *args, retries=0):
+    """Ejecuta el cuerpo de una tarea como lo haría un worker (no eager), sin broker."""
+    task.push_request(id='task-1', retries=retries, is_eager=False, called_directly=False, args=args, kwargs={}, delivery_info={})
+    try:
+        return task.run(*args)
+    finally:
+        task.pop_request()
+
+
+@override_settings(
+    MESSAGING_PROGRESS_BACKEND='memory', MESSAGING_RATE_LIMIT_BACKEND='off',
+    MESSAGING_CIRCUIT_BREAKER_BACKEND='off', MESSAGING_METRICS_ENABLED=False, TWILIO_ASYNC_SENDS=True,
+)
+class SendTaskTestCase(TestCase):
+    def setUp(self):
+        progress._store['pid'] = None # Contadores nuevos: los IDs de mensaje se repiten entre tests
+        self.message = Message.objects.create(subject="Asunto", body_html="<p>Hola</p>", body_text="Hola", status='sending')
+        self.subscriber = Subscriber.objects.create(
+            email="ana@example.com", phone_number="+15551230000", subscribed_to_email=True, subscribed_to_sms=True,
+        )
+
+    def delivery(self, channel):
+        return Delivery.objects.get(message=self.message, subscriber=self.subscriber, channel=channel)
+
+
+class RateLimitDeferralTests(SendTaskTestCase):
+    def test_throttled_batch_is_deferred_not_failed(self):
+        tasks._create_deliveries(self.message.id, 'sms', [self.subscriber.id])
+        throttled = ratelimit.RateLimitTimeout("throttled", retry_after=42.0)
+        with mock.patch.object(tasks, 'send_twilio_batch', return_value=[services.SendResult("+15551230000", None, throttled)]), \
+                mock.patch('celery.canvas.Signature.apply_async') as apply_async:
+            # Último intento: un fallo real se marcaría como definitivo
+            with self.assertRaises(Retry) as cm:
+                _run_task(tasks.task_send_batch, self.message.id, 'sms', [self.subscriber.id], retries=2)
+        apply_async.assert_called_once()
+        self.assertEqual(cm.exception.when, 42.0)
+        self.assertEqual(cm.exception.sig.options['retries'], 2) # No gasta un reintento
+        delivery = self.delivery('sms')
+        self.assertEqual(delivery.status, 'sending') # Sigue reclamada por la tarea (mismo ID al volver)
+        self.assertEqual(delivery.attempts, 0)
+
+    def test_throttled_single_send_is_deferred(self):
+        tasks._create_deliveries(self.message.id, 'sms', [self.subscriber.id])
+        throttled = ratelimit.RateLimitTimeout("throttled", retry_after=5.0)
+        with mock.patch.object(tasks, 'send_sms_message', side_effect=throttled), \
+                mock.patch('celery.canvas.Signature.apply_async'):
+            with self.assertRaises(Retry) as cm:
+                _run_task(tasks.task_send_single_sms, self.message.id, self.subscriber.id, retries=2)
+        self.assertEqual(cm.exception.sig.options['retries'], 2)
+        self.assertEqual(self.delivery('sms').attempts, 0)
+
+
+class RedeliveryTests(SendTaskTestCase):
+    def test_send_tasks_are_acked_after_running(self):
+        for task in (tasks.task_send_batch, tasks.task_send_single_email, tasks.task_send_single_sms, tasks.task_send_single_whatsapp):
+            self.assertTrue(task.acks_late and task.reject_on_worker_lost, task.name)
+
+    def test_redelivered_batch_resumes_its_claimed_rows(self):
+        tasks._create_deliveries(self.message.id, 'sms', [self.subscriber.id])
+        # El worker murió tras reclamar las filas: la reentrega trae el mismo ID de tarea
+        Delivery.objects.filter(message=self.message).update(status='sending', idempotency_key='task-1')
+        with mock.patch.object(tasks, 'send_twilio_batch', return_value=[services.SendResult("+15551230000", 'SM1', None)]) as send:
+            _run_task(tasks.task_send_batch, self.message.id, 'sms', [self.subscriber.id])
+        send.assert_called_once()
+        self.assertEqual(self.delivery('sms').status, 'sent')
+
+
+class ResumeFanOutTests(SendTaskTestCase):
+    def test_resume_does_not_report_delivered_rows_as_queued(self):
+        # El fan-out publicó el lote del primer suscriptor (ya entregado) y el worker murió
+        tasks._create_deliveries(self.message.id, 'email', [self.subscriber.id])
+        tasks._create_deliveries(self.message.id, 'sms', [self.subscriber.id])
+        Delivery.objects.filter(message=self.message).update(status='sent')
+        checkpoint = dict.fromkeys(tasks.CHANNELS, self.subscriber.id)
+        Message.objects.filter(pk=self.message.pk).update(dispatch_checkpoint=checkpoint, sent_to_report="Started.")
+        later = Subscriber.objects.create(email="luis@example.com", subscribed_to_email=True)
+        with mock.patch('celery.canvas.group.apply_async') as apply_async:
+            _run_task(tasks.queue_message_sending, self.message.id)
+        apply_async.assert_called_once()
+        self.message.refresh_from_db()
+        self.assertIn("Total recipients queued: 1 ", self.message.sent_to_report)
+        self.assertIn("- Queued 1 Email recipient(s)", self.message.sent_to_report)
+        self.assertNotIn("SMS", self.message.sent_to_report)
+        self.assertEqual(Delivery.objects.get(message=self.message, subscriber=later).status, 'queued')
+
+
+class SingleSendIdempotencyTests(SendTaskTestCase):
+    def test_redelivered_task_does_not_resend(self):
+        tasks._create_deliveries(self.message.id, 'email', [self.subscriber.id])
+        with mock.patch.object(tasks, 'send_email_message', return_value='gmail-1') as send:
+            _run_task(tasks.task_send_single_email, self.message.id, self.subscriber.id)
+            # Reentrega tras la caída del worker (acks_late) o publicación duplicada
+            _run_task(tasks.task_send_single_email, self.message.id, self.subscriber.id)
+        send.assert_called_once()
+        delivery = self.delivery('email')
+        self.assertEqual((delivery.status, delivery.provider_id, delivery.attempts), ('sent', 'gmail-1', 1))
+
+    def test_row_claimed_by_another_task_is_skipped(self):
+        tasks._create_deliveries(self.message.id, 'sms', [self.subscriber.id])
+        Delivery.objects.filter(message=self.message).update(status='sending', idempotency_key='other-task')
+        with mock.patch.object(tasks, 'send_sms_message') as send:
+            _run_task(tasks.task_send_single_sms, self.message.id, self.subscriber.id)
+        send.assert_not_called()
+
+    def test_retry_after_transient_error_reclaims_its_row(self):
+        tasks._create_deliveries(self.message.id, 'sms', [self.subscriber.id])
+        with mock.patch.object(tasks, 'send_sms_message', side_effect=services.TransientSendError("503")), \
+                mock.patch('celery.canvas.Signature.apply_async'):
+            with self.assertRaises(Retry):
+                _run_task(tasks.task_send_single_sms, self.message.id, self.subscriber.id)
+        self.assertEqual(self.delivery('sms').status, 'queued')
+        with mock.patch.object(tasks, 'send_sms_message', return_value='SM1') as send:
+            _run_task(tasks.task_send_single_sms, self.message.id, self.subscriber.id, retries=1)
+        send.assert_called_once()
+        self.assertEqual((self.delivery('sms').status, self.delivery('sms').attempts), ('sent', 2))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], API_RESPONSE_CACHE_TIMEOUT=0, MESSAGING_PROGRESS_BACKEND='memory')
+class ConditionalRetrieveTests(TestCase):
+    def setUp(self):
+        progress._store['pid'] = None
+        self.message = Message.objects.create(subject="Asunto", body_html="<p>Hola</p>", body_text="Hola")
+        self.url = f'/api/messages/{self.message.id}/'
+
+    def test_malformed_pk_is_404(self):
+        self.assertEqual(self.client.get('/api/messages/abc/').status_code, 404)
+        self.assertEqual(self.client.get('/api/subscribers/abc/').status_code, 404)
+
+    def test_unchanged_message_is_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_sending_message_is_versioned_by_progress_counters(self):
+        Message.objects.filter(pk=self.message.pk).update(status='sending')
+        progress.reset(self.message.id)
+        progress.set_queued(self.message.id, {'email': 2})
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        progress.record(self.message.id, 'email', sent=1) # Un lote registrado cambia la versión
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_sending_message_without_counters_is_not_conditional(self):
+        Message.objects.filter(pk=self.message.pk).update(status='sending')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class UnsubscribeTests(TestCase):
+    def setUp(self):
+        self.subscriber = Subscriber.objects.create(email="ana@example.com", subscribed_to_email=True, subscribed_to_sms=True)
+        self.url = '/api/subscribers/unsubscribe/?token=' + personalization.unsubscribe_token(self.subscriber.id)
+
+    def test_token_round_trip(self):
+        token = personalization.unsubscribe_token(self.subscriber.id)
+        self.assertEqual(personalization.subscriber_from_token(token), self.subscriber.id)
+        with self.assertRaises(signing.BadSignature):
+            personalization.subscriber_from_token(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+
+    def test_get_does_not_unsubscribe(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.subscriber.refresh_from_db()
+        self.assertTrue(self.subscriber.subscribed_to_email)
+
+    def test_one_click_post_unsubscribes(self):
+        response = self.client.post(self.url, {'List-Unsubscribe': 'One-Click'})
+        self.assertEqual(response.status_code, 200)
+        self.subscriber.refresh_from_db()
+        self.assertFalse(self.subscriber.subscribed_to_email or self.subscriber.subscribed_to_sms)
+
+    def test_invalid_token_is_rejected(self):
+        self.assertEqual(self.client.post('/api/subscribers/unsubscribe/?token=1:bad').status_code, 400)
+
+
+@override_settings(
+    MESSAGING_CIRCUIT_BREAKER_BACKEND='memory', MESSAGING_RATE_LIMIT_BACKEND='off', MESSAGING_METRICS_ENABLED=False,
+    GMAIL_SENDER_EMAIL='news@example.com', GMAIL_BATCH_SIZE=50,
+)
+class GmailHalfOpenProbeTests(SimpleTestCase):
+    emails = [f"user{i}@example.com" for i in range(5)]
+
+    def setUp(self):
+        circuitbreaker._backend['pid'] = None # Circuitos nuevos en cada test
+        store, _ = circuitbreaker._get_stores()
+        store._circuits[circuitbreaker._key('gmail', 'news@example.com')] = {'state': circuitbreaker.OPEN, 'open_until': 0, 'opens': 1}
+
+    def send(self, service):
+        with fake_gmail_service(service):
+            return services.send_email_batch(self.emails, "Asunto", "<p>Hola</p>", "Hola")
+
+    def test_probe_is_one_email_then_the_rest(self):
+        service = FakeGmailService(latency=0)
+        results = self.send(service)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(service.request_count, 2)
+        self.assertEqual(circuitbreaker.check('gmail', 'news@example.com'), (circuitbreaker.CLOSED, 0.0))
+
+    def test_failed_probe_defers_the_rest(self):
+        service = FakeGmailService(latency=0, error_rate=1.0)
+        results = self.send(service)
+        self.assertEqual(service.message_count, 1)
+        self.assertIsInstance(results[0].error, services.TransientSendError)
+        self.assertTrue(all(isinstance(result.error, services.CircuitOpenError) for result in results[1:]))
+
+    def test_probe_failing_locally_is_released(self):
+        build = services._build_raw_email
+
+        def build_raw_email(to_email, *args):
+            if to_email == self.emails[0]:
+                raise UnicodeError("bad header")
+            return build(to_email, *args)
+
+        service = FakeGmailService(latency=0)
+        with mock.patch.object(services, '_build_raw_email', side_effect=build_raw_email):
+            results = self.send(service)
+        self.assertFalse(results[0].ok)
+        self.assertTrue(all(result.ok for result in results[1:])) # El siguiente correo hizo de prueba
+        self.assertEqual(service.request_count, 2)
+
+
+def _http_error(status, content=b'', headers=None):
+    return HttpError(httplib2.Response({'status': status, **(headers or {})}), content)
+
+
+class ErrorClassificationTests(SimpleTestCase):
+    def test_gmail_errors(self):
+        throttled = services._gmail_error(_http_error(429, headers={'retry-after': '30'}))
+        self.assertIsInstance(throttled, services.TransientSendError)
+        self.assertEqual(throttled.retry_after, 30.0)
+        self.assertIsInstance(services._gmail_error(_http_error(503)), services.TransientSendError)
+        self.assertIsInstance(services._gmail_error(_http_error(403, b'userRateLimitExceeded')), services.TransientSendError)
+        self.assertIsInstance(services._gmail_error(_http_error(403, b'forbidden')), services.PermanentSendError)
+        self.assertIsInstance(services._gmail_error(_http_error(400, b'invalidArgument')), services.PermanentSendError)
+        self.assertIsInstance(services._gmail_error(ConnectionResetError()), services.TransientSendError)
+
+    def test_twilio_errors(self):
+        def error(status, code=None):
+            return services._twilio_error(TwilioRestException(status, '/Messages.json', "error", code=code))
+
+        self.assertIsInstance(error(400, 21211), services.PermanentSendError) # Número inválido
+        self.assertIsInstance(error(400, 21610), services.PermanentSendError) # Destinatario dado de baja (STOP)
+        self.assertIsInstance(error(429, 20429), services.TransientSendError)
+        self.assertIsInstance(error(503), services.TransientSendError)
+
+    def test_retry_after_header(self):
+        self.assertEqual(services._parse_retry_after('12'), 12.0)
+        self.assertIsNone(services._parse_retry_after('soon'))
+        future = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+        self.assertAlmostEqual(services._parse_retry_after(email.utils.format_datetime(future)), 60, delta=2)
+
+
+@override_settings(MESSAGING_RETRY_BACKOFF_BASE=30, MESSAGING_RETRY_BACKOFF_MAX=900)
+class RetryCountdownTests(SimpleTestCase):
+    def test_exponential_backoff_with_equal_jitter(self):
+        for retries, cap in ((0, 30), (2, 120), (10, 900)):
+            for _ in range(20):
+                self.assertTrue(cap / 2 <= tasks._retry_countdown(retries) <= cap)
+
+    def test_retry_after_is_respected(self):
+        countdown = tasks._retry_countdown(0, services.TransientSendError("429", retry_after=100))
+        self.assertTrue(100 <= countdown <= 110)
+
+    def test_rate_limit_deferral_waits_exactly(self):
+        self.assertEqual(tasks._deferral_countdown(3, ratelimit.RateLimitTimeout("throttled", retry_after=7.5)), 7.5)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate('2.5/50'), (2.5, 50.0))
+        self.assertEqual(ratelimit.parse_rate('10'), (10.0, 10.0))
+        self.assertIsNone(ratelimit.parse_rate('off'))
+
+    def test_burst_then_wait(self):
+        bucket = ratelimit.MemoryTokenBucket()
+        self.assertEqual(bucket.reserve('k', 10, 5, 5, 1), 0.0)
+        self.assertAlmostEqual(bucket.reserve('k', 10, 5, 2, 1), 0.2, places=2)
+
+    def test_wait_over_max_does_not_consume(self):
+        bucket = ratelimit.MemoryTokenBucket()
+        self.assertAlmostEqual(bucket.reserve('k', 1, 5, 10, 1), 5, places=2)
+        self.assertEqual(bucket.reserve('k', 1, 5, 5, 1), 0.0) # Los tokens siguen ahí
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    key = 'messaging:circuit:twilio:test'
+
+    def setUp(self):
+        self.store = circuitbreaker.MemoryCircuitStore()
+
+    def record(self, ok):
+        return self.store.record(self.key, ok, threshold=3, window=60, open_seconds=10, open_max=25)
+
+    def expire(self):
+        data = self.store._circuits[self.key]
+        data['open_until'] = data['probe_until'] = 0
+
+    def test_opens_after_threshold(self):
+        self.assertEqual([self.record(False) for _ in range(3)], ['', '', circuitbreaker.OPEN])
+        state, wait = self.store.check(self.key, 30)
+        self.assertEqual(state, circuitbreaker.OPEN)
+        self.assertAlmostEqual(wait, 10, places=0)
+
+    def test_success_resets_failures(self):
+        self.record(False)
+        self.assertEqual(self.store.check(self.key, 30)[0], circuitbreaker.FAILING)
+        self.assertEqual(self.record(True), '')
+        self.assertEqual(self.store.check(self.key, 30)[0], circuitbreaker.CLOSED)
+
+    def test_single_probe_when_half_open(self):
+        for _ in range(3):
+            self.record(False)
+        self.expire()
+        self.assertEqual(self.store.check(self.key, 30)[0], circuitbreaker.PROBE)
+        self.assertEqual(self.store.check(self.key, 30)[0], circuitbreaker.HALF_OPEN)
+        self.assertEqual(self.record(True), circuitbreaker.CLOSED)
+        self.assertEqual(self.store.check(self.key, 30)[0], circuitbreaker.CLOSED)
+
+    def test_failed_probe_reopens_for_longer(self):
+        for _ in range(3):
+            self.record(False)
+        self.expire()
+        self.store.check(self.key, 30)
+        self.assertEqual(self.record(False), circuitbreaker.OPEN)
+        self.assertAlmostEqual(self.store.check(self.key, 30)[1], 20, places=0)
+        self.expire()
+        self.store.check(self.key, 30)
+        self.record(False)
+        self.assertAlmostEqual(self.store.check(self.key, 30)[1], 25, places=0) # MESSAGING_CIRCUIT_OPEN_MAX
+
+    def test_released_probe_is_granted_again(self):
+        for _ in range(3):
+            self.record(False)
+        self.expire()
+        self.store.check(self.key, 30)
+        self.store.release(self.key)
+        self.assertEqual(self.store.check(self.key, 30)[0], circuitbreaker.PROBE)
+
+
+class KeysetCursorTests(SimpleTestCase):
+    def paginator(self, query=''):
+        paginator = pagination.KeysetPagination()
+        paginator.base_url = 'http://testserver/api/messages/'
+        return paginator, Request(APIRequestFactory().get('/api/messages/' + query))
+
+    def test_cursor_round_trip(self):
+        paginator, _ = self.paginator()
+        created_at = datetime.datetime(2026, 1, 2, 3, 4, 5, 678000, tzinfo=datetime.timezone.utc)
+        for reverse in (False, True):
+            link = paginator.encode_cursor(Message(pk=42, created_at=created_at), reverse=reverse)
+            _, request = self.paginator('?' + link.split('?', 1)[1])
+            self.assertEqual(paginator.decode_cursor(request), ((created_at, 42), reverse))
+
+    def test_invalid_cursor_is_404(self):
+        paginator, request = self.paginator('?cursor=not-a-cursor')
+        with self.assertRaises(NotFound):
+            paginator.decode_cursor(request)
+
+
+class MimeTemplateTests(SimpleTestCase):
+    def test_to_header_keeps_base64_aligned(self):
+        template = services._MimeTemplate("news@example.com", "Asunto", "<p>Hola</p>", "Hola")
+        for to_email in ("a@b.co", "ab@b.co", "abc@b.co", "Ana Pérez <ana@example.com>"):
+            header = services._MimeTemplate._to_header(to_email)
+            self.assertEqual(len(header) % 3, 0)
+            parsed = email.message_from_bytes(base64.urlsafe_b64decode(template.render(to_email)), policy=email.policy.default)
+            built = email.message_from_bytes(
+                services._render_mime("news@example.com", "Asunto", "<p>Hola</p>", "Hola", to_email), policy=email.policy.default,
+            )
+            self.assertEqual(parsed['to'], built['to'])
+            self.assertEqual(parsed.get_body(('plain',)).get_content(), "Hola")
+
+
+class ImportValidationTests(SimpleTestCase):
+    def test_rows(self):
+        records, rejected = importing._validate_batch([
+            (2, {'email': ' ana@example.com ', 'subscribed_to_email': 'sí', 'phone_number': ''}),
+            (3, {'email': 'not-an-email'}),
+            (4, {'email': 'b@example.com', 'is_active': 'maybe'}),
+            (5, {'subscribed_to_email': 'yes'}),
+            (6, {'email': 'c@example.com', 'subscribed_to_sms': '1'}),
+            (7, ['not', 'an', 'object']),
+        ])
+        self.assertEqual(records, [(2, {'email': 'ana@example.com', 'subscribed_to_email': True})])
+        self.assertEqual([(line, error) for line, _, error in rejected], [
+            (3, "Invalid email address."),
+            (4, "Invalid boolean value for is_active."),
+            (5, "Row has no contact method (email, phone_number or whatsapp_number)."),
+            (6, "phone_number is required for subscribed_to_sms."),
+            (7, "Invalid JSON object."),
+        ])
+
+
+class SubscriberImportTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name, MESSAGING_IMPORT_BATCH_SIZE=500))
+
+    def test_repeated_email_in_a_batch_is_merged(self):
+        content = (
+            "email,phone_number,subscribed_to_email,subscribed_to_sms\n"
+            "ana@example.com,+15551230000,yes,yes\n"
+            "bob@example.com,,yes,\n"
+            "ana@example.com,,no,\n"
+        )
+        job = SubscriberImport.objects.create(file=ContentFile(content.encode(), name='subscribers.csv'), format='csv')
+        importing.run_import(job.id)
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.processed_rows, job.imported_rows, job.duplicate_rows, job.failed_rows), ('done', 3, 2, 1, 0),
+        )
+        ana = Subscriber.objects.get(email="ana@example.com")
+        # La fila posterior gana en los campos que trae; los demás se conservan
+        self.assertEqual((ana.phone_number, ana.subscribed_to_email, ana.subscribed_to_sms), ("+15551230000", False, True))
+        self.assertEqual(Subscriber.objects.count(), 2)
 
-# Create your tests here.
@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SubscriberViewSet, MessageViewSet
+from .views import SubscriberViewSet, SubscriberImportViewSet, MessageViewSet
 
 router = DefaultRouter()
 router.register(r'subscribers', SubscriberViewSet)
+router.register(r'subscriber-imports', SubscriberImportViewSet)
 router.register(r'messages', MessageViewSet)
 
 urlpatterns = [
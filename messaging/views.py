@@ -1,30 +1,258 @@
+import csv
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+from itertools import chain
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from redis.exceptions import RedisError
 from django.utils.translation import gettext_lazy as _
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from . import metrics, progress
+from .filters import MessageFilterBackend, SubscriberFilterBackend
+from .importing import guess_format
+from .models import Subscriber, SubscriberImport, Message
+from .personalization import subscriber_from_token
+from .response_cache import cache_response, get_cached_response, invalidate_response
+from .serializers import (
+    MessageListSerializer, MessageSerializer, SubscriberImportSerializer, SubscriberSerializer, requested_fields,
+)
+from .tasks import import_subscribers, queue_message_sending
+
+# Filas leídas por viaje a la base de datos durante una exportación (cursor del servidor en PostgreSQL)
+EXPORT_CHUNK_SIZE = 2000
+
 
-from .models import Subscriber, Message
-from .serializers import SubscriberSerializer, MessageSerializer
-from .tasks import queue_message_sending
+class _Echo:
+    """Pseudo-buffer para csv.writer: devuelve cada línea en lugar de guardarla."""
+    def write(self, value):
+        return value
 
-class SubscriberViewSet(viewsets.ModelViewSet):
+
+class SparseFieldsetViewMixin:
+    """
+    Carga solo las columnas que usa el serializador de la petición (`only()`), de modo que
+    los campos que no se devuelven, por listado compacto o por `?fields=`, no se leen de la
+    base de datos. `id` y `created_at` se cargan siempre (paginación por cursor).
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        columns = set()
+        for field in self.get_serializer().fields.values():
+            source = field.source.split('.')[0]
+            if source.startswith('get_') and source.endswith('_display'): # status_display -> status
+                source = source[len('get_'):-len('_display')]
+            if source in concrete:
+                columns.add(source)
+        return queryset.only('id', 'created_at', *columns)
+
+
+class ConditionalRetrieveMixin:
+    """
+    Detalle con GET condicional. La versión del objeto (`updated_at` y lo que añada
+    `get_version_extra`) se lee con una consulta mínima por clave primaria; si coincide con
+    el If-None-Match / If-Modified-Since del cliente se responde 304 sin cargar ni serializar
+    el objeto. Con API_RESPONSE_CACHE_TIMEOUT > 0 la representación completa se sirve desde
+    la caché mientras la versión no cambie.
+    """
+    version_fields = ('updated_at',)
+
+    def get_version_extra(self, version):
+        """Parte de la versión que no refleja `updated_at` ('' si no hay), o None si no es cacheable."""
+        return ''
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            version = queryset.filter(pk=pk).values_list(*self.version_fields).first()
+        except (ValueError, TypeError, ValidationError): # Clave mal formada (p. ej. /messages/abc/)
+            raise Http404
+        if version is None:
+            raise Http404
+        extra = self.get_version_extra(version)
+        if extra is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        updated_at = version[0]
+        requested = requested_fields(request)
+        fields = ','.join(sorted(requested)) if requested else ''
+        etag = quote_etag(hashlib.md5(f"{pk}:{updated_at.isoformat()}:{extra}:{fields}".encode()).hexdigest())
+        # Si la versión depende de algo más que updated_at, Last-Modified no sería fiable
+        last_modified = int(updated_at.timestamp()) if not extra else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            data = get_cached_response(self.queryset.model, pk, etag) if not fields else None
+            if data is not None:
+                response = Response(data)
+            else:
+                response = super().retrieve(request, *args, **kwargs)
+                if not fields:
+                    cache_response(self.queryset.model, pk, etag, response.data)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache' # Revalidar siempre con el ETag
+        return response
+
+
+class SubscriberViewSet(ConditionalRetrieveMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     """
     API endpoint para ver y editar suscriptores.
     """
     queryset = Subscriber.objects.all().order_by('-created_at')
     serializer_class = SubscriberSerializer
+    filter_backends = [SubscriberFilterBackend]
     # permission_classes = [permissions.IsAuthenticated] # Ajusta permisos según necesites
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Exporta los suscriptores filtrados (mismos parámetros que el listado) como CSV
+        o NDJSON según `export_format`. Las filas se leen por bloques con un cursor del
+        servidor y se escriben a la respuesta a medida que llegan: memoria constante.
+        """
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            return Response({"export_format": _("Format must be 'csv' or 'ndjson'.")}, status=status.HTTP_400_BAD_REQUEST)
+
+        columns = SubscriberSerializer.Meta.fields
+        rows = self.filter_queryset(Subscriber.objects.all()).order_by('id').values_list(*columns).iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        )
+
+        def _cells(row):
+            return [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+
+        if export_format == 'csv':
+            writer = csv.writer(_Echo())
+            content = chain([writer.writerow(columns)], (writer.writerow(_cells(row)) for row in rows))
+            content_type = 'text/csv'
+        else:
+            content = (json.dumps(dict(zip(columns, _cells(row))), ensure_ascii=False) + '\n' for row in rows)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="subscribers.{export_format}"'
+        return response
 
-class MessageViewSet(viewsets.ModelViewSet):
+    # Enlace de baja de los mensajes ({{ unsubscribe_url }}): el token firmado identifica al suscriptor.
+    # GET solo confirma (los escáneres de enlaces de los clientes de correo lo visitan); la baja se hace
+    # con POST, que es también la petición "one-click" de List-Unsubscribe-Post (RFC 8058).
+    @action(detail=False, methods=['get', 'post'])
+    def unsubscribe(self, request):
+        """Da de baja de todos los canales al suscriptor del `token` firmado (solo con POST)."""
+        token = request.query_params.get('token') or request.data.get('token') or ''
+        try:
+            subscriber_id = subscriber_from_token(token)
+        except (signing.BadSignature, ValueError):
+            return Response({"token": _("Invalid unsubscribe token.")}, status=status.HTTP_400_BAD_REQUEST)
+        subscribers = Subscriber.objects.filter(pk=subscriber_id)
+        if request.method == 'GET':
+            if not subscribers.exists():
+                raise Http404
+            return Response({"detail": _("Send a POST request to this URL to unsubscribe from all channels.")})
+        updated = subscribers.update(
+            subscribed_to_email=False, subscribed_to_sms=False, subscribed_to_whatsapp=False,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            raise Http404
+        invalidate_response(Subscriber, subscriber_id)
+        return Response({"detail": _("You have been unsubscribed.")})
+
+    # Importación masiva: el fichero se guarda tal cual y se procesa en segundo plano
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Recibe un fichero CSV o NDJSON en el campo `file` (formato opcional en `format`,
+        si no se deduce de la extensión) y encola su importación. Devuelve la importación
+        creada; su progreso se consulta en /api/subscriber-imports/{id}/.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"file": _("No file was submitted.")}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('format') or guess_format(upload.name)
+        if file_format not in dict(SubscriberImport.FORMAT_CHOICES):
+            return Response({"format": _("Format must be 'csv' or 'ndjson'.")}, status=status.HTTP_400_BAD_REQUEST)
+
+        subscriber_import = SubscriberImport.objects.create(file=upload, format=file_format)
+        import_subscribers.delay(subscriber_import.id)
+        serializer = SubscriberImportSerializer(subscriber_import, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class SubscriberImportViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint para consultar el progreso de las importaciones masivas de suscriptores.
+    """
+    queryset = SubscriberImport.objects.all().order_by('-created_at')
+    serializer_class = SubscriberImportSerializer
+
+    @action(detail=True, methods=['get'])
+    def errors(self, request, pk=None):
+        """Descarga el CSV con las filas rechazadas (línea, error, contenido original)."""
+        subscriber_import = self.get_object()
+        if not subscriber_import.error_file:
+            return Response({"detail": _("This import has no rejected rows.")}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            subscriber_import.error_file.open('rb'), as_attachment=True,
+            filename=f"subscriber_import_{subscriber_import.pk}_errors.csv", content_type='text/csv',
+        )
+
+
+class MessageViewSet(ConditionalRetrieveMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     """
     API endpoint para ver mensajes y opcionalmente encolarlos para envío.
     La creación/edición principal se asume vía Admin.
     """
     queryset = Message.objects.all().order_by('-created_at')
     serializer_class = MessageSerializer
+    filter_backends = [MessageFilterBackend]
     # permission_classes = [permissions.IsAdminUser] # Restringir acceso si es necesario
 
+    version_fields = ('updated_at', 'status', 'id', 'dispatch_checkpoint')
+
+    def get_version_extra(self, version):
+        # Durante el envío el informe de entregas cambia sin tocar updated_at. La versión se
+        # completa con el checkpoint del fan-out (avanza con cada lote publicado) y con los
+        # contadores de progreso (una lectura de hash en Redis, cambian con cada lote
+        # registrado). El reparto queued/sending de los lotes en curso no mueve ningún
+        # contador y puede ir un lote por detrás. Sin contadores no hay GET condicional.
+        _updated_at, message_status, message_id, checkpoint = version
+        if message_status != 'sending':
+            return ''
+        try:
+            counts = progress.get(message_id)
+        except RedisError:
+            return None
+        if counts is None:
+            return None
+        channels = sorted((channel, sorted(values.items())) for channel, values in counts['channels'].items())
+        return json.dumps([checkpoint, counts['total'], counts['done'], channels], sort_keys=True, separators=(',', ':'))
+
+    def get_serializer_class(self):
+        # El listado usa la representación compacta; la completa solo en el detalle
+        if self.action == 'list':
+            return MessageListSerializer
+        return MessageSerializer
+
     # Sobrescribir métodos si solo queremos lectura y acción de envío
     http_method_names = ['get', 'post', 'head', 'options', 'patch', 'delete'] # Permitir GET, POST (para acción), HEAD, OPTIONS
 
@@ -39,17 +267,62 @@ class MessageViewSet(viewsets.ModelViewSet):
         except Message.DoesNotExist:
              return Response({"detail": _("Message not found.")}, status=status.HTTP_404_NOT_FOUND)
 
-        if message.status in ['draft', 'failed']:
+        if message.status in ['draft', 'failed'] and message.scheduled_at and message.scheduled_at > timezone.now():
+            message.status = 'scheduled' # Lo encolará dispatch_scheduled_messages a su hora
+            message.save(update_fields=['status', 'updated_at'])
+            serializer = self.get_serializer(message)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        elif message.status in ['draft', 'failed']:
             message.status = 'queued'
             message.save(update_fields=['status', 'updated_at'])
             queue_message_sending.delay(message.id)
             serializer = self.get_serializer(message) # Devolver el mensaje actualizado
             return Response(serializer.data, status=status.HTTP_202_ACCEPTED) # 202 Accepted
-        elif message.status in ['queued', 'sending']:
-             return Response({"detail": _("Message is already queued or sending.")}, status=status.HTTP_409_CONFLICT) # 409 Conflict
+        elif message.status in ['scheduled', 'queued', 'sending']:
+             return Response({"detail": _("Message is already scheduled, queued or sending.")}, status=status.HTTP_409_CONFLICT) # 409 Conflict
         else: # 'sent'
             return Response({"detail": _("Message has already been sent.")}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """
+        Progreso en vivo de una campaña a partir de los contadores de progreso (sin recorrer
+        Delivery): recuentos por canal, resultados por segundo y tiempo estimado restante.
+        Pensado para que un panel lo consulte cada segundo durante el envío.
+        """
+        try:
+            message_id = int(pk)
+        except ValueError:
+            raise Http404
+        row = Message.objects.filter(pk=message_id).values_list('status', 'dispatch_checkpoint').first()
+        if row is None:
+            raise Http404
+        message_status, checkpoint = row
+        try:
+            counts = progress.get(message_id)
+        except RedisError:
+            return Response({"detail": _("Progress counters are unavailable.")}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        counts = counts or {'total': None, 'done': 0, 'queued_at': None, 'channels': {}}
+
+        total, done = counts['total'], counts['done']
+        rate = eta = None
+        if message_status == 'sending':
+            rate = progress.send_rate(message_id, done, counts['queued_at'])
+            if rate and total is not None:
+                eta = max(total - done, 0) / rate
+        started_at = counts['queued_at']
+        return Response({
+            'id': message_id,
+            'status': message_status,
+            'dispatching': checkpoint is not None, # Fan-out en curso: `total` aún no se conoce
+            'started_at': datetime.fromtimestamp(started_at, tz=dt_timezone.utc) if started_at else None,
+            'total': total,
+            'done': done,
+            'channels': counts['channels'],
+            'rate': rate,
+            'eta_seconds': eta,
+        })
+
     # Deshabilitar creación directa vía API si se maneja solo por Admin
     # def perform_create(self, serializer):
     #     # Podrías permitirlo, pero asegúrate que el estado inicial sea 'draft'
@@ -64,4 +337,11 @@ class MessageViewSet(viewsets.ModelViewSet):
 
     # Deshabilitar borrado vía API si se maneja solo por Admin
     # def perform_destroy(self, instance):
-    #     raise MethodNotAllowed("DELETE")
\ No newline at end of file
+    #     raise MethodNotAllowed("DELETE")
+
+
+def metrics_view(request):
+    """Métricas de envío en formato Prometheus, agregadas de todos los procesos si PROMETHEUS_MULTIPROC_DIR está definido."""
+    if not settings.MESSAGING_METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics.render_latest(), content_type=CONTENT_TYPE_LATEST)
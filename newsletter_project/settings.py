@@ -96,6 +96,10 @@ USE_TZ = True
 STATIC_URL = 'static/'
 # STATIC_ROOT = BASE_DIR / 'staticfiles' # Descomentar y configurar para producción
 
+# Ficheros subidos (importaciones de suscriptores). Web y workers de Celery deben compartir este almacenamiento.
+MEDIA_URL = 'media/'
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -109,26 +113,119 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Número de suscriptores por tarea de envío por lotes (fan-out de queue_message_sending)
+MESSAGING_SEND_CHUNK_SIZE = int(os.getenv('MESSAGING_SEND_CHUNK_SIZE', '100'))
+# Filas de suscriptores leídas por consulta al recorrer la audiencia (paginación por clave)
+MESSAGING_AUDIENCE_PAGE_SIZE = int(os.getenv('MESSAGING_AUDIENCE_PAGE_SIZE', '2000'))
+
+# Limitador de tasa por canal y cuenta emisora ('tasa/ráfaga' en envíos por segundo; '0' lo desactiva).
+# Backend: 'redis' (compartido por el clúster), 'memory' (por proceso, para tests) u 'off'.
+MESSAGING_RATE_LIMIT_BACKEND = os.getenv('MESSAGING_RATE_LIMIT_BACKEND', 'redis')
+MESSAGING_RATE_LIMIT_REDIS_URL = os.getenv('MESSAGING_RATE_LIMIT_REDIS_URL', CELERY_BROKER_URL)
+MESSAGING_RATE_LIMITS = {
+    'email': os.getenv('MESSAGING_RATE_LIMIT_EMAIL', '2.5/50'), # Gmail: 250 unidades/s por usuario, send = 100
+    'sms': os.getenv('MESSAGING_RATE_LIMIT_SMS', '30/30'),
+    'whatsapp': os.getenv('MESSAGING_RATE_LIMIT_WHATSAPP', '30/30'),
+}
+MESSAGING_RATE_LIMIT_MAX_WAIT = float(os.getenv('MESSAGING_RATE_LIMIT_MAX_WAIT', '60')) # Más espera => aplazar la tarea (sin contar como intento)
+
+# Reintentos de las tareas de envío ante errores temporales: backoff exponencial con jitter
+# (segundos) salvo que el proveedor indique Retry-After. Los errores permanentes no se reintentan.
+MESSAGING_RETRY_BACKOFF_BASE = float(os.getenv('MESSAGING_RETRY_BACKOFF_BASE', '30'))
+MESSAGING_RETRY_BACKOFF_MAX = float(os.getenv('MESSAGING_RETRY_BACKOFF_MAX', '900'))
+
+# Circuit breaker por proveedor y cuenta emisora: tras FAILURE_THRESHOLD fallos en FAILURE_WINDOW
+# segundos los envíos se aplazan sin llamar a la API durante OPEN_SECONDS (duplicándose hasta
+# OPEN_MAX) y después una petición de prueba decide si se reanudan.
+# Backend: 'redis' (compartido por el clúster), 'memory' (por proceso, para tests) u 'off'.
+MESSAGING_CIRCUIT_BREAKER_BACKEND = os.getenv('MESSAGING_CIRCUIT_BREAKER_BACKEND', 'redis')
+MESSAGING_CIRCUIT_BREAKER_REDIS_URL = os.getenv('MESSAGING_CIRCUIT_BREAKER_REDIS_URL', CELERY_BROKER_URL)
+MESSAGING_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('MESSAGING_CIRCUIT_FAILURE_THRESHOLD', '5'))
+MESSAGING_CIRCUIT_FAILURE_WINDOW = float(os.getenv('MESSAGING_CIRCUIT_FAILURE_WINDOW', '60'))
+MESSAGING_CIRCUIT_OPEN_SECONDS = float(os.getenv('MESSAGING_CIRCUIT_OPEN_SECONDS', '30'))
+MESSAGING_CIRCUIT_OPEN_MAX = float(os.getenv('MESSAGING_CIRCUIT_OPEN_MAX', '600'))
+MESSAGING_CIRCUIT_PROBE_TIMEOUT = float(os.getenv('MESSAGING_CIRCUIT_PROBE_TIMEOUT', '60')) # Sin resultado de la prueba => otra
+
+# Contadores de progreso por campaña ('redis' compartido por los workers, o 'memory' por proceso)
+MESSAGING_PROGRESS_BACKEND = os.getenv('MESSAGING_PROGRESS_BACKEND', 'redis')
+MESSAGING_PROGRESS_REDIS_URL = os.getenv('MESSAGING_PROGRESS_REDIS_URL', CELERY_BROKER_URL)
+
+# Mensajes programados vencidos que se reclaman por consulta en cada ejecución del planificador
+MESSAGING_SCHEDULER_BATCH_SIZE = int(os.getenv('MESSAGING_SCHEDULER_BATCH_SIZE', '100'))
+
+# Importación masiva de suscriptores: filas validadas e insertadas por lote
+MESSAGING_IMPORT_BATCH_SIZE = int(os.getenv('MESSAGING_IMPORT_BATCH_SIZE', '2000'))
+
+# Métricas Prometheus en /metrics (con varios procesos, define también PROMETHEUS_MULTIPROC_DIR)
+MESSAGING_METRICS_ENABLED = os.getenv('MESSAGING_METRICS_ENABLED', 'True') == 'True'
+# Puerto en el que el worker de Celery sirve sus métricas (hosts sin proceso web; 0 = no servir)
+MESSAGING_METRICS_WORKER_PORT = int(os.getenv('MESSAGING_METRICS_WORKER_PORT', '0'))
+
+# URL pública del sitio para los enlaces de baja ({{ unsubscribe_url }}) de los mensajes
+MESSAGING_PUBLIC_BASE_URL = os.getenv('MESSAGING_PUBLIC_BASE_URL', 'http://localhost:8000')
+
+# Tareas periódicas (requiere `celery -A newsletter_project beat`)
+CELERY_BEAT_SCHEDULE = {
+    'finalize-sending-messages': {
+        'task': 'messaging.tasks.finalize_sending_messages',
+        'schedule': 60.0, # Respaldo por si se pierde el aviso de fin de campaña
+    },
+    'dispatch-scheduled-messages': {
+        'task': 'messaging.tasks.dispatch_scheduled_messages',
+        'schedule': 30.0, # Precisión de los envíos programados
+    },
+}
+# Caché LRU por worker de los mensajes en envío (entradas y tamaño máximo en caracteres)
+MESSAGE_SNAPSHOT_CACHE_SIZE = int(os.getenv('MESSAGE_SNAPSHOT_CACHE_SIZE', '32'))
+MESSAGE_SNAPSHOT_CACHE_MAX_BYTES = int(os.getenv('MESSAGE_SNAPSHOT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
 # --- REST Framework Configuration ---
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         # Ajusta según tus necesidades (ej. IsAuthenticatedOrReadOnly)
         'rest_framework.permissions.AllowAny',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    # Paginación por cursor sobre (created_at, id); el cliente puede pedir otro tamaño con ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'messaging.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', '10')),
 }
 
+# Caché de la representación de detalle de mensajes/suscriptores (segundos; 0 la desactiva).
+# Con API_RESPONSE_CACHE_URL (redis://...) la caché se comparte entre procesos.
+API_RESPONSE_CACHE_TIMEOUT = int(os.getenv('API_RESPONSE_CACHE_TIMEOUT', '0'))
+API_RESPONSE_CACHE_URL = os.getenv('API_RESPONSE_CACHE_URL')
+if API_RESPONSE_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': API_RESPONSE_CACHE_URL,
+        }
+    }
+
 # --- Custom Settings ---
 GMAIL_SENDER_EMAIL = os.getenv('GMAIL_SENDER_EMAIL')
 GMAIL_CREDENTIALS_FILE = os.getenv('GMAIL_CREDENTIALS_FILE')
 GMAIL_TOKEN_FILE = os.getenv('GMAIL_TOKEN_FILE', 'token.json') # Nombre por defecto para el token
 GMAIL_SCOPES = [os.getenv('GMAIL_SCOPES')] if os.getenv('GMAIL_SCOPES') else ['https://www.googleapis.com/auth/gmail.send']
+# Segundos antes de la expiración del access token en que se renueva en segundo plano
+GMAIL_TOKEN_REFRESH_MARGIN = int(os.getenv('GMAIL_TOKEN_REFRESH_MARGIN', '300'))
+# Envíos agrupados por petición HTTP batch de Gmail (máx. 100; Google recomienda <= 50)
+GMAIL_BATCH_SIZE = int(os.getenv('GMAIL_BATCH_SIZE', '50'))
 
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_SMS_NUMBER = os.getenv('TWILIO_SMS_NUMBER')
 TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER')
+# Pool de clientes Twilio por proceso worker (compartido por SMS y WhatsApp)
+TWILIO_CLIENT_POOL_SIZE = int(os.getenv('TWILIO_CLIENT_POOL_SIZE', '4')) # Usa >= --concurrency con --pool threads
+TWILIO_CLIENT_IDLE_TIMEOUT = float(os.getenv('TWILIO_CLIENT_IDLE_TIMEOUT', '60')) # Reciclar sesiones inactivas (s)
+TWILIO_POOL_ACQUIRE_TIMEOUT = float(os.getenv('TWILIO_POOL_ACQUIRE_TIMEOUT', '30'))
+TWILIO_HTTP_TIMEOUT = float(os.getenv('TWILIO_HTTP_TIMEOUT', '30'))
+# Envíos por lotes con el cliente asíncrono de Twilio (aiohttp) y límite de peticiones en vuelo
+TWILIO_ASYNC_SENDS = os.getenv('TWILIO_ASYNC_SENDS', 'True') == 'True'
+TWILIO_ASYNC_CONCURRENCY = int(os.getenv('TWILIO_ASYNC_CONCURRENCY', '200'))
+# Solo para pruebas/benchmarks: URL base alternativa de la API (p. ej. un servidor Twilio falso)
+TWILIO_API_BASE_URL = os.getenv('TWILIO_API_BASE_URL')
 
 # --- Logging ---
 # Configura el logging según sea necesario, especialmente para producción
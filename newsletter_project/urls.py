@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from messaging.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('messaging.urls')), # Incluir las URLs de la API de messaging
+    path('metrics', metrics_view, name='metrics'), # Métricas en formato Prometheus
     # Puedes agregar más rutas aquí si es necesario
 ]
\ No newline at end of file